@@ -1,350 +1,157 @@
 import datetime
-import queue
-import threading
-import time
-from db_helper import save_event, check_database
 from config import OFFLINE_MODE
-import plc_helper
+from event_writer import EventWriter
+from common_fault import CommonFaultAggregator
+from event_throttle import EventThrottle
+from alarm_rules import AlarmRuleEngine, DEFAULT_RULES
 
 
 class AlarmManager:
     """
-    Klasa AlarmManager obsługuje alarm defektów.
+    Klasa AlarmManager obsługuje alarmy linii.
 
-    Alarm defektów jest aktywowany, gdy jednocześnie przekroczone zostaną limity wybrzuszeń
-    oraz zagłębień w oknie. Przejście ze stanu nieaktywnego na aktywny (oraz odwrotnie)
-    rejestrowane jest w bazie danych za pomocą funkcji save_event, a zmiana stanu common fault
-    aktualizowana jest w PLC przy pomocy funkcji lamp_control.
+    Alarmy progowe (defekty, średnica, owalność, odchylenie standardowe) oceniane są wyłącznie
+    przez tabelę reguł (AlarmRuleEngine), alarm pulsacji – przez tory pików z PeakTracker.
+    Przejście ze stanu nieaktywnego na aktywny (oraz odwrotnie)
+    rejestrowane jest w bazie danych przez EventWriter (zapis partiami w tle), a zmiana stanu common fault
+    agregowana jest przez CommonFaultAggregator (zapis do PLC tylko na zboczach, kwitowanie).
     """
 
-    def __init__(self, db_params: dict, plc_client):
+    def __init__(self, db_params: dict, plc_client, save_to_db: bool = True, rules=DEFAULT_RULES):
         """
         Inicjalizuje AlarmManager.
         
         :param db_params: Parametry połączenia z bazą danych.
         :param plc_client: Połączenie z PLC, wykorzystywane do sterowania lampką.
+        :param save_to_db: Czy zapisywać zdarzenia w bazie (False np. przy odtwarzaniu nagrań).
+        :param rules: Tabela reguł alarmowych (AlarmRule) oceniana partiami przez check_and_update_rules.
         """
         self.db_params = db_params
         self.plc_client = plc_client
-        # Stan obecnego alarmu defektów (może być rozwinięte o stany alarmu średnicy i pulsacji)
+        self.save_to_db = save_to_db
+        # Funkcje wywoływane dla każdego zdarzenia (np. zapis raportu przy odtwarzaniu)
+        self.event_listeners = []
+        # Kopie stanów alarmów dla UI – ustawiane tylko przez reguły (state_attr) i tory pulsacji
         self.defects_alarm_active = False
         self.diameter_alarm_active = False
         self.active_pulsation_alarms = {}  
+        self.pulsation_alarm_active = False
+        self.ovality_alarm_active = False
+        self.std_dev_alarm_active = False
+        # Silnik reguł: wszystkie alarmy progowe w jednym przebiegu po partii próbek
+        self.rule_engine = AlarmRuleEngine(rules)
+        # Common fault: suma wszystkich alarmów, zapis do PLC tylko na zboczach
+        self.common_fault = CommonFaultAggregator(plc_client)
+
+        # Grupowanie migających alarmów i globalny limit liczby zdarzeń
+        self.event_throttle = EventThrottle()
+        # Zapis zdarzeń w tle: ścieżka alarmowa tylko wstawia do kolejki
+        self.event_writer = EventWriter(db_params) if (save_to_db and not OFFLINE_MODE) else None
 
-        self.db_event_queue = queue.Queue()
-        self.db_event_thread_running = True
-        self.db_event_thread = threading.Thread(target=self._process_db_events, daemon=True)
-        self.db_event_thread.start()
-
-    def _process_db_events(self):
-        """
-        Oddzielny wątek, który pobiera zdarzenia z kolejki i zapisuje je do bazy.
-        """
-        while self.db_event_thread_running:
-            try:
-                # Próba pobrania zdarzenia z kolejki (timeout 1 s, aby móc sprawdzić flagę wyłączenia)
-                event_data = self.db_event_queue.get(timeout=1)
-            except queue.Empty:
-                continue
-            start_time = time.perf_counter()
-            # Warunki: jeśli aplikacja nie działa w trybie offline oraz baza jest dostępna
-            if not (OFFLINE_MODE or not check_database(self.db_params)):
-                if not save_event(self.db_params, event_data):
-                    print(f"[AlarmManager] Błąd zapisu zdarzenia dla alarmu: {event_data.get('alarm_type')}")
-            elapsed = time.perf_counter() - start_time
-            # print(f"Zdarzenie zapisane w bazie danych w czasie: {elapsed:.3f} s")
-            self.db_event_queue.task_done()
-    
     def enqueue_event(self, event_data: dict):
         """
-        Umieszcza zdarzenie do zapisu w kolejce.
+        Umieszcza zdarzenie do zapisu w kolejce writera (nie blokuje).
         """
-        self.db_event_queue.put(event_data)
+        if self.event_writer is not None:
+            self.event_writer.enqueue(event_data)
 
-    def shutdown_db_event_thread(self):
+    def db_queue_depth(self) -> int:
         """
-        Zatrzymuje wątek zapisu zdarzeń.
+        Zwraca liczbę zdarzeń oczekujących na zapis w bazie.
         """
-        self.db_event_thread_running = False
-        self.db_event_thread.join(timeout=1)
-
-    def check_and_update_defects_alarm(
-        self,
-        lumps_in_window: int,
-        necks_in_window: int,
-        measurement_data: dict,
-        max_lumps: int,
-        max_necks: int
-    ) -> str:
-        """
-        Sprawdza, czy przekroczono limity defektów (wybrzuszeń i zagłębień).
-        Jeśli tak, ustawia/wyłącza alarm defektów. Zwraca "entered", "exited" lub "no_change".
-        """
-        # Warunek alarmu, gdy lumps>max_lumps ORAZ necks>max_necks (wg Twojej logiki)
-        new_state = (lumps_in_window > max_lumps) and (necks_in_window > max_necks)
-        old_state = self.defects_alarm_active
-
-        if new_state != old_state:
-            # Zmiana stanu
-            event_type = 0 if new_state else 1  # 0=wejście, 1=wyjście
-            alarm_type = "defects_alarm"
-            comment = "Wejście w alarm defektów" if new_state else "Zejście z alarmu defektów"
-
-            self._save_event(measurement_data, event_type, alarm_type, comment)
-            self._update_common_fault(new_state)
+        return self.event_writer.queue_depth() if self.event_writer is not None else 0
 
-            self.defects_alarm_active = new_state
-            return "entered" if new_state else "exited"
-        return "no_change"
-
-    def check_and_update_diameter_alarm(
-        self,
-        measurement_data: dict,
-        upper_tol: float,
-        lower_tol: float
-    ) -> str:
-        """
-        Sprawdza, czy którakolwiek z wartości D1, D2, D3, D4
-        jest poza zakresem [dAvg - lower_tol, dAvg + upper_tol].
+    def shutdown_db_event_thread(self):
         """
-        d1 = measurement_data.get("D1", 0.0)
-        d2 = measurement_data.get("D2", 0.0)
-        d3 = measurement_data.get("D3", 0.0)
-        d4 = measurement_data.get("D4", 0.0)
-        diameters = [d1, d2, d3, d4]
-        d_avg = sum(diameters) / 4.0
-
-        out_of_range = any(
-            (d < d_avg - lower_tol) or (d > d_avg + upper_tol)
-            for d in diameters
+        Zatrzymuje wątek zapisu zdarzeń (z próbą zapisania zaległych zdarzeń).
+        """
+        if self.event_writer is not None:
+            self.event_writer.stop()
+
+    def check_and_update_rules(self, features: dict, settings: dict, measurement_data: dict, n: int) -> list:
+        """
+        Ocenia całą tabelę reguł alarmowych dla partii n próbek (numpy, bez pętli po próbkach).
+        Każde przejście zapisywane jest jako zdarzenie z danymi próbki, na której nastąpiło,
+        a stany reguł przekazywane są jako źródła common fault.
+
+        :param features: Kolumny partii (D1-D4, xCoord, timestamp, window_lumps, window_necks, *_std).
+        :param settings: Migawka nastaw (max_lumps, upper_tol, max_ovality, ...).
+        :param measurement_data: Dane próbki bazowej (produkt, batch, statusword, ...).
+        :param n: Liczba próbek w partii.
+        :return: Lista (alarm_type, "entered" | "exited") w kolejności wystąpienia.
+        """
+        transitions = self.rule_engine.evaluate(features, settings, n)
+        changes = []
+        for i, rule, kind, value, threshold in transitions:
+            sample = dict(measurement_data)
+            for key in ("D1", "D2", "D3", "D4", "xCoord", "timestamp"):
+                if key in features:
+                    sample[key] = features[key][i]
+            entered = kind == "entered"
+            template = rule.enter_comment if entered else rule.exit_comment
+            comment = template.format(value=value, threshold=threshold)
+            self._save_event(sample, 0 if entered else 1, rule.alarm_type, comment)
+            if rule.state_attr:
+                setattr(self, rule.state_attr, entered)
+            changes.append((rule.alarm_type, kind))
+
+        for name, state in self.rule_engine.state.items():
+            self.common_fault.set_source(name, state)
+        return changes
+
+    def update_common_fault(self, measurement_data: dict) -> bool:
+        """
+        Jeden cykl common fault (raz na partię): suma stanów alarmów, kwitowanie
+        przez licznik ack_seq z UI i potwierdzenie w statusword (status_plc).
+
+        :param measurement_data: Dane próbki z kluczami status_plc, lamp_control i ack_seq (opcjonalnie).
+        :return: True, gdy common fault jest aktywny.
+        """
+        return self.common_fault.update(
+            status_word=measurement_data.get("status_plc"),
+            ack_seq=measurement_data.get("ack_seq"),
+            lamp_control=measurement_data.get("lamp_control")
         )
-        new_state = bool(out_of_range)
-        old_state = self.diameter_alarm_active
-
-        if new_state != old_state:
-            # Zmiana stanu alarmu
-            event_type = 0 if new_state else 1
-            alarm_type = "diameter_error"
-            comment = ("Wejście w alarm średnicy" if new_state
-                       else "Zejście z alarmu średnicy")
-
-            self._save_event(measurement_data, event_type, alarm_type, comment)
-            self._update_common_fault(new_state)
-
-            self.diameter_alarm_active = new_state
-            return "entered" if new_state else "exited"
-        return "no_change"
-
-    # def check_and_update_pulsation_alarm(self, measurement_data: dict, pulsation_threshold: float) -> str:
-    #     """
-    #     Sprawdza, ile pików (elementów) znajduje się w measurement_data pod kluczem 'pulsation_vals'
-    #     (przy czym same wartości amplitudy nie mają znaczenia, liczy się tylko ich liczba).
-    #     Jeśli liczba pików jest różna od poprzednio zarejestrowanej, loguje wejście/aktualizację alarmu,
-    #     lub zejście z alarmu, jeśli pików już nie ma.
-    #     Zwraca "changed", jeśli stan alarmu uległ zmianie, w przeciwnym razie "no_change".
-    #     """
-        
-    #     # Pobierz listę pików
-    #     current_pulsation_peaks = measurement_data.get("pulsation_vals", [])
-    #     peak_count = len(current_pulsation_peaks)
-
-    #     # Jeśli nie ma wcześniej śledzonej liczby, inicjujemy ją
-    #     if not hasattr(self, "active_pulsation_alarm_count"):
-    #         self.active_pulsation_alarm_count = 0
-
-    #     old_peak_count = self.active_pulsation_alarm_count
-
-    #     # Przy zmianie liczby wykrytych pików logujemy zdarzenie
-    #     if peak_count != old_peak_count:
-    #         if peak_count > 0 and old_peak_count == 0:
-    #             event_type = 0  # wejście w alarm
-    #             comment = f"Wejście alarmu pulsacji: {peak_count} peaków"
-    #         elif peak_count == 0 and old_peak_count > 0:
-    #             event_type = 1  # zejście z alarmu
-    #             comment = "Zejście z alarmu pulsacji"
-    #         else:
-    #             # Zmiana liczby pików (np. aktualizacja liczby alarmów)
-    #             event_type = 0
-    #             comment = f"Aktualizacja alarmu pulsacji: {peak_count} peaków"
 
-    #         self.active_pulsation_alarm_count = peak_count
-
-    #         # Aktualizujemy stan common fault – alarm aktywny, jeśli wykryto choć jeden pik
-    #         overall_active = (peak_count > 0)
-    #         self._update_common_fault(overall_active)
-
-    #         self._save_event(measurement_data, event_type, "pulsation_error", comment)
-    #         return "changed"
-
-    #     # Jeśli liczba pików się nie zmieniła, nadal ustawiamy stan common fault
-    #     overall_active = (peak_count > 0)
-    #     self._update_common_fault(overall_active)
-    #     return "no_change"
-
-    def check_and_update_pulsation_alarm(self, measurement_data: dict, pulsation_threshold: float) -> str:
-        """
-        Sprawdza, czy wykryto choć jedną pulsację (czyli czy lista 'pulsation_vals' zawiera jakiekolwiek elementy).
-        Jeśli tak, alarm jest aktywowany, w przeciwnym razie alarm zostaje wyłączony.
-        Zmiana stanu alarmu (wejście lub zejście) jest rejestrowana jako zdarzenie.
+    def check_and_update_pulsation_tracks(self, measurement_data: dict, transitions: list) -> str:
         """
-        # Pobierz listę pików
-        current_pulsation_peaks = measurement_data.get("pulsation_vals", [])
-        peak_count = len(current_pulsation_peaks)
-
-        # Ustalamy nowy stan – alarm jest aktywny, gdy wykryto choć jeden pik
-        new_state = peak_count > 0
-
-        # Inicjalizacja stanu alarmu, jeśli jeszcze nie istnieje
-        if not hasattr(self, "pulsation_alarm_active"):
-            self.pulsation_alarm_active = False
-
-        old_state = self.pulsation_alarm_active
-
-        if new_state != old_state:
-            event_type = 0 if new_state else 1  # 0 = wejście w alarm, 1 = zejście z alarmu
-            if new_state:
-                comment = "Wejście w alarm pulsacji: wykryto pulsację"
-            else:
-                comment = "Zejście z alarmu pulsacji: brak wykrytych pulsacji"
-
-            self._save_event(measurement_data, event_type, "pulsation_error", comment)
-            self._update_common_fault(new_state)
-            self.pulsation_alarm_active = new_state
-
-            return "entered" if new_state else "exited"
-
-        # Aktualizacja stanu common fault, nawet jeśli stan alarmu nie uległ zmianie
-        self._update_common_fault(new_state)
-        return "no_change"
+        Obsługuje alarmy pulsacji per pasmo częstotliwości na podstawie przejść
+        zwróconych przez PeakTracker (histereza i czas trwania liczone są w trackerze).
+        Każde wejście/zejście toru rejestrowane jest osobno, z częstotliwością w komentarzu.
 
-
-    def check_and_update_ovality_alarm(self, measurement_data: dict, max_ovality_threshold: float) -> str:
-        """
-        Sprawdza, czy mierzona owalność (obliczana jako (dMax - dMin)/dAvg*100)
-        jest mniejsza niż zadany próg max_ovality_threshold.
-        Jeśli tak, aktywowany zostaje alarm 'Wysoka owalność'.
-        """
-        d1 = measurement_data.get("D1", 0.0)
-        d2 = measurement_data.get("D2", 0.0)
-        d3 = measurement_data.get("D3", 0.0)
-        d4 = measurement_data.get("D4", 0.0)
-
-        diameters = [d1, d2, d3, d4]
-        davg = sum(diameters) / 4.0 if sum(diameters) != 0 else 0.0
-        dmin = min(diameters)
-        dmax = max(diameters)
-        ovality = ((dmax - dmin) / davg * 100) if davg != 0 else 0.0
-
-        new_state = (ovality < max_ovality_threshold)
-
-        if not hasattr(self, "ovality_alarm_active"):
-            self.ovality_alarm_active = False
-        old_state = self.ovality_alarm_active
-
-        if new_state != old_state:
-            event_type = 0 if new_state else 1  # 0 = wejście w alarm, 1 = zejście z alarmu
-            alarm_type = "ovality_high"
-            comment = "Wejście w alarm wysokiej owalności" if new_state else "Zejście z alarmu wysokiej owalności"
-            self._save_event(measurement_data, event_type, alarm_type, comment)
-            self._update_common_fault(new_state)
-            self.ovality_alarm_active = new_state
-            return "entered" if new_state else "exited"
-
-        return "no_change"
-
-
-    # def check_and_update_std_dev_alarm(self, measurement_data: dict, max_std_dev_threshold: float) -> dict:
-    #     """
-    #     Sprawdza osobno odchylenie standardowe dla każdej średnicy (D1, D2, D3, D4).
-    #     Jeśli wartość std dev dla danej średnicy przekracza max_std_dev_threshold,
-    #     alarm jest aktywowany, a odpowiednie zdarzenie rejestrowane w bazie danych.
-
-    #     Zwraca słownik, w którym kluczami są nazwy średnic,
-    #     a wartości to status zmiany alarmu: "entered", "exited" lub "no_change".
-    #     """
-    #     results = {}
-    #     diameters = ["D1", "D2", "D3", "D4"]
-
-    #     # Inicjalizacja stanu alarmów przy pierwszym użyciu
-    #     if not hasattr(self, "std_dev_alarm_states"):
-    #         self.std_dev_alarm_states = {d: False for d in diameters}
-
-    #     for d in diameters:
-    #         key = f"{d}_std"
-    #         std_value = measurement_data.get(key, 0.0)
-    #         new_state = (std_value > max_std_dev_threshold)
-    #         old_state = self.std_dev_alarm_states.get(d, False)
-
-    #         if new_state != old_state:
-    #             event_type = 0 if new_state else 1  # 0 = wejście w alarm, 1 = zejście
-    #             alarm_type = f"std_dev_high_{d}"
-    #             comment = (
-    #                 f"Wejście w alarm wysokiego odchylenia standardowego średnicy {d}"
-    #                 if new_state else
-    #                 f"Zejście z alarmu wysokiego odchylenia standardowego średnicy {d}"
-    #             )
-
-    #             self._save_event(measurement_data, event_type, alarm_type, comment)
-    #             self._update_common_fault(new_state)
-    #             self.std_dev_alarm_states[d] = new_state
-
-    #             results[d] = "entered" if new_state else "exited"
-    #         else:
-    #             results[d] = "no_change"
-
-    #     return results
-
-    def check_and_update_std_dev_alarm(self, measurement_data: dict, max_std_dev_threshold: float) -> str:
+        :param measurement_data: Bieżące dane pomiarowe (do zapisu zdarzenia).
+        :param transitions: Lista ("entered" | "exited", tor) z PeakTracker.update().
+        :return: "entered"/"exited" przy zmianie ogólnego stanu alarmu pulsacji, inaczej "no_change".
         """
-        Sprawdza odchylenie standardowe dla średnic D1, D2, D3 i D4.
-        Jeśli którakolwiek z wartości przekracza max_std_dev_threshold, alarm jest aktywowany.
-        Alarm schodzi wtedy, gdy wszystkie średnice mają odchylenie standardowe poniżej tego progu.
+        old_state = getattr(self, "pulsation_alarm_active", False)
 
-        Zwraca "entered", "exited" lub "no_change" w zależności od zmiany stanu alarmu.
-        """
-        diameters = ["D1", "D2", "D3", "D4"]
-        new_state = False
-        exceeded = []
-
-        for d in diameters:
-            key = f"{d}_std"
-            std_value = measurement_data.get(key, 0.0)
-            if std_value > max_std_dev_threshold:
-                new_state = True
-                exceeded.append(d)
-
-        if not hasattr(self, "std_dev_alarm_active"):
-            self.std_dev_alarm_active = False
-        old_state = self.std_dev_alarm_active
-
-        if new_state != old_state:
-            event_type = 0 if new_state else 1  # 0 = wejście w alarm, 1 = zejście z alarmu
-            alarm_type = "std_dev_high"
-
-            if new_state:
-                comment = (
-                    "Wejście w alarm wysokiego odchylenia standardowego dla średnic: "
-                    + ", ".join(exceeded)
-                )
+        for kind, track in transitions:
+            if kind == "entered":
+                self.active_pulsation_alarms[track["id"]] = track
+                comment = (f"Wejście w alarm pulsacji: {track['freq']:.2f} Hz, "
+                           f"amplituda {track['ewma']:.0f}")
+                self._save_event(measurement_data, 0, "pulsation_error", comment, track_id=track["id"])
             else:
-                comment = "Zejście z alarmu wysokiego odchylenia standardowego dla średnic"
-
-            self._save_event(measurement_data, event_type, alarm_type, comment)
-            self._update_common_fault(new_state)
-            self.std_dev_alarm_active = new_state
-
+                self.active_pulsation_alarms.pop(track["id"], None)
+                comment = (f"Zejście z alarmu pulsacji: {track['freq']:.2f} Hz, "
+                           f"czas trwania {track['duration']:.1f} s")
+                self._save_event(measurement_data, 1, "pulsation_error", comment, track_id=track["id"])
+
+        new_state = bool(self.active_pulsation_alarms)
+        self.pulsation_alarm_active = new_state
+        self.common_fault.set_source("pulsation_error", new_state)
+        if new_state != old_state:
             return "entered" if new_state else "exited"
-
         return "no_change"
 
-
-
     def _save_event(self, measurement_data: dict, event_type: int,
-                    alarm_type: str, comment: str):
+                    alarm_type: str, comment: str, track_id=None):
         """
-        Rejestruje zdarzenie w bazie danych.
+        Rejestruje zdarzenie: po przejściu przez EventThrottle powiadamia listenery
+        i przekazuje je do zapisu w tle.
+
+        :param track_id: Id toru pulsacji (pasma) – odrębny stan alarmu w EventThrottle.
         """
-        start_time = time.time()
         event_data = {
             "id_register_settings": measurement_data.get("id_register_settings"),
             "date_time": measurement_data.get("timestamp", datetime.datetime.now()),
@@ -362,29 +169,30 @@ class AlarmManager:
             "event_type": event_type,
             "comment": comment
         }
+        if track_id is not None:
+            event_data["track_id"] = track_id
 
-        if OFFLINE_MODE or not check_database(self.db_params):
-            return
-
-        if not save_event(self.db_params, event_data):
-            print(f"[AlarmManager] Błąd zapisu zdarzenia w bazie dla alarmu: {alarm_type}")
-
-        end_time = time.time()
-        # print(f"Zdarzenie zapisane w bazie danych w czasie: {end_time - start_time} s")
-
-
-    def _update_common_fault(self, is_active: bool):
-        try:
+        for event in self.event_throttle.submit(event_data):
+            self._record_event(event)
 
-            # if hasattr(self, 'last_common_fault_state') and self.last_common_fault_state == is_active:
-            #     return  
-            # self.last_common_fault_state = is_active  
+    def flush_events(self, measurement_data: dict):
+        """
+        Wysyła zdarzenia zbiorcze z EventThrottle (koniec migania alarmu, pominięte zdarzenia).
+        Wywoływane raz na cykl analizy.
+        """
+        timestamp = measurement_data.get("timestamp")
+        t = timestamp.timestamp() if isinstance(timestamp, datetime.datetime) else datetime.datetime.now().timestamp()
+        for event in self.event_throttle.flush(t):
+            self._record_event(event)
 
-            if self.plc_client:
-                if is_active:
-                    plc_helper.write_plc_data(self.plc_client, lamp_on=True, lamp_off=False)
-                else:
-                    plc_helper.write_plc_data(self.plc_client, lamp_on=False, lamp_off=True)
-        except Exception as e:
-            print("Błąd podczas aktualizacji common fault w PLC:", e)
+    def _record_event(self, event_data: dict):
+        """
+        Przekazuje zdarzenie do listenerów i do zapisu w tle.
+        """
+        for listener in self.event_listeners:
+            try:
+                listener(event_data)
+            except Exception as e:
+                print(f"[AlarmManager] Błąd obsługi zdarzenia przez listener: {e}")
 
+        self.enqueue_event(event_data)
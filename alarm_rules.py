@@ -0,0 +1,248 @@
+"""
+Alarm rules module for AccuScan application.
+Declarative alarm table evaluated over whole batches of samples with numpy:
+every rule is an expression over the batch features compared with a
+threshold from the settings snapshot, with hysteresis and a minimum dwell
+(in samples or metres) before a state change is accepted.
+"""
+
+import numpy as np
+
+from flaw_detection import hysteresis_state
+
+
+class AlarmRule:
+    """
+    One row of the alarm table.
+
+    The expression maps the batch features and the settings snapshot to one
+    value per sample (scalars are broadcast over the batch). The alarm is set
+    when the value crosses the threshold in the given direction and reset
+    only once it is back past the threshold by more than the hysteresis.
+    A new state is accepted only after it persisted for min_dwell (entering)
+    or min_off_dwell (leaving) samples or metres of line.
+    """
+
+    def __init__(self, alarm_type, expression, threshold=0.0, direction="above",
+                 hysteresis=0.0, min_dwell=1, min_off_dwell=None, dwell_unit="samples",
+                 enter_comment="", exit_comment="", state_attr=None):
+        """
+        Initialize the AlarmRule.
+
+        Args:
+            alarm_type: Alarm type stored with the event (e.g. "diameter_error")
+            expression: Callable (features, settings) -> value per sample
+            threshold: Constant, settings key or callable (settings) -> threshold
+            direction: "above" (alarm when value > threshold) or "below" (value < threshold)
+            hysteresis: Distance past the threshold required to reset the alarm
+                        (constant, settings key or callable, like threshold)
+            min_dwell: Persistence required to enter the alarm
+            min_off_dwell: Persistence required to leave the alarm (default: min_dwell)
+            dwell_unit: "samples" or "metres" (uses the xCoord feature)
+            enter_comment: Event comment on entering; str.format() receives value and threshold
+            exit_comment: Event comment on leaving
+            state_attr: AlarmManager attribute mirroring the state (e.g. "diameter_alarm_active")
+        """
+        if direction not in ("above", "below"):
+            raise ValueError(f"Unknown rule direction: {direction}")
+        if dwell_unit not in ("samples", "metres"):
+            raise ValueError(f"Unknown dwell unit: {dwell_unit}")
+        self.alarm_type = alarm_type
+        self.expression = expression
+        self.threshold = threshold
+        self.direction = direction
+        self.hysteresis = hysteresis
+        self.dwell_unit = dwell_unit
+        if dwell_unit == "samples":
+            self.min_dwell = max(int(min_dwell), 1)
+            self.min_off_dwell = self.min_dwell if min_off_dwell is None else max(int(min_off_dwell), 1)
+        else:
+            self.min_dwell = float(min_dwell)
+            self.min_off_dwell = self.min_dwell if min_off_dwell is None else float(min_off_dwell)
+        self.enter_comment = enter_comment
+        self.exit_comment = exit_comment
+        self.state_attr = state_attr
+
+    def resolve_threshold(self, settings):
+        """Return the threshold for the current settings snapshot."""
+        return _resolve(self.threshold, settings)
+
+    def resolve_hysteresis(self, settings):
+        """Return the hysteresis for the current settings snapshot."""
+        return _resolve(self.hysteresis, settings)
+
+
+def _resolve(parameter, settings):
+    """Wartość parametru reguły: stała, klucz nastaw lub funkcja nastaw."""
+    if callable(parameter):
+        return float(parameter(settings))
+    if isinstance(parameter, str):
+        return float(settings.get(parameter, 0.0) or 0.0)
+    return float(parameter)
+
+
+class AlarmRuleEngine:
+    """
+    Evaluates a table of AlarmRules over batches of samples.
+
+    Per rule the engine keeps only the latched state, the debounced state and
+    the length (or start position) of the current run, so a batch of any size costs a fixed number
+    of numpy operations per rule and no Python loop over samples.
+    """
+
+    def __init__(self, rules):
+        """
+        Initialize the AlarmRuleEngine.
+
+        Args:
+            rules: List of AlarmRule
+        """
+        self.rules = list(rules)
+        self.reset()
+
+    def reset(self):
+        """Clear the state of all rules (e.g. on a new batch/recipe)."""
+        self.raw_state = {rule.alarm_type: False for rule in self.rules}
+        self.state = {rule.alarm_type: False for rule in self.rules}
+        self.run_length = {rule.alarm_type: 0 for rule in self.rules}
+        self.run_start_x = {rule.alarm_type: None for rule in self.rules}
+
+    def evaluate(self, features, settings, n):
+        """
+        Evaluate all rules over a batch of n samples.
+
+        Args:
+            features: Dictionary of per-sample arrays (or scalars) for the batch
+            settings: Settings snapshot (thresholds from the UI/recipe)
+            n: Number of samples in the batch
+
+        Returns:
+            List of (index, rule, "entered" | "exited", value, threshold) ordered
+            by sample index and then by rule order
+        """
+        transitions = []
+        if n == 0:
+            return transitions
+        for order, rule in enumerate(self.rules):
+            name = rule.alarm_type
+            value = np.broadcast_to(np.asarray(rule.expression(features, settings), dtype=np.float64), (n,))
+            threshold = rule.resolve_threshold(settings)
+            hysteresis = rule.resolve_hysteresis(settings)
+            if rule.direction == "above":
+                set_mask = value > threshold
+                reset_mask = value <= threshold - hysteresis
+            else:
+                set_mask = value < threshold
+                reset_mask = value >= threshold + hysteresis
+            raw = hysteresis_state(set_mask, reset_mask, self.raw_state[name])
+
+            # Długość bieżącej serii stanu raw (z przeniesieniem z poprzedniej partii)
+            idx = np.arange(n)
+            changed = np.empty(n, dtype=bool)
+            changed[0] = raw[0] != self.raw_state[name]
+            changed[1:] = raw[1:] != raw[:-1]
+            run_start = np.maximum.accumulate(np.where(changed, idx, 0))
+            run_length = idx - run_start + 1
+            carried = (run_start == 0) & (not changed[0])
+            if carried.any():
+                # Seria z poprzedniej partii trwa do pierwszej zmiany
+                run_length[carried] += self.run_length[name]
+            if rule.dwell_unit == "metres":
+                x = np.broadcast_to(np.asarray(features["xCoord"], dtype=np.float64), (n,))
+                start_x = x[run_start]
+                if carried.any() and self.run_start_x[name] is not None:
+                    start_x = np.where(carried, self.run_start_x[name], start_x)
+                persistence = x - start_x
+            else:
+                persistence = run_length
+
+            # Stan zatwierdzony dopiero po min_dwell (wejście) / min_off_dwell (zejście) w nowym stanie
+            dwell_ok = persistence >= np.where(raw, rule.min_dwell, rule.min_off_dwell)
+            state = hysteresis_state(raw & dwell_ok, ~raw & dwell_ok, self.state[name])
+
+            previous = np.concatenate(([self.state[name]], state[:-1]))
+            for i in np.flatnonzero(state != previous):
+                kind = "entered" if state[i] else "exited"
+                transitions.append((int(i), order, rule, kind, float(value[i]), threshold))
+
+            self.raw_state[name] = bool(raw[-1])
+            self.state[name] = bool(state[-1])
+            self.run_length[name] = int(run_length[-1])
+            if rule.dwell_unit == "metres":
+                self.run_start_x[name] = float(start_x[-1])
+
+        transitions.sort(key=lambda item: (item[0], item[1]))
+        return [(i, rule, kind, value, threshold) for i, _, rule, kind, value, threshold in transitions]
+
+    def any_active(self):
+        """True when at least one rule is in the alarm state."""
+        return any(self.state.values())
+
+
+def _diameters(features):
+    return np.vstack([np.asarray(features[key], dtype=np.float64) for key in ("D1", "D2", "D3", "D4")])
+
+
+def _diameter_excess(features, settings):
+    """Przekroczenie tolerancji względem średniej dAvg (dodatnie = poza zakresem)."""
+    d = _diameters(features)
+    d_avg = d.mean(axis=0)
+    above = (d - d_avg).max(axis=0) - settings.get("upper_tol", 0.5)
+    below = (d_avg - d).max(axis=0) - settings.get("lower_tol", 0.5)
+    return np.maximum(above, below)
+
+
+def _defects_excess(features, settings):
+    """Alarm defektów, gdy jednocześnie lumps > max_lumps ORAZ necks > max_necks."""
+    return np.minimum(
+        np.asarray(features["window_lumps"]) - settings.get("max_lumps", 3),
+        np.asarray(features["window_necks"]) - settings.get("max_necks", 3)
+    )
+
+
+def _ovality(features, settings):
+    """Owalność (dMax - dMin) / dAvg * 100 dla każdej próbki."""
+    d = _diameters(features)
+    d_avg = d.mean(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(d_avg != 0, (d.max(axis=0) - d.min(axis=0)) / d_avg * 100.0, 0.0)
+
+
+def _max_std(features, settings):
+    """Największe odchylenie standardowe D1-D4 w oknie defektów."""
+    return max(float(features.get(f"{key}_std", 0.0)) for key in ("D1", "D2", "D3", "D4"))
+
+
+# Minimalny czas trwania stanu alarmu średnicy (w próbkach, ~0.1 s przy 31 Hz)
+DIAMETER_DWELL_SAMPLES = 3
+
+# Tabela alarmów – kolejność wierszy = kolejność zdarzeń dla tej samej próbki
+DEFAULT_RULES = (
+    AlarmRule(
+        "defects_alarm", _defects_excess, threshold=0.0,
+        enter_comment="Wejście w alarm defektów",
+        exit_comment="Zejście z alarmu defektów",
+        state_attr="defects_alarm_active"
+    ),
+    # Średnica porównywana z chwilową średnią – histereza z receptury i dwell tłumią szum
+    AlarmRule(
+        "diameter_error", _diameter_excess, threshold=0.0,
+        hysteresis="diameter_histeresis", min_dwell=DIAMETER_DWELL_SAMPLES,
+        enter_comment="Wejście w alarm średnicy",
+        exit_comment="Zejście z alarmu średnicy",
+        state_attr="diameter_alarm_active"
+    ),
+    # Zachowana dotychczasowa semantyka: alarm, gdy owalność < max_ovality
+    AlarmRule(
+        "ovality_high", _ovality, threshold="max_ovality", direction="below",
+        enter_comment="Wejście w alarm wysokiej owalności",
+        exit_comment="Zejście z alarmu wysokiej owalności",
+        state_attr="ovality_alarm_active"
+    ),
+    AlarmRule(
+        "std_dev_high", _max_std, threshold="max_standard_deviation",
+        enter_comment="Wejście w alarm wysokiego odchylenia standardowego: {value:.3f} > {threshold:.3f}",
+        exit_comment="Zejście z alarmu wysokiego odchylenia standardowego dla średnic",
+        state_attr="std_dev_alarm_active"
+    ),
+)
@@ -0,0 +1,237 @@
+"""
+Analysis pipeline module for AccuScan application.
+Flaw detection, statistics, spectral analysis and alarm evaluation for the
+sample stream. The same pipeline runs either in a thread of the GUI process
+or in a dedicated process that publishes compact result records back.
+"""
+
+import queue
+import time
+
+import numpy as np
+
+from alarm_manager import AlarmManager
+from data_processing import FastAcquisitionBuffer, samples_to_columns, DIAMETER_KEYS
+from flaw_detection import FlawDetector, DiameterFlawDetector
+from spectral_analysis import SpectralEngine, PeakTracker
+
+
+# Analiza widmowa: długość FFT i liczba nowych próbek między kolejnymi widmami
+FFT_BUFFER_SIZE = 1024
+FFT_HOP = 32
+
+# Źródło liczników defektów dla okna defektów: "plc" (liczniki DB2) lub "software"
+# (DiameterFlawDetector na strumieniu D1-D4). Detektor programowy działa zawsze równolegle.
+FLAW_SOURCE = "plc"
+
+
+class AnalysisPipeline:
+    """
+    Analysis of one item from the analysis queue: the first sample of a
+    receiver batch with the UI parameters and the whole batch as columns
+    under "flaw_batch" (or a single sample without it).
+
+    process() returns a compact, picklable result record; the controller
+    applies it to its mirrors (flaw counters, fft_data, spectrogram, event
+    listeners) the same way for the thread and the process variant.
+    """
+
+    def __init__(self, alarm_manager, acquisition_buffer=None, flaw_source=FLAW_SOURCE):
+        """
+        Initialize the AnalysisPipeline.
+
+        Args:
+            alarm_manager: AlarmManager evaluating the alarms
+            acquisition_buffer: Buffer used for window statistics; when None the
+                                pipeline keeps and feeds its own buffer
+            flaw_source: "plc" or "software" counters for the flaw window
+        """
+        self.alarm_manager = alarm_manager
+        self.own_buffer = acquisition_buffer is None
+        self.acquisition_buffer = FastAcquisitionBuffer(max_samples=1024) if self.own_buffer else acquisition_buffer
+        self.flaw_source = flaw_source
+
+        self.flaw_detector = FlawDetector()
+        self.diameter_flaw_detector = DiameterFlawDetector()
+        self.spectral_engine = SpectralEngine(
+            n_fft=FFT_BUFFER_SIZE, hop=FFT_HOP,
+            channels=("avg", "D1", "D2", "D3", "D4")
+        )
+        self.peak_tracker = PeakTracker()
+
+        # Zdarzenia alarmowe zebrane w trakcie process() – wracają w rekordzie wyniku
+        self._events = []
+        self.alarm_manager.event_listeners.append(self._events.append)
+
+    def _single_sample_batch(self, measurement_data):
+        """Kolumny dla pojedynczej próbki (np. przy odtwarzaniu każda próbka osobno)."""
+        columns = samples_to_columns([measurement_data])
+        columns["xCoord"] = np.array([measurement_data.get("xCoord", 0.0)])
+        columns["t"] = np.array([columns["timestamp"][0].timestamp()])
+        return columns
+
+    def process(self, measurement_data):
+        """
+        Run the whole analysis for one queue item.
+
+        Args:
+            measurement_data: Sample dictionary with UI parameters, optionally
+                              with the batch columns under "flaw_batch"
+
+        Returns:
+            Result record with flaw counters, software defects, the new
+            spectrum (or None), active pulsation tracks and alarm events
+        """
+        start = time.perf_counter()
+        x_coord = measurement_data.get("xCoord", 0.0)
+        flaw_batch = measurement_data.pop("flaw_batch", None)
+        if flaw_batch is None:
+            flaw_batch = self._single_sample_batch(measurement_data)
+        if self.own_buffer:
+            self.acquisition_buffer.add_samples(flaw_batch)
+        diameters = np.vstack([np.asarray(flaw_batch[key], dtype=np.float64) for key in DIAMETER_KEYS])
+        t_last = float(flaw_batch["t"][-1])
+
+        flaw_window = measurement_data.get("flaw_window")
+        if flaw_window and flaw_window != self.flaw_detector.flaw_window_size:
+            self.flaw_detector.update_flaw_window_size(flaw_window)
+
+        # Programowa detekcja lumps/necks z histerezą na D1-D4
+        self.diameter_flaw_detector.configure(
+            measurement_data.get("lump_threshold", 0.3),
+            measurement_data.get("neck_threshold", 0.3),
+            measurement_data.get("lump_histeresis", 0.0),
+            measurement_data.get("neck_histeresis", 0.0)
+        )
+        software_flaws = self.diameter_flaw_detector.process_batch(
+            flaw_batch["xCoord"],
+            diameters,
+            measurement_data.get("diameter_preset", 0.0)
+        )
+        measurement_data["software_defects"] = software_flaws["defects"]
+        lumps_delta, necks_delta = flaw_batch["lumps_delta"], flaw_batch["necks_delta"]
+        if self.flaw_source == "software":
+            lumps_delta, necks_delta = software_flaws["lumps_delta"], software_flaws["necks_delta"]
+
+        # Cała partia wektorowo; alarm dostaje maksimum okna w partii
+        flaw_result = self.flaw_detector.process_flaws_batch(flaw_batch["xCoord"], lumps_delta, necks_delta)
+
+        # --- Uzupełnienie measurement_data o statystyki okna dla alarmu std dev ---
+        samples = list(self.acquisition_buffer.samples)
+        n = 0
+        flaw_window_size = measurement_data.get("flaw_window", self.flaw_detector.flaw_window_size)
+        for sample in reversed(samples):
+            if x_coord - sample.get("xCoord", 0) <= flaw_window_size:
+                n += 1
+            else:
+                break
+        if n > 0:
+            stats = self.acquisition_buffer.get_statistics(last_n=n)
+            if stats:
+                measurement_data.update(stats)
+
+        # Alarmy progowe (defekty, średnica, owalność, std dev) – tabela reguł dla całej partii
+        n = len(flaw_batch["xCoord"])
+        features = {
+            "xCoord": flaw_batch["xCoord"],
+            "timestamp": flaw_batch["timestamp"],
+            "window_lumps": flaw_result["window_lumps_series"],
+            "window_necks": flaw_result["window_necks_series"],
+        }
+        for i, key in enumerate(DIAMETER_KEYS):
+            features[key] = diameters[i]
+            features[f"{key}_std"] = measurement_data.get(f"{key}_std", 0.0)
+        self.alarm_manager.check_and_update_rules(features, measurement_data, measurement_data, n)
+
+        # --- Przetwarzanie FFT i alarm pulsacji ---
+        pulsation_threshold = measurement_data.get("pulsation_threshold", 500.0)
+        avg_diameter = np.where((diameters != 0).all(axis=0), diameters.mean(axis=0), 0.0)
+        processing_time = measurement_data.get("processing_time", 0.01)
+        sample_rate = 1 / processing_time if processing_time > 0 else 83.123
+        # Oś częstotliwości z rzeczywistych znaczników czasu akwizycji (sample_rate to tylko
+        # wartość zapasowa); kanały: średnia (detekcja pulsacji) + D1-D4
+        fft_result = self.spectral_engine.update(
+            np.vstack((avg_diameter, diameters)), sample_rate, pulsation_threshold,
+            t=flaw_batch["t"], x=flaw_batch["xCoord"]
+        )
+        if self.spectral_engine.last_result is not None:
+            measurement_data.update(self.spectral_engine.last_result)
+
+        # Alarm pulsacji per pasmo: tory pików śledzone tylko przy nowym widmie
+        if fft_result is not None:
+            self.peak_tracker.threshold = pulsation_threshold
+            transitions = self.peak_tracker.update(
+                fft_result["fft_freqs"], fft_result["fft_magnitude"], t_last
+            )
+            fft_result["pulsation_tracks"] = [
+                (track["freq"], track["ewma"]) for track in self.peak_tracker.active_tracks()
+            ]
+            self.alarm_manager.check_and_update_pulsation_tracks(measurement_data, transitions)
+
+        # Common fault raz na partię – PLC dostaje zapis tylko przy zmianie słowa sterującego
+        common_fault = self.alarm_manager.update_common_fault(measurement_data)
+        self.alarm_manager.flush_events(measurement_data)
+
+        events = list(self._events)
+        self._events.clear()
+        return {
+            "x": x_coord,
+            "t": t_last,
+            "flaw_lumps_count": self.flaw_detector.flaw_lumps_count,
+            "flaw_necks_count": self.flaw_detector.flaw_necks_count,
+            "total_lumps_count": self.flaw_detector.total_lumps_count,
+            "total_necks_count": self.flaw_detector.total_necks_count,
+            "lumps_per_metre": self.flaw_detector.lumps_per_metre,
+            "necks_per_metre": self.flaw_detector.necks_per_metre,
+            "software_defects": software_flaws["defects"],
+            "fft": fft_result,
+            "events": events,
+            "event_queue_depth": self.alarm_manager.db_queue_depth(),
+            "common_fault": common_fault,
+            "common_fault_stats": self.alarm_manager.common_fault.stats(),
+            "processing_time": time.perf_counter() - start,
+        }
+
+
+def analysis_process_worker(input_queue, result_queue, process_running, db_params,
+                            save_to_db=True, plc_address=None):
+    """
+    Process target running the AnalysisPipeline outside the GUI process.
+
+    Args:
+        input_queue: Multiprocessing Queue with analysis items from the data receiver
+        result_queue: Multiprocessing Queue for result records
+        process_running: Shared Value flag indicating if process should continue running
+        db_params: Database parameters for the AlarmManager
+        save_to_db: Whether alarm events are written to the database
+        plc_address: Optional (ip, rack, slot) for the common-fault lamp; None = no PLC
+    """
+    from plc_helper import connect_plc
+
+    plc_client = connect_plc(*plc_address) if plc_address else None
+    alarm_manager = AlarmManager(db_params=db_params, plc_client=plc_client, save_to_db=save_to_db)
+    pipeline = AnalysisPipeline(alarm_manager)
+    print("[Analysis Process] Started.")
+
+    while process_running.value:
+        try:
+            item = input_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        try:
+            result = pipeline.process(item)
+        except Exception as e:
+            print(f"[Analysis Process] Error: {e}")
+            continue
+        # Wyniki blokująco – kontroler jest szybki, a utrata zdarzeń alarmowych jest niedopuszczalna
+        while process_running.value:
+            try:
+                result_queue.put(result, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+
+    alarm_manager.shutdown_db_event_thread()
+    if plc_client is not None:
+        plc_client.disconnect()
+    print("[Analysis Process] Stopped.")
@@ -13,20 +13,24 @@ import multiprocessing as mp
 from multiprocessing import Process, Value, Event, Queue
 # Import modułów
 
-from plc_helper import read_plc_data, connect_plc, write_plc_data
+from plc_helper import read_plc_data, read_plc_frame, parse_plc_frame, compute_counter_delta, connect_plc, write_plc_data
 from db_helper import init_database, check_database
-from data_processing import FastAcquisitionBuffer
+from data_processing import FastAcquisitionBuffer, samples_to_columns
 from flaw_detection import FlawDetector
+from spectral_analysis import SpectrogramStore
+from analysis_pipeline import AnalysisPipeline, analysis_process_worker, FLAW_SOURCE
 from alarm_manager import AlarmManager
+from measurement_archiver import MeasurementArchiver
+from db_retention import RetentionJob
 
 # Import stron
 from main_page import MainPage
 from settings_page import SettingsPage
 from history_page import HistoryPage
 from config import OFFLINE_MODE
+from replay import replay_process_worker, parse_speed, AlarmEventLog
 
 import numpy as np
-from scipy.signal import find_peaks
 
 
 # PLC connection parameters
@@ -34,6 +38,9 @@ PLC_IP = "192.168.50.90"  # Przykładowy adres sterownika
 PLC_RACK = 0              # Zwykle 0 przy S7-1200
 PLC_SLOT = 1              # Często 1 przy S7-1200
 
+# Katalog nagrań surowych ramek DB2 (None wyłącza nagrywanie)
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
 # Database parameters
 DB_PARAMS = {
     "host": "localhost",
@@ -45,6 +52,28 @@ DB_PARAMS = {
     "connect_timeout": 5
 }
 
+# Backend bazy: "mysql" (serwer, DB_PARAMS) lub "sqlite" (wbudowany plik, bez serwera)
+DB_BACKEND = "mysql"
+SQLITE_DB_PARAMS = {
+    "backend": "sqlite",
+    "path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "accuscan.sqlite"),
+}
+
+# Parametry z UI dołączane do próbek przekazywanych do analizy
+ANALYSIS_PARAM_KEYS = (
+    "processing_time", "max_lumps", "max_necks", "upper_tol", "lower_tol",
+    "pulsation_threshold", "max_ovality", "max_standard_deviation",
+    "diameter_preset", "lump_threshold", "neck_threshold", "lump_histeresis", "neck_histeresis",
+    "flaw_window", "ack_seq", "diameter_histeresis",
+)
+
+# Analiza (detekcja defektów, statystyki, FFT, alarmy) w osobnym procesie zamiast wątku GUI
+ANALYSIS_IN_PROCESS = False
+# Spektrogram: liczba przechowywanych wierszy, widma uśredniane na wiersz, maks. liczba prążków
+SPECTROGRAM_ROWS = 300
+SPECTROGRAM_AVERAGE = 2
+SPECTROGRAM_MAX_BINS = 256
+
 # Set multiprocessing start method to 'spawn' for better compatibility
 if __name__ == "__main__":
     # Use spawn method for Windows compatibility. This should be set before any other multiprocessing code runs
@@ -55,10 +84,21 @@ class App(QMainWindow):
     Główne okno aplikacji, dawniej dziedziczące po ctk.CTk,
     teraz po QMainWindow (PyQt5).
     """
-    def __init__(self):
+    def __init__(self, replay_source=None, replay_speed=1.0, replay_report=None, db_backend=DB_BACKEND):
+        """
+        Args:
+            replay_source: Katalog nagrania (FrameRecorder) lub plik .jsonl z próbkami.
+                           Gdy podany, zamiast procesu akwizycji z PLC odtwarzane jest nagranie.
+            replay_speed: Prędkość odtwarzania (1.0 = czas rzeczywisty, None = maksymalna)
+            replay_report: Plik .jsonl, do którego zapisywane są zdarzenia alarmowe z odtwarzania
+            db_backend: "mysql" (serwer MySQL) lub "sqlite" (wbudowana baza w pliku)
+        """
         super().__init__()
         self.plc_connected_flag = Value('i', 0)         #Inicjalizacja flagi PLC
         print("[App] Inicjalizacja aplikacji...")
+        self.replay_source = replay_source
+        self.replay_speed = replay_speed
+        self.replay_report = replay_report
         
 
         self.setWindowTitle("AccuScan Controller")
@@ -90,7 +130,7 @@ class App(QMainWindow):
         self.analysis_queue = queue.Queue(maxsize=100)
         self.plc_write_queue = queue.Queue(maxsize=20)
         
-        if not OFFLINE_MODE:
+        if not OFFLINE_MODE and not self.replay_source:
             self.plc_client = connect_plc(PLC_IP, PLC_RACK, PLC_SLOT)
             if self.plc_client and self.plc_client.get_connected():
                 print("[Main] PLC connected in main process.")
@@ -104,14 +144,41 @@ class App(QMainWindow):
         self.data_queue = mp.Queue(maxsize=250)
         
         # Parametry bazy danycH
-        self.db_params = DB_PARAMS
+        self.db_params = SQLITE_DB_PARAMS if db_backend == "sqlite" else DB_PARAMS
         self.init_database_connection()
 
         # Bufor akwizycji
         self.acquisition_buffer = FastAcquisitionBuffer(max_samples=1024)
+        # W trybie wątku zastępowany detektorem potoku analizy, w trybie procesu
+        # jest lustrem liczników odtwarzanym z rekordów wyników
         self.flaw_detector = FlawDetector()
-        if not OFFLINE_MODE:
+        self.spectrogram = SpectrogramStore(
+            rows=SPECTROGRAM_ROWS, average=SPECTROGRAM_AVERAGE, max_bins=SPECTROGRAM_MAX_BINS
+        )
+        self.analysis_pipeline = None
+        self.event_queue_depth = 0
+        # Licznik kwitowań (Kwituj) – zmiana wartości to żądanie kwitowania common fault
+        self.ack_seq = 0
+        self.common_fault_active = False
+        self.common_fault_stats = {}
+        self.analysis_in_process = ANALYSIS_IN_PROCESS
+        if self.replay_source:
+            # Odtwarzanie: bez PLC i bez zapisu do bazy, zdarzenia trafiają do raportu
+            if not self.analysis_in_process:
+                self.alarm_manager = AlarmManager(db_params=self.db_params, plc_client=None, save_to_db=False)
+            if self.replay_report:
+                self.replay_event_log = AlarmEventLog(self.replay_report)
+            # Cache statystyk zależy od czasu zegarowego – wyłączamy dla powtarzalności
+            self.acquisition_buffer.stats_cache_ttl = 0.0
+        elif not OFFLINE_MODE and not self.analysis_in_process:
             self.alarm_manager = AlarmManager(db_params=self.db_params, plc_client=self.plc_client)
+        # Archiwum surowych próbek (tabela measurement) – tylko przy pracy z PLC i bazą
+        self.measurement_archiver = None
+        self.retention_job = None
+        if not OFFLINE_MODE and not self.replay_source:
+            self.measurement_archiver = MeasurementArchiver(self.db_params)
+            # Retencja danych historycznych – kasowanie porcjami tylko na postoju linii
+            self.retention_job = RetentionJob(self.db_params, is_idle=self.is_line_idle)
         self.plc_client = None
         # if not OFFLINE_MODE:
         #     self.plc_client = connect_plc(PLC_IP, PLC_RACK, PLC_SLOT)
@@ -152,6 +219,7 @@ class App(QMainWindow):
         self.start_update_loop()
 
     def update_plc_status(self):
+        self.check_replay_finished()
         if self.plc_connected_flag.value == 1:
             self.main_page.plc_status_label.setText("Połączono z PLC")
             self.main_page.plc_status_label.setStyleSheet("color: green;")
@@ -171,6 +239,16 @@ class App(QMainWindow):
         self._on_closing()
         event.accept()  # lub event.ignore(), zależnie od Twojej logiki
     
+    def is_line_idle(self, max_age=60.0, min_speed=0.1):
+        """True when the line stands still: no samples for max_age seconds or speed below min_speed [m/min]."""
+        latest = getattr(self, 'latest_data', None)
+        if not latest:
+            return True
+        timestamp = latest.get("timestamp")
+        if timestamp is None or (datetime.now() - timestamp).total_seconds() > max_age:
+            return True
+        return latest.get("speed", 0.0) < min_speed
+
     def init_database_connection(self):
         try:
             # print("[App] Inicjalizacja połączenia z bazą...")
@@ -218,6 +296,9 @@ class App(QMainWindow):
     
     def start_acquisition_process(self):
         """Start dedicated process for high-speed data acquisition from PLC"""
+        if self.replay_source:
+            self.start_replay_process()
+            return
         if OFFLINE_MODE:
             print("[App] Offline mode: Skipped acquisition process.")
             return
@@ -229,6 +310,8 @@ class App(QMainWindow):
         
         self.process_running_flag = Value('i', 1)  # 1 = True, 0 = False
         self.plc_connected_flag = Value('i', 0)
+        # Nazwa bieżącego batcha – proces akwizycji zakłada nowe nagranie przy jej zmianie
+        self.batch_name = Array('c', 64)
         
         # Create a separate process for data acquisition
         self.acquisition_process = Process(
@@ -240,7 +323,9 @@ class App(QMainWindow):
                 PLC_IP,
                 PLC_RACK,
                 PLC_SLOT,
-                self.plc_connected_flag
+                self.plc_connected_flag,
+                self.batch_name,
+                RECORDINGS_DIR
             ),
             daemon=True
         )
@@ -253,6 +338,48 @@ class App(QMainWindow):
         print(f"[App] Data acquisition process started with PID: {self.acquisition_process.pid}")
         self.start_data_receiver_thread()
     
+    def start_replay_process(self):
+        """Start a process replaying a recording into data_queue instead of reading the PLC."""
+        self.run_measurement_flag = Value('i', 1)  # odtwarzanie startuje od razu
+        self.process_running_flag = Value('i', 1)
+        self.replay_finished_flag = Value('i', 0)
+        self.run_measurement = True
+        self.replay_summary_printed = False
+
+        self.acquisition_process = Process(
+            target=replay_process_worker,
+            args=(
+                self.replay_source,
+                self.replay_speed,
+                self.data_queue,
+                self.process_running_flag,
+                self.run_measurement_flag,
+                self.replay_finished_flag
+            ),
+            daemon=True
+        )
+        self.replay_start_time = time.perf_counter()
+        self.acquisition_process.start()
+        print(f"[App] Replay process started with PID: {self.acquisition_process.pid}")
+        self.start_data_receiver_thread()
+
+    def check_replay_finished(self):
+        """Print a one-time summary once the replay was fully consumed by the pipeline."""
+        if not self.replay_source or self.replay_summary_printed:
+            return
+        if not self.replay_finished_flag.value:
+            return
+        if not self.data_queue.empty() or not self.analysis_queue.empty():
+            return
+        if hasattr(self, 'analysis_result_queue') and not self.analysis_result_queue.empty():
+            return
+        self.replay_summary_printed = True
+        elapsed = time.perf_counter() - self.replay_start_time
+        events = self.replay_event_log.count if hasattr(self, 'replay_event_log') else 0
+        print(f"[App] Replay finished in {elapsed:.2f}s, x={self.acquisition_buffer.current_x:.2f} m, "
+              f"lumps={self.flaw_detector.total_lumps_count}, necks={self.flaw_detector.total_necks_count}, "
+              f"alarm events={events}")
+
     def start_data_receiver_thread(self):
         """Start a thread to receive data from the acquisition process and update the buffer"""
         self.data_receiver_running = True
@@ -293,8 +420,8 @@ class App(QMainWindow):
                 if current_queue_size > 10:
                     print(f"[Data Receiver] Current queue size: {current_queue_size}")
 
-                # Jeśli kolejka za duża – część odrzucamy.
-                if current_queue_size > QUEUE_CRITICAL_THRESHOLD:
+                # Jeśli kolejka za duża – część odrzucamy (nie przy odtwarzaniu – ma być deterministycznie).
+                if current_queue_size > QUEUE_CRITICAL_THRESHOLD and not self.replay_source:
                     print(f"[Data Receiver] CRITICAL: Queue size {current_queue_size} exceeds threshold, dropping samples to catch up")
                     samples_to_drop = current_queue_size - QUEUE_WARNING_THRESHOLD
                     for _ in range(samples_to_drop):
@@ -306,28 +433,23 @@ class App(QMainWindow):
 
                 # Ustalamy rozmiar partii
                 batch_size = min(MAX_BATCH_SIZE, self.data_queue.qsize())
-                if batch_size == 0:
-                    # Jeśli w kolejce może być 0 elementów – pobieramy pojedynczy z timeoutem
-                    try:
-                        # Pomiar czasu pobrania z kolejki
-                        queue_start = time.perf_counter()
-                        data = self.data_queue.get(timeout=0.01)
-                        queue_end = time.perf_counter()
-                        queue_time = queue_end - queue_start
-                        queue_get_times.append(queue_time)
-
-                        batch_size = 1
-                    except queue.Empty:
-                        continue
-                else:
-                    # Pobieramy pierwszą próbkę partii
+                try:
+                    # Pierwszą próbkę pobieramy z timeoutem (kolejka może być pusta)
                     queue_start = time.perf_counter()
                     data = self.data_queue.get(timeout=0.01)
-                    queue_end = time.perf_counter()
-                    queue_time = queue_end - queue_start
-                    queue_get_times.append(queue_time)
+                    queue_get_times.append(time.perf_counter() - queue_start)
+                except queue.Empty:
+                    continue
 
-                batch_start = time.perf_counter()  # start przetwarzania pierwszej próbki w batchu
+                batch_start = time.perf_counter()
+                records = [data]
+                # Pozostałe próbki partii pobieramy bez czekania
+                for _ in range(batch_size - 1):
+                    try:
+                        records.append(self.data_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                batch_size = len(records)
                 ui_refresh_counter += 1
 
                 # Co pewien czas odświeżamy nazwy w UI (o ile nie jest "busy")
@@ -341,8 +463,14 @@ class App(QMainWindow):
                         except Exception as e:
                             print(f"[Data Receiver] UI access error: {e}")
 
-                data["batch"] = batch_cache
-                data["product"] = product_cache
+                for record in records:
+                    record["batch"] = batch_cache
+                    record["product"] = product_cache
+
+                # Przekazujemy nazwę batcha do procesu akwizycji (nagrania per batch)
+                if hasattr(self, 'batch_name') and self.batch_name.value != batch_cache.encode()[:63]:
+                    self.batch_name.value = batch_cache.encode()[:63]
+
                 data["processing_time"] = self.processing_time
 
                 # Pobieramy parametry z interfejsu (o ile istnieje)
@@ -378,76 +506,57 @@ class App(QMainWindow):
                     except ValueError:
                         data["max_standard_deviation"] = 0.0
 
+                    # Nastawy programowej detekcji defektów
+                    try:
+                        data["diameter_preset"] = float(self.main_page.entry_diameter_setpoint.text() or "0.0")
+                    except ValueError:
+                        data["diameter_preset"] = 0.0
+                    try:
+                        data["lump_threshold"] = float(self.main_page.entry_lump_threshold.text() or "0.3")
+                    except ValueError:
+                        data["lump_threshold"] = 0.3
+                    try:
+                        data["neck_threshold"] = float(self.main_page.entry_neck_threshold.text() or "0.3")
+                    except ValueError:
+                        data["neck_threshold"] = 0.3
+                    data["lump_histeresis"] = getattr(self.main_page, "lump_histeresis", 0.0)
+                    data["neck_histeresis"] = getattr(self.main_page, "neck_histeresis", 0.0)
+                    data["diameter_histeresis"] = getattr(self.main_page, "diameter_histeresis", 0.0)
+                    data["ack_seq"] = self.ack_seq
+                    try:
+                        data["flaw_window"] = float(self.main_page.entry_flaw_window.text() or "0.5")
+                    except ValueError:
+                        data["flaw_window"] = 0.5
+
+                # Cała partia trafia do bufora jednym wywołaniem (jeden lock,
+                # wektorowe całkowanie xCoord); rekordy dostają xCoord w miejscu.
+                columns = samples_to_columns(records)
+                self.acquisition_buffer.add_samples(columns, records=records)
+                self.latest_data = records[-1].copy()
+                if self.measurement_archiver is not None:
+                    self.measurement_archiver.add_columns(columns, batch_cache, product_cache)
+
                 # Próbujemy wstawić do kolejki analizy
-                try:
-                    self.analysis_queue.put_nowait(data)
-                    # print how many samples are in the queue
-                    # if self.analysis_queue.qsize() > 100:
-                    #     print(f"[Data Receiver] Analysis queue size: {self.analysis_queue.qsize()}")
-                except queue.Full:
-                    print("[Data Receiver] Analysis queue is full, dropping sample")
-
-                # Dodajemy próbkę do bufora
-                self.acquisition_buffer.add_sample(data)
-                x_coord = self.acquisition_buffer.current_x
-                data["xCoord"] = x_coord
-                self.latest_data = data
-                samples_processed += 1
-
-                # Pomiar czasu przetwarzania tej jednej próbki
-                batch_end = time.perf_counter()
-                processing_time = batch_end - batch_start
-                processing_times.append(processing_time)
-
-                # samples_since_last_log += 1
-
-                # # Sprawdzamy, czy przekroczyliśmy 500 próbek od ostatniego logu.
-                # if samples_since_last_log >= 500:
-                #     avg_queue_get = sum(queue_get_times) / len(queue_get_times)
-                #     avg_processing = sum(processing_times) / len(processing_times)
-                #     print(f"[Data Receiver][Performance] Last 500 samples => "
-                #         f"Avg queue get time: {avg_queue_get:.6f} s/sample, "
-                #         f"Avg processing time: {avg_processing:.6f} s/sample")
-                #     queue_get_times.clear()
-                #     processing_times.clear()
-                #     samples_since_last_log = 0
-
-                # Jeżeli w partii jest więcej próbek – pobieramy je i przetwarzamy w pętli
-                for _ in range(batch_size - 1):
+                if self.replay_source:
+                    # Przy odtwarzaniu analiza dostaje każdą próbkę (blokująco), aby wynik
+                    # nie zależał od prędkości odtwarzania ani podziału na partie
+                    for record in records[1:]:
+                        record.update({k: data[k] for k in ANALYSIS_PARAM_KEYS if k in data})
+                    for record in records:
+                        self.analysis_queue.put(record)
+                else:
+                    # Analiza dostaje jedną próbkę na partię, ale defekty liczone są dla całej partii;
+                    # osobny słownik – wątek analizy go modyfikuje, GUI czyta rekordy z bufora
+                    analysis_data = dict(data)
+                    analysis_data["flaw_batch"] = columns
                     try:
-                        queue_start = time.perf_counter()
-                        data = self.data_queue.get_nowait()
-                        queue_end = time.perf_counter()
-                        queue_time = queue_end - queue_start
-                        queue_get_times.append(queue_time)
-
-                        batch_start = time.perf_counter()
-
-                        data["batch"] = batch_cache
-                        data["product"] = product_cache
-                        self.acquisition_buffer.add_sample(data)
-                        self.latest_data = data
-                        x_coord = data.get("xCoord", 0.0)
-                        # print(f"[Data Receiver] Processing data at x={x_coord:.2f} m")
-                        samples_processed += 1
-
-                        batch_end = time.perf_counter()
-                        processing_time = batch_end - batch_start
-                        processing_times.append(processing_time)
-
-                        # samples_since_last_log += 1
-                        # if samples_since_last_log >= 500:
-                        #     avg_queue_get = sum(queue_get_times) / len(queue_get_times)
-                        #     avg_processing = sum(processing_times) / len(processing_times)
-                        #     print(f"[Data Receiver][Performance] Last 500 samples => "
-                        #         f"Avg queue get time: {avg_queue_get:.6f} s/sample, "
-                        #         f"Avg processing time: {avg_processing:.6f} s/sample")
-                        #     queue_get_times.clear()
-                        #     processing_times.clear()
-                        #     samples_since_last_log = 0
+                        self.analysis_queue.put_nowait(analysis_data)
+                    except queue.Full:
+                        print("[Data Receiver] Analysis queue is full, dropping sample")
 
-                    except queue.Empty:
-                        break
+                samples_processed += batch_size
+
+                processing_times.append(time.perf_counter() - batch_start)
 
                 # Kontrola rozmiaru kolejki i logi wydajności
                 current_queue_size = self.data_queue.qsize()
@@ -479,7 +588,8 @@ class App(QMainWindow):
 
     
     @staticmethod
-    def _acquisition_process_worker(process_running, run_measurement, data_queue, plc_ip, plc_rack, plc_slot, plc_connected_flag):
+    def _acquisition_process_worker(process_running, run_measurement, data_queue, plc_ip, plc_rack, plc_slot, plc_connected_flag,
+                                    batch_name=None, recordings_dir=None):
         """
         Worker function for high-speed data acquisition process.
         This runs in a separate process to avoid GIL limitations.
@@ -489,6 +599,8 @@ class App(QMainWindow):
             run_measurement: Shared Value flag indicating if measurements should be taken
             
             data_queue: Multiprocessing Queue for sending data back to main process
+            batch_name: Shared char Array with the current batch name (for recordings)
+            recordings_dir: Directory for raw frame recordings (None disables recording)
         """
         
         print(f"[ACQ Process] Starting acquisition process worker")
@@ -498,6 +610,13 @@ class App(QMainWindow):
         lumps_total = 0
         necks_total = 0
         stable_count = 0  # licznik cykli bez przyrostu
+
+        # Nagrywanie surowych ramek DB2 (mmap, bez wywołań systemowych na ramkę)
+        recorder = None
+        recorded_batch = None
+        if recordings_dir:
+            from frame_recorder import FrameRecorder
+            recorder = FrameRecorder(recordings_dir)
         # Connect to the PLC
         plc_client = None
         try:
@@ -543,6 +662,10 @@ class App(QMainWindow):
             if not run_measurement.value:
                 # Reset the initial reset flag when measurement is off
                 initial_reset_needed = True
+                # Zamykamy nagranie po zatrzymaniu pomiaru
+                if recorder is not None and recorded_batch is not None:
+                    recorder.close()
+                    recorded_batch = None
                 # If not measuring, just sleep and continue
                 time.sleep(0.01)
                 continue
@@ -594,8 +717,18 @@ class App(QMainWindow):
                 
             try:
                 plc_start = time.perf_counter()
-                data = read_plc_data(plc_client, db_number=2)
+                frame = read_plc_frame(plc_client, db_number=2)
                 read_time = time.perf_counter() - plc_start
+                data = parse_plc_frame(frame)
+
+                if recorder is not None:
+                    # Nazwę batcha sprawdzamy co log_frequency cykli, nowe nagranie przy zmianie
+                    if recorded_batch is None or cycle_count == 0:
+                        current_batch = batch_name.value.decode(errors="replace") if batch_name is not None else ""
+                        if current_batch != recorded_batch:
+                            recorder.start_batch(current_batch)
+                            recorded_batch = current_batch
+                    data["frame_seq"] = recorder.append(frame, data.get("speed", 0.0))
 
                 # Pobierz bieżące wartości z PLC
                 current_lumps = data.get("lumps", 0)
@@ -607,16 +740,9 @@ class App(QMainWindow):
                 #     f"lumps_prev={lumps_prev}, necks_prev={necks_prev}")
 
                 # Oblicz przyrosty (delta) na podstawie poprzednich odczytów
-                if current_lumps >= lumps_prev:
-                    delta_lumps = current_lumps - lumps_prev
-                else:
-                    # Jeśli current_lumps jest mniejsze, licznik w PLC został zresetowany lub przepełniony
-                    delta_lumps = current_lumps
-
-                if current_necks >= necks_prev:
-                    delta_necks = current_necks - necks_prev
-                else:
-                    delta_necks = current_necks
+                # (reset lub przepełnienie licznika w PLC => przyrostem jest bieżąca wartość)
+                delta_lumps = compute_counter_delta(current_lumps, lumps_prev)
+                delta_necks = compute_counter_delta(current_necks, necks_prev)
 
                 # Debug: wypis przyrostów
                 # print(f"[ACQ Process] Delta: delta_lumps={delta_lumps}, delta_necks={delta_necks}")
@@ -772,6 +898,8 @@ class App(QMainWindow):
                     print("[ACQ Process] PLC connection lost during forced read, setting flag to 0.")
         
         print("[ACQ Process] Acquisition process worker exiting")
+        if recorder is not None:
+            recorder.close()
         # Clean up PLC connection before exiting
         plc_connected_flag.value = 0
         if plc_client:
@@ -816,11 +944,38 @@ class App(QMainWindow):
 
 
     def start_analysis_worker(self):
-        """Uruchamia wątek do analizy danych i wywoływania alarmów."""
-        if OFFLINE_MODE:
+        """Uruchamia analizę danych i wywoływanie alarmów – w wątku lub w osobnym procesie."""
+        if OFFLINE_MODE and not self.replay_source:
             print("[App] Offline mode: Skipped analysis worker.")
             return
         self.analysis_worker_running = True
+
+        if self.analysis_in_process:
+            # Kolejki międzyprocesowe: próbki do analizy i zwrotne rekordy wyników
+            self.analysis_queue = mp.Queue(maxsize=100)
+            self.analysis_result_queue = mp.Queue(maxsize=100)
+            self.analysis_process_running = Value('i', 1)
+            plc_address = None if (OFFLINE_MODE or self.replay_source) else (PLC_IP, PLC_RACK, PLC_SLOT)
+            self.analysis_process = Process(
+                target=analysis_process_worker,
+                args=(
+                    self.analysis_queue,
+                    self.analysis_result_queue,
+                    self.analysis_process_running,
+                    self.db_params,
+                    not self.replay_source,
+                    plc_address
+                ),
+                daemon=True
+            )
+            self.analysis_process.start()
+            self.analysis_thread = threading.Thread(target=self._analysis_result_worker, daemon=True)
+            self.analysis_thread.start()
+            print(f"[App] Analysis process started with PID: {self.analysis_process.pid}")
+            return
+
+        self.analysis_pipeline = AnalysisPipeline(self.alarm_manager, self.acquisition_buffer)
+        self.flaw_detector = self.analysis_pipeline.flaw_detector
         self.analysis_thread = threading.Thread(target=self._analysis_worker, daemon=True)
         self.analysis_thread.start()
         print("[App] Analysis worker thread started.")
@@ -832,110 +987,8 @@ class App(QMainWindow):
         while self.analysis_worker_running:
             try:
                 measurement_data = self.analysis_queue.get(timeout=0.005)
-                x_coord = measurement_data.get("xCoord", 0.0)
-
-                # --- Główna logika: analiza defektów ---
-                start = time.perf_counter()
-                self.flaw_detector.process_flaws(measurement_data, x_coord)
-                end = time.perf_counter()
-                process_time = end - start
-
-                lumps_in_window = self.flaw_detector.flaw_lumps_count
-                necks_in_window = self.flaw_detector.flaw_necks_count
-
-                max_lumps = measurement_data.get("max_lumps", 3)
-                max_necks = measurement_data.get("max_necks", 3)
-                upper_tol = measurement_data.get("upper_tol", 0.5)
-                lower_tol = measurement_data.get("lower_tol", 0.5)
-
-                # Wywołanie alarmu defektów (lumps & necks)
-                start_alarm = time.perf_counter()
-                self.alarm_manager.check_and_update_defects_alarm(
-                    lumps_in_window,
-                    necks_in_window,
-                    measurement_data,
-                    max_lumps,
-                    max_necks
-                )
-                end_alarm = time.perf_counter()
-
-                # Wywołanie alarmu średnicy
-                start_alarm = time.perf_counter()
-                self.alarm_manager.check_and_update_diameter_alarm(
-                    measurement_data,
-                    upper_tol,
-                    lower_tol
-                )
-                end_alarm = time.perf_counter()
-
-                # --- Uzupełnienie measurement_data o statystyki dla alarmów owalności i std dev ---
-                samples = list(self.acquisition_buffer.samples)
-                # print(f"[Analysis Worker] Samples: {len(samples)}")
-                n = 0
-                flaw_window_size = measurement_data.get("flaw_window", 2.0)
-                # print(f"[Analysis Worker] Flaw window size: {flaw_window_size}")
-                for sample in reversed(samples):
-                    if x_coord - sample.get("xCoord", 0) <= flaw_window_size:
-                        n += 1
-                    else:
-                        break
-
-                if n > 0:
-                    stats = self.acquisition_buffer.get_statistics(last_n=n)
-                    if stats:
-                        measurement_data.update(stats)
-
-                # Wywołanie alarmu dla niskiej owalności
-                max_ovality_threshold = float(self.main_page.entry_max_ovality.text() or "0.0")
-                self.alarm_manager.check_and_update_ovality_alarm(measurement_data, max_ovality_threshold)
-
-                # Wywołanie alarmu dla wysokiego odchylenia standardowego
-                max_std_dev_threshold = float(self.main_page.entry_max_std_dev.text() or "0.0")
-                self.alarm_manager.check_and_update_std_dev_alarm(measurement_data, max_std_dev_threshold)
-
-                # --- Przetwarzanie FFT i alarm pulsacji ---
-                pulsation_threshold = measurement_data.get("pulsation_threshold", 500.0)
-                fft_buffer_size = 1024
-
-                window_data = self.acquisition_buffer.get_window_data()
-                diameter_history = window_data.get("diameter_history", [])
-
-                if len(diameter_history) >= fft_buffer_size:
-                    current_time = time.perf_counter()
-                    fft_start = time.perf_counter()
-
-                    processing_time = measurement_data.get("processing_time", 0.01)
-                    sample_rate = 1 / processing_time if processing_time > 0 else 83.123
-                    diameter_array = np.array(diameter_history[-fft_buffer_size:], dtype=np.float32)
-                    diameter_mean = np.mean(diameter_array)
-                    diameter_array -= diameter_mean
-
-                    if len(diameter_array) > 1:
-                        fft_magnitude = np.abs(np.fft.rfft(diameter_array))
-                        fft_freqs = np.fft.rfftfreq(len(diameter_array), d=1.0 / sample_rate)
-                        peak_idxs, _ = find_peaks(fft_magnitude, prominence=100, distance=5)
-                        pulsation_vals = [
-                            (float(fft_freqs[i]), float(fft_magnitude[i]))
-                            for i in peak_idxs if fft_magnitude[i] > pulsation_threshold
-                        ]
-                        measurement_data["pulsation_vals"] = pulsation_vals
-                        measurement_data["fft_freqs"] = fft_freqs
-                        measurement_data["fft_magnitude"] = fft_magnitude
-                        self.fft_data = {
-                            "fft_freqs": fft_freqs,
-                            "fft_magnitude": fft_magnitude,
-                            "pulsation_vals": pulsation_vals
-                        }
-
-                    fft_end = time.perf_counter()
-                    self.last_fft_time = current_time
-
-                start_alarm = time.perf_counter()
-                self.alarm_manager.check_and_update_pulsation_alarm(
-                    measurement_data, pulsation_threshold
-                )
-                end_alarm = time.perf_counter()
-
+                result = self.analysis_pipeline.process(measurement_data)
+                self._apply_analysis_result(result)
                 self.analysis_queue.task_done()
 
             except queue.Empty:
@@ -943,8 +996,44 @@ class App(QMainWindow):
             except Exception as e:
                 print(f"[Analysis Worker] Error: {e}")
 
+    def _analysis_result_worker(self):
+        """Worker thread applying result records published by the analysis process."""
+        print("[Analysis Results] Worker started.")
+
+        while self.analysis_worker_running:
+            try:
+                result = self.analysis_result_queue.get(timeout=0.05)
+                self._apply_analysis_result(result)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                print(f"[Analysis Results] Error: {e}")
+
+    def _apply_analysis_result(self, result):
+        """
+        Aktualizuje stan kontrolera na podstawie rekordu wyniku analizy
+        (liczniki defektów, dane FFT, spektrogram, raport zdarzeń).
+        """
+        if self.analysis_pipeline is None:
+            # Analiza w osobnym procesie – odtwarzamy liczniki w lustrzanym FlawDetector
+            for key in ("flaw_lumps_count", "flaw_necks_count", "total_lumps_count",
+                        "total_necks_count", "lumps_per_metre", "necks_per_metre"):
+                setattr(self.flaw_detector, key, result[key])
+
+        self.event_queue_depth = result["event_queue_depth"]
+        self.common_fault_active = result["common_fault"]
+        self.common_fault_stats = result["common_fault_stats"]
+
+        fft_result = result["fft"]
+        if fft_result is not None:
+            self.fft_data = fft_result
+            self.spectrogram.append(fft_result["fft_magnitude"], fft_result["fft_freqs"], result["t"])
+            self.last_fft_time = time.perf_counter()
+
+        if hasattr(self, 'replay_event_log'):
+            for event in result["events"]:
+                self.replay_event_log(event)
 
-    
     def _on_closing(self):
         if self._closing:
             return  # Already closing, avoid recursion
@@ -980,9 +1069,21 @@ class App(QMainWindow):
         if hasattr(self, 'plc_writer_thread') and self.plc_writer_thread and self.plc_writer_thread.is_alive():
             self.plc_writer_thread.join(timeout=1.0)
         
+        # Zatrzymaj proces analizy (jeśli analiza działa poza procesem GUI)
+        if hasattr(self, 'analysis_process_running'):
+            self.analysis_process_running.value = 0
+        if hasattr(self, 'analysis_process') and self.analysis_process.is_alive():
+            self.analysis_process.join(timeout=2.0)
+
         # Zatrzymaj wątek zapisu zdarzeń (w AlarmManager)
-        if hasattr(self.alarm_manager, 'shutdown_db_event_thread'):
+        if hasattr(self, 'alarm_manager') and hasattr(self.alarm_manager, 'shutdown_db_event_thread'):
             self.alarm_manager.shutdown_db_event_thread()
+        if getattr(self, 'measurement_archiver', None) is not None:
+            self.measurement_archiver.stop()
+        if getattr(self, 'retention_job', None) is not None:
+            self.retention_job.stop()
+        if hasattr(self, 'replay_event_log'):
+            self.replay_event_log.close()
             
         # Wait for acquisition process to finish (with timeout)
         if hasattr(self, 'acquisition_process') and self.acquisition_process and self.acquisition_process.is_alive():
@@ -1073,9 +1174,26 @@ if __name__ == "__main__":
     mp.freeze_support()  
     print("[App] Uruchamianie aplikacji")
 
-    app = QApplication(sys.argv)
+    import argparse
+    parser = argparse.ArgumentParser(description="AccuScan Controller")
+    parser.add_argument("--replay", metavar="SOURCE",
+                        help="katalog nagrania ramek lub plik .jsonl z próbkami do odtworzenia")
+    parser.add_argument("--replay-speed", default="1",
+                        help="prędkość odtwarzania: 1, 10, 2.5x lub max")
+    parser.add_argument("--replay-report", metavar="FILE",
+                        help="plik .jsonl na zdarzenia alarmowe z odtwarzania")
+    parser.add_argument("--db-backend", choices=("mysql", "sqlite"), default=DB_BACKEND,
+                        help="baza danych: serwer MySQL lub wbudowany plik SQLite")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setStyle("fusion")
-    main_window = App() 
+    main_window = App(
+        replay_source=args.replay,
+        replay_speed=parse_speed(args.replay_speed),
+        replay_report=args.replay_report,
+        db_backend=args.db_backend
+    ) 
     main_window.showFullScreen()
 
     sys.exit(app.exec_())
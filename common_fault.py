@@ -0,0 +1,137 @@
+"""
+Common fault module for AccuScan application.
+Aggregates the states of all alarms into one common fault, drives the PLC
+lamp on edges of the control byte (re-writing it when the PLC copy differs)
+and implements the acknowledgement (Kwituj) handshake through the control
+byte and the PLC statusword.
+"""
+
+import plc_helper
+
+
+class CommonFaultAggregator:
+    """
+    OR of all alarm sources with a latched lamp.
+
+    The lamp is switched on on the rising edge of the common fault and stays on
+    until acknowledged. An acknowledgement is accepted only when no alarm is
+    active; the lamp-off request is then held for at least ack_hold_cycles and
+    until the PLC statusword reports the lamp off (or ack_timeout_cycles pass),
+    so it reliably reaches the PLC cycle. The control byte is written when it
+    changes or when the lamp bit read back from the PLC differs from it (the
+    byte was overwritten by another writer).
+    """
+
+    def __init__(self, plc_client, db_number=2, ack_hold_cycles=3, ack_timeout_cycles=50):
+        """
+        Initialize the CommonFaultAggregator.
+
+        Args:
+            plc_client: snap7 client used for the control byte (None = no PLC writes)
+            db_number: DB holding the control byte
+            ack_hold_cycles: Minimum number of cycles the lamp-off request is held
+            ack_timeout_cycles: Cycles after which the request is dropped without PLC confirmation
+        """
+        self.plc_client = plc_client
+        self.db_number = db_number
+        self.ack_hold_cycles = ack_hold_cycles
+        self.ack_timeout_cycles = ack_timeout_cycles
+
+        self.sources = {}
+        self.active = False
+        self.lamp = False
+        self.ack_cycles = None       # None = brak kwitowania w toku
+        self.last_ack_seq = None
+        self.control = plc_helper.control_byte(False, False)
+        self.written_control = None
+
+        # Diagnostyka ruchu do PLC
+        self.cycles = 0
+        self.edge_count = 0
+        self.write_count = 0
+        self.write_errors = 0
+
+    def set_source(self, name, active):
+        """Set the state of one alarm source (written to the PLC on the next update())."""
+        self.sources[name] = bool(active)
+
+    def request_ack(self):
+        """Request acknowledgement of the lamp (Kwituj)."""
+        if self.active:
+            print("[CommonFault] Kwitowanie odrzucone – common fault nadal aktywny")
+            return False
+        if self.lamp and self.ack_cycles is None:
+            self.ack_cycles = 0
+        return True
+
+    def update(self, status_word=None, ack_seq=None, lamp_control=None):
+        """
+        One aggregator cycle: evaluate the OR of all sources, advance the
+        acknowledgement handshake and write the control byte if it changed
+        or does not match the PLC.
+
+        Args:
+            status_word: PLC statusword (status_plc) of the current cycle, if available
+            ack_seq: Acknowledgement counter from the UI; a change requests an ack
+            lamp_control: Lamp-on bit of the control byte read back from the PLC, if available
+
+        Returns:
+            True when the common fault is active
+        """
+        self.cycles += 1
+        active = any(self.sources.values())
+        if active != self.active:
+            self.edge_count += 1
+        self.active = active
+
+        if ack_seq is not None:
+            if self.last_ack_seq is not None and ack_seq != self.last_ack_seq:
+                self.request_ack()
+            self.last_ack_seq = ack_seq
+
+        if active:
+            # Nowy błąd przerywa kwitowanie i zapala lampkę
+            self.lamp = True
+            self.ack_cycles = None
+        elif self.ack_cycles is not None:
+            self.ack_cycles += 1
+            plc_lamp = None
+            if status_word is not None:
+                plc_lamp = bool((int(status_word) >> plc_helper.STATUS_LAMP_BIT) & 1)
+            confirmed = self.ack_cycles >= self.ack_hold_cycles and plc_lamp is not True
+            if confirmed or self.ack_cycles >= self.ack_timeout_cycles:
+                if not confirmed:
+                    print("[CommonFault] Brak potwierdzenia zgaszenia lampki ze statusword")
+                self.lamp = False
+                self.ack_cycles = None
+
+        lamp_off_request = self.ack_cycles is not None
+        self.control = plc_helper.control_byte(self.lamp and not lamp_off_request, lamp_off_request)
+        desired_lamp = bool((self.control >> plc_helper.CONTROL_LAMP_ON_BIT) & 1)
+        # Odczyt zwrotny: bajt mógł zostać nadpisany w PLC mimo zapamiętanego zapisu
+        out_of_sync = lamp_control is not None and bool(lamp_control) != desired_lamp
+        if self.control != self.written_control or out_of_sync:
+            self._write(self.control)
+        return active
+
+    def _write(self, value):
+        if self.plc_client is None:
+            self.written_control = value
+            return
+        try:
+            plc_helper.write_plc_byte(self.plc_client, plc_helper.CONTROL_BYTE_OFFSET, value, self.db_number)
+            self.written_control = value
+            self.write_count += 1
+        except Exception as e:
+            # written_control bez zmian – zapis zostanie ponowiony w następnym cyklu
+            self.write_errors += 1
+            print("Błąd podczas aktualizacji common fault w PLC:", e)
+
+    def stats(self):
+        """Return counters for confirming the PLC traffic (cycles, edges, writes, errors)."""
+        return {
+            "cycles": self.cycles,
+            "edges": self.edge_count,
+            "writes": self.write_count,
+            "write_errors": self.write_errors,
+        }
@@ -6,6 +6,297 @@ Handles window calculations and processing of measurement data with multithreadi
 import time
 import threading
 from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+
+DIAMETER_KEYS = ("D1", "D2", "D3", "D4")
+
+
+def samples_to_columns(records):
+    """
+    Convert a list of sample dicts (as produced by the acquisition process)
+    into a columnar batch accepted by FastAcquisitionBuffer.add_samples().
+
+    Args:
+        records: List of measurement dictionaries
+
+    Returns:
+        Dictionary of per-channel arrays plus a list of timestamps
+    """
+    columns = {
+        key: np.fromiter((r.get(key, 0) for r in records), dtype=np.float64, count=len(records))
+        for key in DIAMETER_KEYS
+    }
+    columns["lumps_delta"] = np.fromiter((r.get("lumps_delta", 0) for r in records), dtype=np.int64, count=len(records))
+    columns["necks_delta"] = np.fromiter((r.get("necks_delta", 0) for r in records), dtype=np.int64, count=len(records))
+    columns["speed"] = np.fromiter((r.get("speed", 25.0) for r in records), dtype=np.float64, count=len(records))
+    columns["status_plc"] = np.fromiter((r.get("status_plc", 0) for r in records), dtype=np.int64, count=len(records))
+    columns["timestamp"] = [r.get("timestamp") or datetime.now() for r in records]
+    return columns
+
+
+HISTORY_CHANNELS = ("avg",) + DIAMETER_KEYS
+
+
+class HistoryTier:
+    """
+    One resolution level of the tiered history.
+    Aggregates samples into fixed-length distance buckets (e.g. 1 m) and keeps
+    the last max_buckets completed buckets in preallocated ring arrays.
+    """
+
+    def __init__(self, bucket_size, max_buckets=4096, channels=HISTORY_CHANNELS, on_close=None):
+        """
+        Initialize the HistoryTier.
+
+        Args:
+            bucket_size: Length of one bucket in meters
+            max_buckets: Number of completed buckets kept in the ring
+            channels: Names of the value channels (rows of `values` in update())
+            on_close: Optional callable receiving the summary of each completed bucket
+        """
+        self.bucket_size = float(bucket_size)
+        self.max_buckets = max_buckets
+        self.channels = tuple(channels)
+        self.on_close = on_close
+        n_ch = len(self.channels)
+
+        # Ring of completed buckets
+        self.bucket_ids = np.zeros(max_buckets, dtype=np.int64)
+        self.count = np.zeros((n_ch, max_buckets), dtype=np.int64)
+        self.sum = np.zeros((n_ch, max_buckets))
+        self.sumsq = np.zeros((n_ch, max_buckets))
+        self.min = np.zeros((n_ch, max_buckets))
+        self.max = np.zeros((n_ch, max_buckets))
+        self.lumps = np.zeros(max_buckets, dtype=np.int64)
+        self.necks = np.zeros(max_buckets, dtype=np.int64)
+        self.samples = np.zeros(max_buckets, dtype=np.int64)
+        self.speed_sum = np.zeros(max_buckets)
+        self.head = 0     # index of the next slot to write
+        self.filled = 0   # number of valid completed buckets
+
+        # Currently open (not yet completed) bucket
+        self.open_id = None
+        self._reset_open()
+
+    def _reset_open(self):
+        n_ch = len(self.channels)
+        self.open_count = np.zeros(n_ch, dtype=np.int64)
+        self.open_sum = np.zeros(n_ch)
+        self.open_sumsq = np.zeros(n_ch)
+        self.open_min = np.full(n_ch, np.inf)
+        self.open_max = np.full(n_ch, -np.inf)
+        self.open_lumps = 0
+        self.open_necks = 0
+        self.open_samples = 0
+        self.open_speed_sum = 0.0
+
+    def _close_open(self):
+        """Move the open bucket into the ring of completed buckets."""
+        if self.open_id is None:
+            return
+        if self.on_close is not None and self.open_samples > 0:
+            self.on_close(self.open_summary())
+        i = self.head
+        self.bucket_ids[i] = self.open_id
+        self.count[:, i] = self.open_count
+        self.sum[:, i] = self.open_sum
+        self.sumsq[:, i] = self.open_sumsq
+        self.min[:, i] = self.open_min
+        self.max[:, i] = self.open_max
+        self.lumps[i] = self.open_lumps
+        self.necks[i] = self.open_necks
+        self.samples[i] = self.open_samples
+        self.speed_sum[i] = self.open_speed_sum
+        self.head = (self.head + 1) % self.max_buckets
+        self.filled = min(self.filled + 1, self.max_buckets)
+        self._reset_open()
+
+    def close(self):
+        """Complete the open bucket now (e.g. at the end of a batch)."""
+        self._close_open()
+        self.open_id = None
+
+    def open_summary(self):
+        """Summary of the open bucket: x range, counts, speed and mean/std/min/max per channel."""
+        count = np.maximum(self.open_count, 1)
+        mean = self.open_sum / count
+        std = np.sqrt(np.maximum(self.open_sumsq / count - mean * mean, 0.0))
+        x_start = self.open_id * self.bucket_size
+        summary = {
+            'bucket_id': int(self.open_id),
+            'x_start': x_start,
+            'x_end': x_start + self.bucket_size,
+            'samples': self.open_samples,
+            'lumps': self.open_lumps,
+            'necks': self.open_necks,
+            'speed': self.open_speed_sum / max(self.open_samples, 1),
+        }
+        for c, name in enumerate(self.channels):
+            valid = self.open_count[c] > 0
+            summary[f'{name}_mean'] = float(mean[c]) if valid else None
+            summary[f'{name}_std'] = float(std[c]) if valid else None
+            summary[f'{name}_min'] = float(self.open_min[c]) if valid else None
+            summary[f'{name}_max'] = float(self.open_max[c]) if valid else None
+        return summary
+
+    def update(self, x, values, valid, lumps, necks, speed):
+        """
+        Add a batch of samples (arrays) to the tier.
+
+        Args:
+            x: X-coordinates of the samples
+            values: Array (channels, n), by default avg, D1..D4
+            valid: Boolean mask of samples with a valid diameter reading
+            lumps, necks: Per-sample defect deltas
+            speed: Per-sample line speed [m/min]
+        """
+        ids = np.floor(x / self.bucket_size).astype(np.int64)
+        # Granice grup kolejnych próbek należących do tego samego kubełka
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        w = valid.astype(np.int64)
+        masked = np.where(valid, values, 0.0)
+        g_count = np.add.reduceat(np.broadcast_to(w, values.shape), starts, axis=1)
+        g_sum = np.add.reduceat(masked, starts, axis=1)
+        g_sumsq = np.add.reduceat(masked * masked, starts, axis=1)
+        g_min = np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=1)
+        g_max = np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=1)
+        g_lumps = np.add.reduceat(lumps, starts)
+        g_necks = np.add.reduceat(necks, starts)
+        g_speed = np.add.reduceat(speed, starts)
+        g_samples = np.diff(np.r_[starts, len(ids)])
+
+        # Pętla po kubełkach (zwykle 1-2 na partię), nie po próbkach
+        for j, bucket_id in enumerate(ids[starts].tolist()):
+            if bucket_id != self.open_id:
+                self._close_open()
+                self.open_id = bucket_id
+            self.open_count += g_count[:, j]
+            self.open_sum += g_sum[:, j]
+            self.open_sumsq += g_sumsq[:, j]
+            np.minimum(self.open_min, g_min[:, j], out=self.open_min)
+            np.maximum(self.open_max, g_max[:, j], out=self.open_max)
+            self.open_lumps += int(g_lumps[j])
+            self.open_necks += int(g_necks[j])
+            self.open_samples += int(g_samples[j])
+            self.open_speed_sum += float(g_speed[j])
+
+    def snapshot(self, x_min=None, x_max=None):
+        """
+        Return completed buckets (plus the open one) overlapping [x_min, x_max]
+        as a dictionary of arrays ordered by distance.
+        """
+        order = (np.arange(self.head - self.filled, self.head) % self.max_buckets) if self.filled else np.zeros(0, dtype=np.int64)
+        ids = self.bucket_ids[order]
+        count = self.count[:, order]
+        s = self.sum[:, order]
+        sq = self.sumsq[:, order]
+        mn = self.min[:, order]
+        mx = self.max[:, order]
+        lumps = self.lumps[order]
+        necks = self.necks[order]
+        samples = self.samples[order]
+        speed_sum = self.speed_sum[order]
+
+        if self.open_id is not None and self.open_samples > 0:
+            ids = np.append(ids, self.open_id)
+            count = np.column_stack([count, self.open_count])
+            s = np.column_stack([s, self.open_sum])
+            sq = np.column_stack([sq, self.open_sumsq])
+            mn = np.column_stack([mn, self.open_min])
+            mx = np.column_stack([mx, self.open_max])
+            lumps = np.append(lumps, self.open_lumps)
+            necks = np.append(necks, self.open_necks)
+            samples = np.append(samples, self.open_samples)
+            speed_sum = np.append(speed_sum, self.open_speed_sum)
+
+        x_start = ids * self.bucket_size
+        keep = np.ones(len(ids), dtype=bool)
+        if x_min is not None:
+            keep &= x_start + self.bucket_size > x_min
+        if x_max is not None:
+            keep &= x_start <= x_max
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, s / np.maximum(count, 1), np.nan)
+            var = np.maximum(sq / np.maximum(count, 1) - mean * mean, 0.0)
+            std = np.where(count > 0, np.sqrt(var), np.nan)
+
+        result = {
+            'bucket_size': self.bucket_size,
+            'x': (x_start + self.bucket_size / 2.0)[keep],
+            'x_start': x_start[keep],
+            'lumps': lumps[keep],
+            'necks': necks[keep],
+            'samples': samples[keep],
+            'speed': (speed_sum / np.maximum(samples, 1))[keep],
+        }
+        for c, name in enumerate(self.channels):
+            result[f'{name}_mean'] = mean[c][keep]
+            result[f'{name}_std'] = std[c][keep]
+            result[f'{name}_min'] = np.where(count[c] > 0, mn[c], np.nan)[keep]
+            result[f'{name}_max'] = np.where(count[c] > 0, mx[c], np.nan)[keep]
+        return result
+
+
+class TieredHistory:
+    """
+    Multi-resolution history covering the whole batch in bounded memory.
+    Keeps per-1 m, per-10 m and per-100 m buckets (min/max/mean/std of the
+    diameters, lump and neck sums), updated incrementally next to the raw ring.
+    """
+
+    def __init__(self, bucket_sizes=(1.0, 10.0, 100.0), max_buckets=4096):
+        """
+        Initialize the TieredHistory.
+
+        Args:
+            bucket_sizes: Bucket lengths in meters, finest first
+            max_buckets: Number of completed buckets kept per tier
+        """
+        self.tiers = [HistoryTier(size, max_buckets) for size in bucket_sizes]
+
+    def update(self, x, diameters, avg, lumps, necks, speed):
+        """
+        Add a batch of samples to every tier.
+
+        Args:
+            x: X-coordinates (n,)
+            diameters: Array (4, n) with D1..D4
+            avg: Average diameter (n,); 0 marks an invalid reading
+            lumps, necks: Defect deltas (n,)
+            speed: Line speed [m/min] (n,)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) == 0:
+            return
+        values = np.vstack([np.asarray(avg, dtype=np.float64)[None, :],
+                            np.asarray(diameters, dtype=np.float64)])
+        valid = values[0] > 0
+        lumps = np.asarray(lumps, dtype=np.int64)
+        necks = np.asarray(necks, dtype=np.int64)
+        speed = np.asarray(speed, dtype=np.float64)
+        for tier in self.tiers:
+            tier.update(x, values, valid, lumps, necks, speed)
+
+    def select_tier(self, x_min, x_max, max_points=2000):
+        """Pick the finest tier that shows [x_min, x_max] in at most max_points buckets."""
+        span = max(x_max - x_min, 0.0)
+        for tier in self.tiers:
+            if span / tier.bucket_size <= max_points:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, x_min, x_max, max_points=2000):
+        """
+        Return the aggregated history for the visible range from the best tier.
+
+        Returns:
+            Dictionary of arrays (see HistoryTier.snapshot)
+        """
+        return self.select_tier(x_min, x_max, max_points).snapshot(x_min, x_max)
 
 
 class FastAcquisitionBuffer:
@@ -56,6 +347,9 @@ class FastAcquisitionBuffer:
         self.last_stats_update = 0
         self.stats_cache_ttl = 1.0  # 1 second
 
+        # Multi-resolution history of the whole batch (per 1 m / 10 m / 100 m)
+        self.history = TieredHistory()
+
     def add_sample(self, data):
         """
         Thread-safe method to add a new sample to the buffer,
@@ -106,6 +400,15 @@ class FastAcquisitionBuffer:
             speed_mps = speed / 60.0  # Convert m/min to m/s
             self.current_x += dt * speed_mps
             self.x_coords.append(self.current_x)
+
+            self.history.update(
+                [self.current_x],
+                [[data.get(f"D{i}", 0)] for i in range(1, 5)],
+                [avg],
+                [data.get("lumps_delta", 0)],
+                [data.get("necks_delta", 0)],
+                [speed],
+            )
             
             # Store complete sample data
             sample_copy = data.copy()
@@ -143,7 +446,109 @@ class FastAcquisitionBuffer:
             'samples_count': len(self.timestamps)
         }
 
-    
+    def add_samples(self, batch, records=None):
+        """
+        Thread-safe method to add a whole batch of samples under a single lock.
+
+        X-coordinates are integrated for the batch with a vectorised cumulative
+        sum of dt * speed, so catching up after a stall costs one pass over
+        the arrays instead of one add_sample() call per sample.
+
+        Args:
+            batch: Columnar batch - arrays for D1..D4, lumps_delta, necks_delta,
+                   speed and a sequence of timestamps (see samples_to_columns)
+            records: Optional list of the original sample dicts; when given they
+                     are annotated in place (xCoord, speed, avg_diameter) and
+                     copies are stored as the complete samples instead of building
+                     new dicts (the originals may be changed by other threads)
+
+        The integrated x-coordinates are stored back into batch["xCoord"] and
+        the timestamps as epoch seconds into batch["t"].
+
+        Returns:
+            Dictionary with timing information (same keys as add_sample)
+        """
+        method_start = time.perf_counter()
+
+        diameters = np.vstack([np.asarray(batch[key], dtype=np.float64) for key in DIAMETER_KEYS])
+        n = diameters.shape[1]
+        if n == 0:
+            return {'lock_wait_time': 0.0, 'processing_time': 0.0,
+                    'total_method_time': 0.0, 'samples_count': len(self.timestamps)}
+
+        # Średnia liczona tylko gdy wszystkie cztery średnice są niezerowe (jak w add_sample)
+        avg = diameters.sum(axis=0) / 4.0
+        avg[(diameters == 0).any(axis=0)] = 0.0
+
+        speed = np.asarray(batch.get("speed", np.full(n, 25.0)), dtype=np.float64)
+        lumps = np.asarray(batch.get("lumps_delta", np.zeros(n)))
+        necks = np.asarray(batch.get("necks_delta", np.zeros(n)))
+        timestamps = batch.get("timestamp")
+        timestamps = list(timestamps) if timestamps is not None else [datetime.now()] * n
+        t = np.fromiter((ts.timestamp() for ts in timestamps), dtype=np.float64, count=n)
+
+        lock_wait_start = time.perf_counter()
+        with self.lock:
+            lock_wait_time = time.perf_counter() - lock_wait_start
+            processing_start = time.perf_counter()
+
+            # dt pierwszej próbki liczymy względem ostatniej próbki z poprzedniej partii
+            t_prev = self.last_update_time.timestamp() if self.last_update_time is not None else t[0]
+            dt = np.diff(t, prepend=t_prev)
+            x = self.current_x + np.cumsum(dt * (speed / 60.0))
+            batch["xCoord"] = x
+            batch["t"] = t
+
+            for i, key in enumerate(DIAMETER_KEYS):
+                self.diameters[key].extend(diameters[i].tolist())
+            self.lumps.extend(lumps.tolist())
+            self.necks.extend(necks.tolist())
+            self.avg_diameters.extend(avg.tolist())
+            self.timestamps.extend(timestamps)
+            self.x_coords.extend(x.tolist())
+            self.history.update(x, diameters, avg, lumps, necks, speed)
+
+            x_list = x.tolist()
+            speed_list = speed.tolist()
+            avg_list = avg.tolist()
+            if records is not None:
+                for rec, x_i, speed_i, avg_i in zip(records, x_list, speed_list, avg_list):
+                    rec['xCoord'] = x_i
+                    rec['speed'] = speed_i
+                    rec['avg_diameter'] = avg_i
+                # Kopie jak w add_sample – rekordy wędrują dalej (analiza) i są tam modyfikowane
+                self.samples.extend(rec.copy() for rec in records)
+            else:
+                d_lists = [diameters[i].tolist() for i in range(4)]
+                self.samples.extend(
+                    {
+                        'D1': d_lists[0][j], 'D2': d_lists[1][j],
+                        'D3': d_lists[2][j], 'D4': d_lists[3][j],
+                        'lumps_delta': int(lumps[j]), 'necks_delta': int(necks[j]),
+                        'timestamp': timestamps[j], 'xCoord': x_list[j],
+                        'speed': speed_list[j], 'avg_diameter': avg_list[j],
+                    }
+                    for j in range(n)
+                )
+
+            self.current_x = x_list[-1]
+            self.last_update_time = timestamps[-1]
+
+            # Invalidate the statistics cache
+            self.stats_cache = {}
+
+            processing_time = time.perf_counter() - processing_start
+
+        self.acquisition_time = processing_time
+
+        return {
+            'lock_wait_time': lock_wait_time,
+            'processing_time': processing_time,
+            'total_method_time': time.perf_counter() - method_start,
+            'samples_count': len(self.timestamps)
+        }
+
+
     def get_latest_data(self):
         """Get the most recent data point (thread-safe)"""
         with self.lock:
@@ -196,6 +601,21 @@ class FastAcquisitionBuffer:
             
             return stats
     
+    def get_history(self, x_min=None, x_max=None, max_points=2000):
+        """
+        Get the aggregated history for a distance range (thread-safe copy).
+        The tier is chosen so that the range fits in max_points buckets.
+
+        Args:
+            x_min: Start of the visible range in meters (default: 0)
+            x_max: End of the visible range in meters (default: current_x)
+            max_points: Maximum number of buckets to return
+        """
+        with self.lock:
+            x_min = 0.0 if x_min is None else x_min
+            x_max = self.current_x if x_max is None else x_max
+            return self.history.query(x_min, x_max, max_points)
+
     def get_window_data(self):
         """
         Get all data for visualization (thread-safe copy)
@@ -1,28 +1,242 @@
 # db_helper.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 from datetime import datetime
 from config import OFFLINE_MODE
+from db_migrations import try_migrate
+from storage import get_backend
+
+# Pula połączeń: zamiast connect/uwierzytelnienia przy każdej operacji
+POOL_SIZE = 4
+POOL_ACQUIRE_TIMEOUT = 5.0   # [s] oczekiwanie na wolne połączenie z puli
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Przygotowane instrukcje per fizyczne połączenie: {(id połączenia, sql): kursor}
+_statements = {}
+# Cache instrukcji i metryki są współdzielone przez wątki (GUI, writery, retencja, historia)
+_state_lock = threading.Lock()
+_metrics = {
+    "acquired": 0,
+    "acquire_wait_total": 0.0,
+    "acquire_wait_max": 0.0,
+    "pool_exhausted": 0,
+    "pings": 0,
+    "reconnects": 0,
+    "errors": 0,
+    "statements_prepared": 0,
+    "statements_reused": 0,
+}
+
+
+def _pool_key(db_params: dict) -> tuple:
+    # PID w kluczu – proces potomny nie używa gniazd odziedziczonych po rodzicu
+    return (os.getpid(),) + tuple(sorted((k, str(v)) for k, v in db_params.items()))
+
+
+def get_pool(db_params: dict) -> pooling.MySQLConnectionPool:
+    """
+    Zwraca (tworząc przy pierwszym użyciu) pulę połączeń dla danych parametrów.
+    Sesja nie jest resetowana przy zwrocie do puli, aby przygotowane instrukcje pozostały ważne.
+    """
+    key = _pool_key(db_params)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = pooling.MySQLConnectionPool(
+                pool_name=f"accuscan_{len(_pools)}_{os.getpid()}",
+                pool_size=POOL_SIZE,
+                pool_reset_session=False,
+                **db_params
+            )
+            _pools[key] = pool
+        return pool
+
+
+def _raw_connection(connection):
+    return getattr(connection, "_cnx", connection)
+
+
+def _count(name: str, value=1) -> None:
+    with _state_lock:
+        _metrics[name] += value
+
+
+def _forget_statements(connection):
+    raw_id = id(_raw_connection(connection))
+    with _state_lock:
+        for key in [k for k in _statements if k[0] == raw_id]:
+            del _statements[key]
+
+
+def acquire_connection(db_params: dict):
+    """
+    Pobiera połączenie z puli i sprawdza je tanim ping zamiast nowego połączenia.
+    connection.close() oddaje połączenie do puli. Błędy MySQL są propagowane.
+    Dla wbudowanego backendu (db_params["backend"] == "sqlite") zwraca jego połączenie.
+    """
+    if db_params.get("backend") == "sqlite":
+        return get_backend(db_params).acquire()
+    start = time.perf_counter()
+    pool = get_pool(db_params)
+    connection = None
+    while connection is None:
+        try:
+            connection = pool.get_connection()
+        except PoolError:
+            _count("pool_exhausted")
+            if time.perf_counter() - start > POOL_ACQUIRE_TIMEOUT:
+                raise
+            time.sleep(0.01)
+    wait = time.perf_counter() - start
+    with _state_lock:
+        _metrics["acquired"] += 1
+        _metrics["acquire_wait_total"] += wait
+        _metrics["acquire_wait_max"] = max(_metrics["acquire_wait_max"], wait)
+        _metrics["pings"] += 1
+    try:
+        connection.ping(reconnect=False)
+    except Error:
+        # Połączenie zerwane przez serwer – jedno ponowne połączenie, stare instrukcje nieważne
+        _forget_statements(connection)
+        _count("reconnects")
+        try:
+            connection.reconnect(attempts=1, delay=0)
+        except Error:
+            _count("errors")
+            connection.close()
+            raise
+    return connection
+
+
+@contextmanager
+def db_connection(db_params: dict):
+    """
+    Połączenie z puli na czas bloku with; przy błędzie MySQL wycofuje transakcję.
+    """
+    connection = acquire_connection(db_params)
+    try:
+        yield connection
+    except Error:
+        _count("errors")
+        try:
+            connection.rollback()
+        except Error:
+            pass
+        raise
+    finally:
+        connection.close()  # zwrot do puli
+
+
+def prepared_cursor(connection, sql: str):
+    """
+    Zwraca przygotowany kursor dla instrukcji (tworzony raz na fizyczne połączenie i ponownie używany).
+    """
+    key = (id(_raw_connection(connection)), sql)
+    # Połączenie używa jeden wątek naraz – blokada chroni tylko wspólny słownik i liczniki
+    with _state_lock:
+        cursor = _statements.get(key)
+        if cursor is None:
+            _metrics["statements_prepared"] += 1
+        else:
+            _metrics["statements_reused"] += 1
+    if cursor is None:
+        cursor = connection.cursor(prepared=True)
+        with _state_lock:
+            _statements[key] = cursor
+    return cursor
+
+
+def execute_write(db_params: dict, sql: str, params=None) -> int:
+    """
+    Wykonuje instrukcję zapisu (INSERT/UPDATE/DELETE) przygotowanym kursorem i zatwierdza ją.
+    Zwraca lastrowid (dla INSERT) lub liczbę zmienionych wierszy.
+    """
+    with db_connection(db_params) as connection:
+        cursor = prepared_cursor(connection, sql)
+        cursor.execute(sql, params or ())
+        connection.commit()
+        return cursor.lastrowid or cursor.rowcount
+
+
+def fetch_all(db_params: dict, sql: str, params=None, dictionary: bool = True) -> list:
+    """
+    Wykonuje zapytanie i zwraca wszystkie wiersze (domyślnie jako słowniki).
+    """
+    with db_connection(db_params) as connection:
+        cursor = connection.cursor(dictionary=dictionary)
+        try:
+            cursor.execute(sql, params or ())
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+def fetch_one(db_params: dict, sql: str, params=None, dictionary: bool = True):
+    """
+    Wykonuje zapytanie i zwraca pierwszy wiersz lub None.
+    """
+    rows = fetch_all(db_params, sql, params, dictionary)
+    return rows[0] if rows else None
+
+
+_primary_keys = {}
+
+
+def primary_key_column(db_params: dict, table: str):
+    """
+    Zwraca nazwę (pierwszej) kolumny klucza głównego tabeli lub None, gdy tabela go nie ma.
+    Wynik jest zapamiętywany per parametry połączenia i tabela.
+    """
+    key = _pool_key(db_params) + (table,)
+    if key not in _primary_keys:
+        if get_backend(db_params).dialect == "sqlite":
+            rows = fetch_all(db_params, f"PRAGMA table_info(`{table}`)", dictionary=False)
+            columns = [row[1] for row in sorted(rows, key=lambda row: row[5]) if row[5]]
+        else:
+            rows = fetch_all(
+                db_params,
+                "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' "
+                "ORDER BY ORDINAL_POSITION", (table,), dictionary=False
+            )
+            columns = [row[0] for row in rows]
+        _primary_keys[key] = columns[0] if columns else None
+    return _primary_keys[key]
+
+
+def pool_metrics() -> dict:
+    """
+    Zwraca metryki warstwy połączeń (pobrania, czasy oczekiwania, ping, reconnect,
+    wyczerpanie puli, użycie przygotowanych instrukcji).
+    """
+    with _state_lock:
+        metrics = dict(_metrics)
+    metrics["acquire_wait_avg"] = (metrics["acquire_wait_total"] / metrics["acquired"]
+                                   if metrics["acquired"] else 0.0)
+    metrics["pools"] = len(_pools)
+    return metrics
+
 
 def check_database(db_params: dict) -> bool:
     """
-    Sprawdza czy można połączyć się z bazą danych.
+    Sprawdza czy można połączyć się z bazą danych (ping połączenia z puli).
     Zwraca True jeśli połączenie jest możliwe, False w przeciwnym przypadku.
     """
     if OFFLINE_MODE:
         return True
-    connection = None
     try:
-        connection = mysql.connector.connect(**db_params)
-        if connection.is_connected():
-            return True
+        with db_connection(db_params) as connection:
+            return connection.is_connected()
     except Error as e:
         print(f"check_database() - Błąd MySQL: {e}")
         return False
-    finally:
-        if connection is not None and connection.is_connected():
-            connection.close()
-    return False
 
 def init_database(db_params: dict) -> bool:
     """
@@ -32,66 +246,98 @@ def init_database(db_params: dict) -> bool:
     if OFFLINE_MODE:
         return True
     print("init_database()")
-    connection = None
     try:
         print("db_params:", db_params)
-        connection = mysql.connector.connect(**db_params)
-        print("Połączono z bazą danych.")
-        cursor = connection.cursor()
-        
-        connection.commit()
+        with db_connection(db_params) as connection:
+            print("Połączono z bazą danych.")
+            version = try_migrate(connection)
+            print(f"init_database() - Wersja schematu: {version}")
         print("init_database() - Inicjalizacja bazy danych zakończona sukcesem.")
         return True
 
     except Error as e:
         print(f"init_database() - Błąd MySQL: {e}")
         return False
-    finally:
-        if connection is not None and connection.is_connected():
-            connection.close()
 
-def save_measurement_sample(db_params: dict, data: dict) -> bool:
+# Kolumny archiwum próbek (kolejność = kolejność wartości w wierszu MeasurementChunk)
+MEASUREMENT_INSERT_COLUMNS = (
+    "`Date time`", "`X-coordinate`", "`Batch nr`", "`Product nr`",
+    "Statusword", "D1", "D2", "D3", "D4",
+    "`lumps number of`", "`necks number of`", "Speed",
+)
+
+# Agregat na metr produktu (tabela measurement_metre, wiersze z agregatu metrowego MeasurementArchiver)
+METRE_STAT_KEYS = ("D1", "D2", "D3", "D4", "avg")
+METRE_INSERT_COLUMNS = (
+    ("`Date time`", "`Batch nr`", "`Product nr`", "Metre", "Samples")
+    + tuple(f"`{key} {stat}`" for key in METRE_STAT_KEYS for stat in ("mean", "min", "max", "std"))
+    + ("`Ovality mean`", "`Ovality max`", "`lumps number of`", "`necks number of`", "Speed")
+)
+
+def _insert_rows(cursor, table: str, columns: tuple, rows: list, rows_per_insert: int) -> None:
+    """Wielowierszowe INSERT-y po rows_per_insert wierszy (bez commita)."""
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    prefix = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+    for start in range(0, len(rows), rows_per_insert):
+        part = rows[start:start + rows_per_insert]
+        cursor.execute(prefix + ", ".join([placeholders] * len(part)), [value for row in part for value in row])
+
+def save_measurement_chunk(connection, rows: list, metre_rows=(), rows_per_insert: int = 256) -> int:
     """
-    Zapisuje próbkę pomiarową do tabeli measurement:
-      ID_Measurement (auto), Statusword, D1..D4, lumps number of, necks number of
-    Zwraca True jeśli zapis się powiódł, False w przeciwnym przypadku.
+    Zapisuje wiersze próbek (measurement) i agregaty metrów (measurement_metre)
+    wielowierszowymi INSERT-ami w jednej transakcji na otwartym połączeniu.
+    Błędy MySQL są propagowane – o ponowieniu decyduje wywołujący (MeasurementArchiver).
+    Zwraca liczbę zapisanych wierszy próbek.
     """
-    if OFFLINE_MODE:
-        return True
-    if not check_database(db_params):
-        return False
-        
-    connection = None
+    if not rows and not metre_rows:
+        return 0
+    cursor = connection.cursor()
     try:
-        connection = mysql.connector.connect(**db_params)
-        cursor = connection.cursor()
-
-        sql = """
-        INSERT INTO measurement (
-            Statusword, D1, D2, D3, D4,
-            `lumps number of`, `necks number of`
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(
-            sql,
-            (
-                data.get("statusword", 0),
-                data.get("D1", 0.0), data.get("D2", 0.0),
-                data.get("D3", 0.0), data.get("D4", 0.0),
-                data.get("lumps", 0), data.get("necks", 0),
-            )
-        )
+        if rows:
+            _insert_rows(cursor, "measurement", MEASUREMENT_INSERT_COLUMNS, rows, rows_per_insert)
+        if metre_rows:
+            _insert_rows(cursor, "measurement_metre", METRE_INSERT_COLUMNS, list(metre_rows), rows_per_insert)
         connection.commit()
-        return True
-    except Error as e:
-        print(f"save_measurement_sample() - Błąd MySQL: {e}")
-        if connection:
-            connection.rollback()
-        return False
     finally:
-        if connection is not None and connection.is_connected():
-            connection.close()
+        cursor.close()
+    return len(rows)
+
+# INSERT IGNORE + unikalny event_key: zdarzenie wysłane ponownie z dziennika zapisuje się raz
+EVENT_INSERT_SQL = """
+INSERT IGNORE INTO event (
+    `Id register settings`,
+    `Date time`, `X-coordinate`,
+    `Product nr`, `Batch nr`,
+    `Alarm Statusword`,
+    D1, D2, D3, D4,
+    `lumps number of`, `necks number of`,
+    alarm_type, event_type, comment, event_key
+)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+def event_row(event_data: dict) -> tuple:
+    """
+    Zamienia słownik zdarzenia na krotkę parametrów dla EVENT_INSERT_SQL.
+    """
+    return (
+        event_data.get("id_register_settings", None),
+        event_data.get("date_time"),
+        event_data.get("x_coordinate", 0.0),
+        event_data.get("product_nr", ""),
+        event_data.get("batch_nr", ""),
+        event_data.get("alarm_statusword", 0),
+        event_data.get("D1", 0.0),
+        event_data.get("D2", 0.0),
+        event_data.get("D3", 0.0),
+        event_data.get("D4", 0.0),
+        event_data.get("lumps", 0),
+        event_data.get("necks", 0),
+        event_data.get("alarm_type", None),
+        event_data.get("event_type", None),
+        event_data.get("comment", None),
+        event_data.get("event_key", None),
+    )
 
 def save_event(db_params: dict, event_data: dict) -> bool:
     """
@@ -103,45 +349,12 @@ def save_event(db_params: dict, event_data: dict) -> bool:
     """
     if OFFLINE_MODE:
         return True
-    if not check_database(db_params):
-        return False
 
     connection = None
     try:
-        connection = mysql.connector.connect(**db_params)
-        cursor = connection.cursor()
-        sql = """
-        INSERT INTO event (
-            `Id register settings`,
-            `Date time`, `X-coordinate`,
-            `Product nr`, `Batch nr`,
-            `Alarm Statusword`,
-            D1, D2, D3, D4,
-            `lumps number of`, `necks number of`,
-            alarm_type, event_type, comment
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(
-            sql,
-            (
-                event_data.get("id_register_settings", None),
-                event_data.get("date_time"),
-                event_data.get("x_coordinate", 0.0),
-                event_data.get("product_nr", ""),
-                event_data.get("batch_nr", ""),
-                event_data.get("alarm_statusword", 0),
-                event_data.get("D1", 0.0),
-                event_data.get("D2", 0.0),
-                event_data.get("D3", 0.0),
-                event_data.get("D4", 0.0),
-                event_data.get("lumps", 0),
-                event_data.get("necks", 0),
-                event_data.get("alarm_type", None),
-                event_data.get("event_type", None),
-                event_data.get("comment", None),
-            )
-        )
+        connection = acquire_connection(db_params)
+        cursor = prepared_cursor(connection, EVENT_INSERT_SQL)
+        cursor.execute(EVENT_INSERT_SQL, event_row(event_data))
         connection.commit()
         return True
     except Error as e:
@@ -150,9 +363,27 @@ def save_event(db_params: dict, event_data: dict) -> bool:
             connection.rollback()
         return False
     finally:
-        if connection is not None and connection.is_connected():
+        if connection is not None:
             connection.close()
 
+def save_events(connection, events: list) -> int:
+    """
+    Zapisuje partię zdarzeń jednym executemany i jednym commitem na otwartym połączeniu.
+    Duplikaty event_key są pomijane (INSERT IGNORE) – połączenie nie może mieć
+    raise_on_warnings (storage.connect() je wyłącza), inaczej ostrzeżenie 1062 byłoby wyjątkiem.
+    Błędy są propagowane – o ponowieniu lub odłożeniu wiersza decyduje wywołujący (EventWriter).
+    Zwraca liczbę zapisanych zdarzeń.
+    """
+    if not events:
+        return 0
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(EVENT_INSERT_SQL, [event_row(e) for e in events])
+        connection.commit()
+    finally:
+        cursor.close()
+    return len(events)
+
 def save_settings(db_params: dict, settings_data: dict) -> int:
     """
     Zapisuje/aktualizuje rekord w tabeli settings:
@@ -161,14 +392,11 @@ def save_settings(db_params: dict, settings_data: dict) -> int:
     """
     if OFFLINE_MODE:
         return 3
-    if not check_database(db_params):
-        return None
 
     connection = None
     row_id = None
     try:
-        connection = mysql.connector.connect(**db_params)
-        cursor = connection.cursor()
+        connection = acquire_connection(db_params)
 
         if "id_settings" in settings_data:
             sql = """
@@ -185,6 +413,7 @@ def save_settings(db_params: dict, settings_data: dict) -> int:
             WHERE `Id Settings`=%s
             """
 
+            cursor = prepared_cursor(connection, sql)
             cursor.execute(
                 sql,
                 (
@@ -229,6 +458,7 @@ def save_settings(db_params: dict, settings_data: dict) -> int:
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
 
+            cursor = prepared_cursor(connection, sql)
             cursor.execute(
                 sql,
                 (
@@ -287,7 +517,7 @@ def save_settings(db_params: dict, settings_data: dict) -> int:
             connection.rollback()
         return None
     finally:
-        if connection is not None and connection.is_connected():
+        if connection is not None:
             connection.close()
 
 def save_settings_history(db_params: dict, settings_data: dict) -> bool:
@@ -298,13 +528,10 @@ def save_settings_history(db_params: dict, settings_data: dict) -> bool:
     """
     if OFFLINE_MODE:
         return True
-    if not check_database(db_params):
-        return False
 
     connection = None
     try:
-        connection = mysql.connector.connect(**db_params)
-        cursor = connection.cursor()
+        connection = acquire_connection(db_params)
         sql = """
         INSERT INTO settings_register (
             `Date time`, `Recipe name`, `Product nr`, `Preset Diameter`,
@@ -321,6 +548,7 @@ def save_settings_history(db_params: dict, settings_data: dict) -> bool:
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
 
+        cursor = prepared_cursor(connection, sql)
         cursor.execute(
             sql,
             (
@@ -354,7 +582,7 @@ def save_settings_history(db_params: dict, settings_data: dict) -> bool:
             connection.rollback()
         return False
     finally:
-        if connection is not None and connection.is_connected():
+        if connection is not None:
             connection.close()
 
 def load_settings(db_params: dict, settings_id: int) -> dict:
@@ -363,25 +591,13 @@ def load_settings(db_params: dict, settings_id: int) -> dict:
     """
     if OFFLINE_MODE:
         return {}
-    if not check_database(db_params):
-        return {}
 
-    connection = None
     try:
-        connection = mysql.connector.connect(**db_params)
-        cursor = connection.cursor(dictionary=True)
-        sql = "SELECT * FROM settings WHERE id=%s"
-        cursor.execute(sql, (settings_id,))
-        row = cursor.fetchone()
-        if row is None:
-            return {}
-        return row
+        row = fetch_one(db_params, "SELECT * FROM settings WHERE id=%s", (settings_id,))
+        return row or {}
     except Error as e:
         print(f"load_settings() - Błąd MySQL: {e}")
         return {}
-    finally:
-        if connection is not None and connection.is_connected():
-            connection.close()
 
 # def save_detection_event(db_params: dict, event_data: dict) -> bool:
 #     """
@@ -0,0 +1,345 @@
+"""
+Database migrations module for AccuScan application.
+Versioned MySQL schema: every migration is applied once and recorded in
+the schema_version table, in order, under a named lock so the GUI and the
+background writers can all call migrate() on connect. MySQL commits DDL
+implicitly, so each migration checks the current schema and is safe to
+repeat after an interrupted run.
+
+The high-volume tables (measurement, measurement_metre) are range
+partitioned by month of `Date time`; ensure_future_partitions() keeps a few
+empty months ahead of the current date and is repeated periodically by
+roll_partitions() (RetentionJob).
+"""
+
+from datetime import date, datetime
+
+from mysql.connector import Error
+
+
+MIGRATION_LOCK = "accuscan_schema_migration"
+MIGRATION_LOCK_TIMEOUT = 30          # [s]
+PARTITION_MONTHS_AHEAD = 3
+PARTITIONED_TABLES = ("measurement", "measurement_metre")
+
+# Data wstawiana starym próbkom bez czasu (kolumna partycjonowania musi być NOT NULL)
+UNDATED_ROWS_TIME = "1970-01-01 00:00:00"
+
+
+# ----------------------------------------------------------------------
+# Pomocnicze zapytania do information_schema
+def _columns(cursor, table):
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _table_exists(cursor, table):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def _indexes(cursor, table):
+    """Indeksy tabeli: {nazwa: (unikalny, [kolumny])}."""
+    cursor.execute(
+        "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX", (table,)
+    )
+    result = {}
+    for name, non_unique, column in cursor.fetchall():
+        result.setdefault(name, (not non_unique, []))[1].append(column)
+    return result
+
+
+def _add_index(cursor, table, name, columns):
+    if name in _indexes(cursor, table):
+        return
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    cursor.execute(f"ALTER TABLE `{table}` ADD INDEX `{name}` ({column_list})")
+    print(f"[Migrations] Added index {table}.{name} ({column_list})")
+
+
+def _quote(name):
+    return f"`{name}`"
+
+
+# ----------------------------------------------------------------------
+# Partycje miesięczne
+def _add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def partition_name(month):
+    """Nazwa partycji z danymi miesiąca `month` (np. p202610)."""
+    return f"p{month:%Y%m}"
+
+
+def _partition_clause(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{_add_months(month, 1):%Y-%m-%d}')"
+
+
+def list_partitions(cursor, table):
+    """
+    Partycje tabeli w kolejności zakresów.
+
+    Returns:
+        List of (name, upper bound as string or "MAXVALUE", table rows estimate);
+        empty when the table is not partitioned
+    """
+    cursor.execute(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION", (table,)
+    )
+    return [(name, str(description).strip("'"), rows or 0) for name, description, rows in cursor.fetchall()]
+
+
+def _partition_by_month(cursor, table, today):
+    """Zamienia tabelę na partycjonowaną miesięcznie po `Date time` (jeśli to możliwe)."""
+    if not _table_exists(cursor, table) or list_partitions(cursor, table):
+        return
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL "
+        "AND (TABLE_NAME = %s OR REFERENCED_TABLE_NAME = %s)", (table, table)
+    )
+    if cursor.fetchone()[0]:
+        print(f"[Migrations] Table {table} has foreign keys – left unpartitioned")
+        return
+    indexes = _indexes(cursor, table)
+    primary = indexes.get("PRIMARY", (True, []))[1]
+    other_unique = [name for name, (unique, _) in indexes.items() if unique and name != "PRIMARY"]
+    if not primary or other_unique:
+        print(f"[Migrations] Table {table} has no primary key or other unique keys – left unpartitioned")
+        return
+
+    # Kolumna partycjonowania musi należeć do każdego klucza unikalnego i być NOT NULL
+    cursor.execute(f"UPDATE `{table}` SET `Date time` = %s WHERE `Date time` IS NULL", (UNDATED_ROWS_TIME,))
+    clauses = ["MODIFY `Date time` DATETIME(3) NOT NULL"]
+    if "Date time" not in primary:
+        key = ", ".join(_quote(column) for column in primary + ["Date time"])
+        clauses += ["DROP PRIMARY KEY", f"ADD PRIMARY KEY ({key})"]
+    cursor.execute(f"ALTER TABLE `{table}` " + ", ".join(clauses))
+
+    first = date(today.year, today.month, 1)
+    months = [_add_months(first, k) for k in range(PARTITION_MONTHS_AHEAD + 1)]
+    partitions = ([f"PARTITION p_old VALUES LESS THAN ('{first:%Y-%m-%d}')"]
+                  + [_partition_clause(month) for month in months]
+                  + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+    cursor.execute(f"ALTER TABLE `{table}` PARTITION BY RANGE COLUMNS(`Date time`) ({', '.join(partitions)})")
+    print(f"[Migrations] Partitioned {table} by month from {first:%Y-%m}")
+
+
+def ensure_future_partitions(cursor, today=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Dzieli partycję pmax tak, aby istniały partycje do bieżącego miesiąca + months_ahead.
+    pmax jest normalnie pusta, więc REORGANIZE nie przepisuje danych.
+    """
+    today = today or date.today()
+    last_needed = _add_months(date(today.year, today.month, 1), months_ahead)
+    for table in PARTITIONED_TABLES:
+        names = [name for name, _, _ in list_partitions(cursor, table)]
+        if "pmax" not in names:
+            continue
+        monthly = [name for name in names if name[1:].isdigit()]
+        month = _add_months(datetime.strptime(max(monthly), "p%Y%m").date(), 1) if monthly \
+            else date(today.year, today.month, 1)
+        new = []
+        while month <= last_needed:
+            new.append(_partition_clause(month))
+            month = _add_months(month, 1)
+        if new:
+            cursor.execute(
+                f"ALTER TABLE `{table}` REORGANIZE PARTITION pmax INTO "
+                f"({', '.join(new)}, PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+            )
+            print(f"[Migrations] Added {len(new)} monthly partitions to {table}")
+
+
+# ----------------------------------------------------------------------
+# Migracje (zamrożone – nie zmieniać po wdrożeniu, tylko dopisywać kolejne)
+def _m001_event_key(cursor, today):
+    """Klucz zdarzenia z lokalnego dziennika (zapis dokładnie raz)."""
+    if "event_key" not in _columns(cursor, "event"):
+        cursor.execute("ALTER TABLE event ADD COLUMN event_key CHAR(32) NULL, "
+                       "ADD UNIQUE KEY uq_event_key (event_key)")
+
+
+def _m002_measurement_archive(cursor, today):
+    """Kolumny archiwum próbek w tabeli measurement."""
+    existing = _columns(cursor, "measurement")
+    missing = [(name, ddl) for name, ddl in (
+        ("Date time", "DATETIME(3) NULL"),
+        ("X-coordinate", "DOUBLE NULL"),
+        ("Batch nr", "VARCHAR(64) NULL"),
+        ("Product nr", "VARCHAR(64) NULL"),
+        ("Speed", "FLOAT NULL"),
+    ) if name not in existing]
+    if missing:
+        cursor.execute("ALTER TABLE measurement " + ", ".join(f"ADD COLUMN `{name}` {ddl}" for name, ddl in missing))
+    _add_index(cursor, "measurement", "ix_measurement_batch_x", ("Batch nr", "X-coordinate"))
+
+
+def _m003_measurement_metre(cursor, today):
+    """Tabela agregatów na metr produktu."""
+    stats = ", ".join(
+        f"`{key} {stat}` FLOAT NULL"
+        for key in ("D1", "D2", "D3", "D4", "avg") for stat in ("mean", "min", "max", "std")
+    )
+    if _table_exists(cursor, "measurement_metre"):
+        return
+    cursor.execute(
+        "CREATE TABLE measurement_metre ("
+        " ID_Metre BIGINT NOT NULL AUTO_INCREMENT,"
+        " `Date time` DATETIME(3) NULL,"
+        " `Batch nr` VARCHAR(64) NULL,"
+        " `Product nr` VARCHAR(64) NULL,"
+        " Metre INT NOT NULL,"
+        " Samples INT NOT NULL, "
+        + stats + ","
+        " `Ovality mean` FLOAT NULL,"
+        " `Ovality max` FLOAT NULL,"
+        " `lumps number of` INT NOT NULL DEFAULT 0,"
+        " `necks number of` INT NOT NULL DEFAULT 0,"
+        " Speed FLOAT NULL,"
+        " PRIMARY KEY (ID_Metre),"
+        " INDEX ix_metre_batch (`Batch nr`, Metre))"
+    )
+
+
+def _m004_history_indexes(cursor, today):
+    """Indeksy złożone pod filtry historii (data, batch, produkt, typ alarmu)."""
+    for name, columns in (
+        ("ix_event_date", ("Date time",)),
+        ("ix_event_batch_date", ("Batch nr", "Date time")),
+        ("ix_event_product_date", ("Product nr", "Date time")),
+        ("ix_event_alarm_date", ("alarm_type", "Date time")),
+    ):
+        _add_index(cursor, "event", name, columns)
+    for table, prefix in (("measurement", "ix_measurement"), ("measurement_metre", "ix_metre")):
+        _add_index(cursor, table, f"{prefix}_date", ("Date time",))
+        _add_index(cursor, table, f"{prefix}_batch_date", ("Batch nr", "Date time"))
+        _add_index(cursor, table, f"{prefix}_product_date", ("Product nr", "Date time"))
+
+
+def _m005_partition_by_month(cursor, today):
+    """Partycjonowanie miesięczne tabel o dużym wolumenie."""
+    for table in PARTITIONED_TABLES:
+        _partition_by_month(cursor, table, today)
+
+
+MIGRATIONS = (
+    (1, "event.event_key", _m001_event_key),
+    (2, "measurement archive columns", _m002_measurement_archive),
+    (3, "measurement_metre table", _m003_measurement_metre),
+    (4, "history indexes", _m004_history_indexes),
+    (5, "monthly partitions", _m005_partition_by_month),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(connection, today=None):
+    """
+    Bring the schema to SCHEMA_VERSION and add upcoming monthly partitions.
+
+    Args:
+        connection: Open MySQL connection
+        today: Date used for partition ranges (default: today)
+
+    Returns:
+        Schema version after the call, or None when the migration lock was not obtained
+
+    Errors of a migration are propagated (the version stays at the last applied one).
+    """
+    if getattr(connection, "dialect", "mysql") != "mysql":
+        # Wbudowany backend tworzy aktualny schemat przy otwarciu pliku (storage.SQLITE_SCHEMA)
+        return SCHEMA_VERSION
+    today = today or date.today()
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            print("[Migrations] Schema lock not obtained – migration skipped")
+            return None
+        try:
+            # Sprawdzenie zamiast IF NOT EXISTS: nota 1050 przy raise_on_warnings byłaby wyjątkiem
+            if not _table_exists(cursor, "schema_version"):
+                cursor.execute(
+                    "CREATE TABLE schema_version ("
+                    " version INT NOT NULL PRIMARY KEY,"
+                    " name VARCHAR(128) NOT NULL,"
+                    " applied_at DATETIME NOT NULL)"
+                )
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current = cursor.fetchone()[0]
+            for version, name, apply in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"[Migrations] Applying {version}: {name}")
+                apply(cursor, today)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (%s, %s, %s)",
+                    (version, name, datetime.now())
+                )
+                connection.commit()
+                current = version
+            ensure_future_partitions(cursor, today)
+            connection.commit()
+            return current
+        finally:
+            try:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+                cursor.fetchone()
+            except Error:
+                pass
+    finally:
+        cursor.close()
+
+
+def try_migrate(connection, today=None):
+    """
+    migrate() for callers that must keep working with the existing schema:
+    a failed migration (e.g. missing ALTER privilege) is logged and retried
+    on the next connection instead of failing the caller.
+    """
+    try:
+        return migrate(connection, today)
+    except Error as e:
+        print(f"[Migrations] Schema migration failed: {e}")
+        return None
+
+
+def roll_partitions(connection, today=None):
+    """
+    ensure_future_partitions() under the migration lock, for periodic calls
+    on long-running connections (migrate() runs only on connect).
+
+    Returns:
+        True when the partitions were checked, False when the lock was not obtained
+    """
+    if getattr(connection, "dialect", "mysql") != "mysql":
+        return True
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            print("[Migrations] Schema lock not obtained – partition roll-forward skipped")
+            return False
+        try:
+            ensure_future_partitions(cursor, today or date.today())
+            connection.commit()
+            return True
+        finally:
+            try:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+                cursor.fetchone()
+            except Error:
+                pass
+    finally:
+        cursor.close()
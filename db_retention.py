@@ -0,0 +1,299 @@
+"""
+Data retention module for AccuScan application.
+Per-table retention policies for the historical tables. Expired months of
+partitioned tables are removed with DROP PARTITION (a metadata operation),
+other tables are cleaned with small DELETE chunks committed one by one.
+Partition DDL and deletes run only while the line is idle and the DDL waits
+at most a few seconds for its metadata lock, so no long lock or giant
+transaction ever blocks the production writers. Every run reports the reclaimed space.
+Every pass also adds the upcoming monthly partitions, so a line running for
+months without reconnecting never collects new rows in pmax.
+Works with both storage backends (the SQLite file has no partitions).
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import threading
+import time
+
+from db_helper import db_connection
+from db_migrations import list_partitions, roll_partitions
+from storage import dialect_of
+
+
+class RetentionPolicy:
+    """
+    How long the rows of one table are kept.
+    """
+
+    def __init__(self, table, keep_days=None, date_column="Date time"):
+        """
+        Initialize the RetentionPolicy.
+
+        Args:
+            table: Table name
+            keep_days: Age in days after which rows are removed (None = keep forever)
+            date_column: Column holding the row time
+        """
+        self.table = table
+        self.keep_days = keep_days
+        self.date_column = date_column
+
+    def cutoff(self, now):
+        """Rows older than the returned time are expired (None when kept forever)."""
+        if self.keep_days is None:
+            return None
+        return now - timedelta(days=self.keep_days)
+
+
+DEFAULT_POLICIES = (
+    RetentionPolicy("measurement", keep_days=30),
+    RetentionPolicy("measurement_metre", keep_days=730),
+    RetentionPolicy("event", keep_days=None),
+    RetentionPolicy("settings_register", keep_days=None),
+)
+
+
+def table_size(cursor, table, dialect="mysql"):
+    """
+    Rozmiar tabeli wg information_schema (szacunkowy – statystyki InnoDB).
+    Dla SQLite rozmiar całego pliku bazy (strony zajęte i wolne).
+
+    Returns:
+        Tuple (data + index bytes, free bytes inside the tablespace)
+    """
+    if dialect == "sqlite":
+        values = []
+        for pragma in ("page_size", "page_count", "freelist_count"):
+            cursor.execute(f"PRAGMA {pragma}")
+            values.append(cursor.fetchone()[0])
+        page_size, pages, free = values
+        return (pages - free) * page_size, free * page_size
+    cursor.execute(
+        "SELECT COALESCE(DATA_LENGTH + INDEX_LENGTH, 0), COALESCE(DATA_FREE, 0) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,)
+    )
+    row = cursor.fetchone()
+    return (int(row[0]), int(row[1])) if row else (0, 0)
+
+
+@contextmanager
+def ddl_lock_wait(cursor, seconds, dialect="mysql"):
+    """
+    Krótki lock_wait_timeout sesji dla DDL (DROP/REORGANIZE PARTITION): zamiast czekać
+    w kolejce na blokadę metadanych (i blokować za sobą INSERT-y writerów) DDL kończy się
+    błędem i zostaje ponowiony w następnym przebiegu. Poprzednia wartość jest przywracana
+    (połączenie wraca do puli bez resetu sesji).
+    """
+    if dialect != "mysql":
+        yield
+        return
+    cursor.execute("SELECT @@SESSION.lock_wait_timeout")
+    previous = cursor.fetchone()[0]
+    cursor.execute("SET SESSION lock_wait_timeout = %s", (int(seconds),))
+    try:
+        yield
+    finally:
+        cursor.execute("SET SESSION lock_wait_timeout = %s", (int(previous),))
+
+
+def drop_expired_partitions(cursor, table, cutoff):
+    """
+    Usuwa partycje, których cały zakres jest starszy niż cutoff.
+
+    Returns:
+        List of (partition name, estimated rows) that were dropped
+    """
+    expired = []
+    for name, bound, rows in list_partitions(cursor, table):
+        if bound == "MAXVALUE":
+            continue
+        if datetime.strptime(bound[:10], "%Y-%m-%d") <= cutoff:
+            expired.append((name, rows))
+    if expired:
+        cursor.execute(f"ALTER TABLE `{table}` DROP PARTITION {', '.join(name for name, _ in expired)}")
+    return expired
+
+
+def delete_expired_rows(connection, policy, cutoff, chunk_rows=5000, pause=0.2, should_continue=None):
+    """
+    Usuwa wygasłe wiersze porcjami po chunk_rows (każda porcja w osobnej, krótkiej transakcji).
+
+    Args:
+        connection: Open storage connection
+        policy: RetentionPolicy of the table
+        cutoff: Rows with date_column older than this are deleted
+        chunk_rows: Rows per DELETE
+        pause: Sleep between chunks [s] (gives the writers room)
+        should_continue: Callable checked between chunks; False stops the cleanup
+
+    Returns:
+        Number of deleted rows
+    """
+    if dialect_of(connection) == "sqlite":
+        # SQLite nie obsługuje DELETE ... LIMIT w standardowej kompilacji
+        sql = (f"DELETE FROM `{policy.table}` WHERE rowid IN (SELECT rowid FROM `{policy.table}` "
+               f"WHERE `{policy.date_column}` < %s ORDER BY `{policy.date_column}` LIMIT {int(chunk_rows)})")
+    else:
+        sql = (f"DELETE FROM `{policy.table}` WHERE `{policy.date_column}` < %s "
+               f"ORDER BY `{policy.date_column}` LIMIT {int(chunk_rows)}")
+    deleted = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(sql, (cutoff,))
+            count = cursor.rowcount
+            connection.commit()
+            deleted += count
+            if count < chunk_rows:
+                break
+            if should_continue is not None and not should_continue():
+                break
+            time.sleep(pause)
+    finally:
+        cursor.close()
+    return deleted
+
+
+class RetentionJob:
+    """
+    Background job applying the retention policies periodically.
+
+    Partition DDL, chunked deletes and compaction (OPTIMIZE TABLE, online
+    for InnoDB) run only while is_idle() is True and stop as soon as
+    production resumes.
+    """
+
+    def __init__(self, db_params, policies=DEFAULT_POLICIES, interval=3600.0, is_idle=None,
+                 chunk_rows=5000, pause=0.2, compact_free_ratio=0.25, ddl_lock_wait=5):
+        """
+        Initialize the RetentionJob.
+
+        Args:
+            db_params: Database connection parameters
+            policies: Sequence of RetentionPolicy
+            interval: Time between passes [s]
+            is_idle: Callable returning True when the line is idle (None = always idle)
+            chunk_rows: Rows per DELETE chunk
+            pause: Sleep between DELETE chunks [s]
+            compact_free_ratio: Free/used ratio above which an unpartitioned table is compacted
+            ddl_lock_wait: Max wait for the metadata lock of partition DDL [s]
+        """
+        self.db_params = db_params
+        self.policies = tuple(policies)
+        self.interval = interval
+        self.is_idle = is_idle or (lambda: True)
+        self.chunk_rows = chunk_rows
+        self.pause = pause
+        self.compact_free_ratio = compact_free_ratio
+        self.ddl_lock_wait = ddl_lock_wait
+        self.last_report = []
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        """Stop the job (a running DELETE chunk is finished first)."""
+        self.stop_event.set()
+        self.thread.join(timeout=timeout)
+
+    def _should_continue(self):
+        return not self.stop_event.is_set() and self.is_idle()
+
+    def _run(self):
+        # Pierwszy przebieg po krótkiej zwłoce, żeby nie obciążać startu aplikacji
+        delay = min(60.0, self.interval)
+        while not self.stop_event.wait(delay):
+            delay = self.interval
+            try:
+                self.run_once()
+            except Exception as e:
+                # Wątek działa dalej – kolejna próba po krótkiej przerwie
+                delay = min(60.0, self.interval)
+                print(f"[Retention] {type(e).__name__}, retry in {delay:.0f}s: {e}")
+
+    def run_once(self, now=None):
+        """
+        Add upcoming monthly partitions and apply all policies once (partition
+        DDL and deletes only while the line is idle).
+
+        Returns:
+            List of per-table report dicts (table, partitions_dropped, rows_deleted,
+            compacted, bytes_before, bytes_after, reclaimed_bytes)
+        """
+        now = now or datetime.now()
+        report = []
+        with db_connection(self.db_params) as connection:
+            cursor = connection.cursor(buffered=True)
+            try:
+                with ddl_lock_wait(cursor, self.ddl_lock_wait, dialect_of(connection)):
+                    # Nowe miesiące przed pmax – migrate() działa tylko przy połączeniu writerów;
+                    # PARTITION_MONTHS_AHEAD daje miesiące zapasu na przebieg w czasie postoju
+                    if self._should_continue():
+                        roll_partitions(connection, now.date())
+                    for policy in self.policies:
+                        cutoff = policy.cutoff(now)
+                        if cutoff is None or self.stop_event.is_set():
+                            continue
+                        entry = self._apply(connection, cursor, policy, cutoff)
+                        if entry is not None:
+                            report.append(entry)
+            finally:
+                cursor.close()
+        for entry in report:
+            print(f"[Retention] {entry['table']}: dropped {len(entry['partitions_dropped'])} partitions, "
+                  f"deleted {entry['rows_deleted']} rows, compacted={entry['compacted']}, "
+                  f"reclaimed {entry['reclaimed_bytes'] / 1e6:.1f} MB")
+        self.last_report = report
+        return report
+
+    def _apply(self, connection, cursor, policy, cutoff):
+        dialect = dialect_of(connection)
+        if dialect == "sqlite":
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", (policy.table,))
+        else:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (policy.table,)
+            )
+        if not cursor.fetchone()[0]:
+            return None
+        size_before, free_before = table_size(cursor, policy.table, dialect)
+        dropped, deleted, compacted = [], 0, False
+
+        if dialect == "mysql" and list_partitions(cursor, policy.table):
+            # Granulacja miesięczna: wiersze z częściowo wygasłego miesiąca czekają na jego koniec
+            if self._should_continue():
+                dropped = drop_expired_partitions(cursor, policy.table, cutoff)
+        elif self._should_continue():
+            deleted = delete_expired_rows(connection, policy, cutoff, self.chunk_rows,
+                                          self.pause, self._should_continue)
+            if deleted and dialect == "mysql":
+                cursor.execute(f"ANALYZE TABLE `{policy.table}`")
+                cursor.fetchall()
+            size, free = table_size(cursor, policy.table, dialect)
+            # SQLite ponownie wykorzystuje wolne strony; VACUUM blokowałby cały plik
+            if (dialect == "mysql" and size and free / size > self.compact_free_ratio
+                    and self._should_continue()):
+                # OPTIMIZE = przebudowa online (ALGORITHM=INPLACE), oddaje wolne miejsce do systemu
+                cursor.execute(f"OPTIMIZE TABLE `{policy.table}`")
+                cursor.fetchall()
+                compacted = True
+
+        if not dropped and not deleted and not compacted:
+            return None
+        size_after, free_after = table_size(cursor, policy.table, dialect)
+        reclaimed = max(size_before - size_after, 0)
+        if not compacted:
+            # Po DELETE miejsce wraca do przestrzeni tabeli (DATA_FREE), nie do systemu plików
+            reclaimed += max(free_after - free_before, 0)
+        return {
+            "table": policy.table,
+            "partitions_dropped": [name for name, _ in dropped],
+            "rows_deleted": deleted + sum(rows for _, rows in dropped),
+            "compacted": compacted,
+            "bytes_before": size_before,
+            "bytes_after": size_after,
+            "reclaimed_bytes": reclaimed,
+        }
@@ -1,4 +1,5 @@
 import mysql.connector
+from db_helper import execute_write
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QLabel, QLineEdit, QDialogButtonBox, QMessageBox
 )
@@ -86,11 +87,7 @@ class EditSettingDialog(QDialog):
             QMessageBox.critical(self, "Błąd", "Niepoprawne wartości numeryczne.")
             return
         
-        connection = None
         try:
-            connection = mysql.connector.connect(**self.controller.db_params)
-            cursor = connection.cursor()
-            
             if self.values is None or self.clone:
                 # INSERT
                 sql = """
@@ -103,7 +100,7 @@ class EditSettingDialog(QDialog):
                     `Max necks in flaw window`
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """
-                cursor.execute(sql, (
+                execute_write(self.controller.db_params, sql, (
                     new_data["recipe_name"],
                     new_data["product_nr"],
                     new_data["preset_diameter"],
@@ -134,7 +131,7 @@ class EditSettingDialog(QDialog):
                     `Max necks in flaw window`=%s
                 WHERE `Id Settings`=%s
                 """
-                cursor.execute(sql, (
+                execute_write(self.controller.db_params, sql, (
                     new_data["recipe_name"],
                     new_data["product_nr"],
                     new_data["preset_diameter"],
@@ -154,15 +151,11 @@ class EditSettingDialog(QDialog):
                     setting_id
                 ))
             
-            connection.commit()
             print("Sukces: Receptura zapisana.")
             QMessageBox.information(self, "Sukces", "Receptura zapisana.")
             
             # Zamyka dialog z kodem "QDialog.Accepted"
             self.accept()
-            
-            if connection and connection.is_connected():
-                connection.close()
         
         except mysql.connector.Error as e:
             print("Błąd bazy:", e)
@@ -0,0 +1,146 @@
+"""
+Event journal module for AccuScan application.
+Append-only local journal of alarm events in an SQLite file in WAL mode.
+Every event is journaled first (tens of microseconds, no network) and the
+EventWriter drains the journal to MySQL; events survive a database outage
+and an application restart.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal", "events.sqlite")
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if hasattr(value, "item"):
+        # Skalary numpy (np.float64 itp.)
+        return value.item()
+    raise TypeError(f"Cannot journal value of type {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class EventJournal:
+    """
+    Durable FIFO of events backed by SQLite (WAL, synchronous=NORMAL).
+
+    Each event gets a unique event_key when appended; the key travels with the
+    event to MySQL (unique column, INSERT IGNORE), so an event re-sent after a
+    crash between the MySQL commit and remove() is stored exactly once.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        """
+        Initialize the EventJournal.
+
+        Args:
+            path: SQLite file of the journal (created if missing)
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " event_key TEXT NOT NULL UNIQUE,"
+            " payload TEXT NOT NULL)"
+        )
+        # Zdarzenia, których nie da się zapisać (zły wiersz) – odłożone, nie blokują kolejki
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rejected ("
+            " seq INTEGER PRIMARY KEY,"
+            " event_key TEXT,"
+            " payload TEXT NOT NULL,"
+            " error TEXT,"
+            " rejected_at TEXT NOT NULL)"
+        )
+        self.pending = self.connection.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        if self.pending:
+            print(f"[EventJournal] {self.pending} events from a previous run waiting for the database")
+
+    def append(self, event_data):
+        """
+        Journal one event (assigns event_key if missing).
+
+        Returns:
+            The event_key of the event
+        """
+        event_key = event_data.get("event_key") or uuid.uuid4().hex
+        event_data["event_key"] = event_key
+        payload = json.dumps(event_data, default=_encode)
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO journal (event_key, payload) VALUES (?, ?)", (event_key, payload)
+            )
+            self.pending += cursor.rowcount
+        return event_key
+
+    def peek(self, limit):
+        """
+        Return up to `limit` oldest events as a list of (seq, event_data).
+        Entries that cannot be decoded are moved to the rejected table.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT seq, payload FROM journal ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        events = []
+        for seq, payload in rows:
+            try:
+                events.append((seq, json.loads(payload, object_hook=_decode)))
+            except ValueError as e:
+                print(f"[EventJournal] Undecodable event {seq} set aside: {e}")
+                self.reject(seq, str(e))
+        return events
+
+    def remove(self, last_seq):
+        """Remove all events up to and including last_seq (after they were written to MySQL)."""
+        with self.lock:
+            removed = self.connection.execute("DELETE FROM journal WHERE seq <= ?", (last_seq,)).rowcount
+            self.pending = max(self.pending - removed, 0)
+
+    def reject(self, seq, error):
+        """Move one event that cannot be written to the rejected table (kept for inspection)."""
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO rejected (seq, event_key, payload, error, rejected_at) "
+                    "SELECT seq, event_key, payload, ?, ? FROM journal WHERE seq = ?",
+                    (error, datetime.datetime.now().isoformat(" "), seq)
+                )
+                removed = self.connection.execute("DELETE FROM journal WHERE seq = ?", (seq,)).rowcount
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.pending = max(self.pending - removed, 0)
+
+    def rejected_count(self):
+        """Number of events set aside as unwritable."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM rejected").fetchone()[0]
+
+    def __len__(self):
+        return self.pending
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
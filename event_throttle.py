@@ -0,0 +1,143 @@
+"""
+Event throttle module for AccuScan application.
+Protects the database and the operators from event storms: rapid flapping
+of one alarm is coalesced into a single summary event with counts, and a
+global token bucket limits the rate of all alarm events.
+"""
+
+from collections import deque
+import datetime
+
+
+def alarm_key(event_data):
+    """Klucz stanu alarmu: typ alarmu i – dla torów pulsacji – id toru (pasma)."""
+    return event_data.get("alarm_type"), event_data.get("track_id")
+
+
+def event_time(event_data):
+    """Czas zdarzenia w sekundach epoki (z daty próbki, więc powtarzalny przy odtwarzaniu)."""
+    date_time = event_data.get("date_time")
+    if isinstance(date_time, datetime.datetime):
+        return date_time.timestamp()
+    return float(date_time or 0.0)
+
+
+class EventThrottle:
+    """
+    Flap coalescing per alarm plus a global event-rate limiter. An alarm is
+    identified by alarm_key() (alarm type and pulsation track), so transitions
+    of different frequency bands never replace each other.
+
+    An alarm that changes state more than flap_limit times within flap_window
+    seconds is marked as flapping: further transitions are only counted, and
+    once it stays quiet for flap_window seconds one summary event is emitted
+    carrying the last transition (so the final state is still recorded) and
+    the number of coalesced transitions. Events passing the coalescer consume
+    a token from a bucket refilled at `rate` per second. Events without a token
+    are held back per alarm: only the latest transition is kept, and once
+    tokens are available again it is emitted with the number of dropped events,
+    so the final state of every alarm is still recorded.
+    """
+
+    def __init__(self, flap_window=10.0, flap_limit=4, rate=5.0, burst=20):
+        """
+        Initialize the EventThrottle.
+
+        Args:
+            flap_window: Time window for flap detection and quiet period [s]
+            flap_limit: Transitions per window above which an alarm is flapping
+            rate: Sustained number of events per second let through
+            burst: Bucket size (events allowed in a burst)
+        """
+        self.flap_window = flap_window
+        self.flap_limit = flap_limit
+        self.rate = rate
+        self.burst = burst
+
+        self.history = {}        # alarm_key -> deque czasów przejść
+        self.flapping = {}       # alarm_key -> {"count", "first_t", "last_event"}
+        self.tokens = float(burst)
+        self.last_refill = None
+        self.dropped = {}        # alarm_key -> {"count", "last_event"} (czekające na token)
+
+        # Statystyki
+        self.coalesced_total = 0
+        self.dropped_total = 0
+
+    def submit(self, event_data):
+        """
+        Pass one event through the throttle.
+
+        Returns:
+            List of events to record now (possibly empty)
+        """
+        t = event_time(event_data)
+        key = alarm_key(event_data)
+        history = self.history.setdefault(key, deque())
+        history.append(t)
+        while history and t - history[0] > self.flap_window:
+            history.popleft()
+
+        flap = self.flapping.get(key)
+        if flap is not None:
+            flap["count"] += 1
+            flap["last_event"] = event_data
+            self.coalesced_total += 1
+            return []
+        if len(history) > self.flap_limit:
+            self.flapping[key] = {"count": 1, "first_t": t, "last_event": event_data}
+            self.coalesced_total += 1
+            return []
+        return self._limit([event_data], t)
+
+    def flush(self, t):
+        """
+        Emit summaries for alarms that stopped flapping and for dropped events.
+        Called once per analysis cycle with the current sample time.
+
+        Returns:
+            List of events to record now
+        """
+        out = []
+        for key, flap in list(self.flapping.items()):
+            history = self.history.get(key)
+            last_t = history[-1] if history else flap["first_t"]
+            if t - last_t < self.flap_window:
+                continue
+            del self.flapping[key]
+            history.clear()
+            summary = dict(flap["last_event"])
+            summary["comment"] = (f"{summary.get('comment', '')} "
+                                  f"(zgrupowano {flap['count']} przełączeń w {last_t - flap['first_t']:.1f} s)")
+            out.append(summary)
+        return self._limit(out, t)
+
+    def _limit(self, events, t):
+        if self.last_refill is None:
+            self.last_refill = t
+        self.tokens = min(self.burst, self.tokens + (t - self.last_refill) * self.rate)
+        self.last_refill = t
+
+        out = []
+        # Ostatnie pominięte przejście każdego alarmu, gdy limiter znów przepuszcza
+        for key, dropped in list(self.dropped.items()):
+            if self.tokens < 1.0:
+                break
+            summary = dict(dropped["last_event"])
+            summary["comment"] = (f"{summary.get('comment', '')} "
+                                  f"(pominięto {dropped['count']} zdarzeń, limit {self.rate:g}/s)")
+            out.append(summary)
+            self.tokens -= 1.0
+            del self.dropped[key]
+        for event_data in events:
+            key = alarm_key(event_data)
+            # Alarm z czekającym przejściem nie może go wyprzedzić – kolejność stanów zostaje zachowana
+            if self.tokens >= 1.0 and key not in self.dropped:
+                self.tokens -= 1.0
+                out.append(event_data)
+            else:
+                dropped = self.dropped.setdefault(key, {"count": 0, "last_event": None})
+                dropped["count"] += 1
+                dropped["last_event"] = event_data
+                self.dropped_total += 1
+        return out
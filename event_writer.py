@@ -0,0 +1,169 @@
+"""
+Event writer module for AccuScan application.
+Background writer for alarm events: the alarm path only appends to the local
+EventJournal, a single thread holds a persistent MySQL connection and drains
+the journal in batches (executemany) by size or time, reconnecting with
+exponential backoff. Events survive database outages and restarts; an event
+that cannot be written at all is set aside so it does not block the rest.
+"""
+
+import threading
+import time
+
+from mysql.connector import Error
+
+from db_helper import save_events
+from db_migrations import try_migrate
+import storage
+from event_journal import EventJournal, DEFAULT_JOURNAL_PATH
+
+
+class EventWriter:
+    """
+    Asynchronous, batched writer of alarm events to the `event` table.
+
+    Events are removed from the journal only after the MySQL commit, so a
+    database outage delays events but does not reorder or drop them and never
+    blocks the caller of enqueue(); the event_key makes re-sent events
+    idempotent. When a batch fails because of the data of a row, the batch
+    is written row by row and the offending rows are moved to the journal's
+    rejected table.
+    """
+
+    def __init__(self, db_params, journal_path=DEFAULT_JOURNAL_PATH, batch_size=50,
+                 flush_interval=0.5, min_backoff=0.5, max_backoff=30.0, warn_depth=1000):
+        """
+        Initialize the EventWriter.
+
+        Args:
+            db_params: Database connection parameters
+            journal_path: SQLite file of the local event journal
+            batch_size: Flush when this many events are pending (and max events per INSERT)
+            flush_interval: Flush pending events at least this often [s]
+            min_backoff: First retry delay after a database error [s]
+            max_backoff: Upper bound of the retry delay [s]
+            warn_depth: Journal depth above which a warning is printed
+        """
+        self.db_params = db_params
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.warn_depth = warn_depth
+
+        self.journal = EventJournal(journal_path)
+        self.wakeup = threading.Event()
+        self.connection = None
+        self.backoff = 0.0
+        self.retry_at = 0.0
+
+        # Statystyki do diagnostyki (odczytywane bez blokady – tylko liczniki)
+        self.written = 0
+        self.rejected = 0
+        self.failed_flushes = 0
+        self.last_flush_time = 0.0
+        self.last_error = None
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def enqueue(self, event_data):
+        """Journal an event for writing (never waits on the database)."""
+        self.journal.append(event_data)
+        if len(self.journal) >= self.batch_size:
+            self.wakeup.set()
+
+    def queue_depth(self):
+        """Number of events not yet written to MySQL."""
+        return len(self.journal)
+
+    def stop(self, timeout=2.0):
+        """Stop the writer thread after a final flush attempt; unwritten events stay journaled."""
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=timeout)
+        if not self.thread.is_alive():
+            self.journal.close()
+
+    # ------------------------------------------------------------------
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if time.perf_counter() < self.retry_at:
+                continue
+            # Opróżniamy dziennik partiami, dopóki zapis się udaje
+            while self.running and len(self.journal) and self._flush():
+                pass
+
+        if len(self.journal) and time.perf_counter() >= self.retry_at:
+            self._flush()
+        if len(self.journal):
+            print(f"[EventWriter] {len(self.journal)} events kept in the journal for the next run")
+        self._close_connection()
+
+    def _flush(self):
+        """Write one batch from the journal; returns True on success."""
+        start = time.perf_counter()
+        try:
+            batch = self.journal.peek(self.batch_size)
+            if not batch:
+                return False
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = storage.connect(self.db_params)
+                try_migrate(self.connection)
+            try:
+                self.written += save_events(self.connection, [event for _, event in batch])
+            except Exception as e:
+                if not storage.is_row_error(e):
+                    raise
+                self._flush_rows(batch)
+            else:
+                self.journal.remove(batch[-1][0])
+            self.backoff = 0.0
+            self.retry_at = 0.0
+            ok = True
+        except Exception as e:
+            # Każdy błąd (baza, dziennik, dane) – ponowienie z opóźnieniem, wątek działa dalej
+            self.failed_flushes += 1
+            self.last_error = str(e)
+            self._close_connection()
+            self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+            self.retry_at = time.perf_counter() + self.backoff
+            print(f"[EventWriter] {type(e).__name__}, {len(self.journal)} events journaled, "
+                  f"retry in {self.backoff:.1f}s: {e}")
+            ok = False
+        self.last_flush_time = time.perf_counter() - start
+
+        depth = len(self.journal)
+        if depth > self.warn_depth:
+            print(f"[EventWriter] Warning: {depth} events waiting for the database")
+        return ok
+
+    def _flush_rows(self, batch):
+        """
+        Write a batch row by row after a row error; rows that fail because of
+        their data are moved to the rejected table, connection errors propagate.
+        """
+        self.connection.rollback()
+        for seq, event in batch:
+            try:
+                self.written += save_events(self.connection, [event])
+            except Exception as e:
+                if not storage.is_row_error(e):
+                    raise
+                self.connection.rollback()
+                self.journal.reject(seq, f"{type(e).__name__}: {e}")
+                self.rejected += 1
+                print(f"[EventWriter] Event {event.get('event_key')} set aside: {e}")
+                continue
+            self.journal.remove(seq)
+
+    def _close_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Error:
+                pass
+        self.connection = None
@@ -1,11 +1,326 @@
 import time
+from collections import deque
+
+import numpy as np
+
+
+def hysteresis_state(set_mask, reset_mask, initial=False):
+    """
+    Vectorised set/reset latch.
+
+    The state after sample i is the value of the last sample j <= i on which
+    either mask was true (True for set, False for reset); before the first
+    such sample the state is `initial`. Set wins when both masks are true.
+
+    Args:
+        set_mask: Boolean array, True where the state is switched on
+        reset_mask: Boolean array, True where the state is switched off
+        initial: State carried over from the previous batch
+
+    Returns:
+        Boolean array with the latch state after every sample
+    """
+    n = len(set_mask)
+    event_idx = np.where(set_mask | reset_mask, np.arange(n), -1)
+    last = np.maximum.accumulate(event_idx) if n else event_idx
+    return np.where(last >= 0, set_mask[np.maximum(last, 0)], initial)
+
+
+class FlawWindow:
+    """
+    Sliding windows over the flaw stream, measured in metres.
+
+    Flaw events are stored in growable ring arrays together with the running
+    (exclusive) prefix sums of lumps and necks. Every window length keeps its
+    own start pointer that only moves forward while the line moves, so the
+    count in a window is total - prefix[start], i.e. O(1) amortised per sample
+    regardless of how many flaws are inside the window. Several windows (e.g.
+    the configured flaw window and a 1 m density window) share one ring.
+    """
+
+    def __init__(self, lengths=None, capacity=1024):
+        """
+        Initialize the FlawWindow.
+
+        Args:
+            lengths: Dictionary {window name: length in metres}
+            capacity: Initial ring capacity (number of flaw events), grows when needed
+        """
+        self.capacity = capacity
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.lumps_prefix = np.zeros(capacity, dtype=np.int64)
+        self.necks_prefix = np.zeros(capacity, dtype=np.int64)
+
+        # Indeksy absolutne: head = liczba dotychczas dodanych zdarzeń,
+        # tail = najstarsze zdarzenie jeszcze przechowywane w pierścieniu
+        self.head = 0
+        self.tail = 0
+        self.lumps_total = 0
+        self.necks_total = 0
+
+        self.lengths = {}
+        self.starts = {}
+        for name, length in (lengths or {}).items():
+            self.set_length(name, length)
+
+    def set_length(self, name, length):
+        """
+        Add a window or change its length. The start pointer is adjusted on the
+        next update(); a window enlarged past the events already discarded from
+        the ring only sees the events still retained.
+        """
+        self.lengths[name] = float(length)
+        self.starts.setdefault(name, self.tail)
+
+    def add(self, x, lumps, necks):
+        """Append one flaw event at position x (only called when lumps or necks > 0)."""
+        if self.head - self.tail >= self.capacity:
+            self._grow()
+        i = self.head % self.capacity
+        self.x[i] = x
+        self.lumps_prefix[i] = self.lumps_total
+        self.necks_prefix[i] = self.necks_total
+        self.lumps_total += lumps
+        self.necks_total += necks
+        self.head += 1
+
+    def update(self, current_x):
+        """Move the start pointer of every window to the first event with x >= current_x - length."""
+        cap = self.capacity
+        for name, length in self.lengths.items():
+            window_start = current_x - length
+            start = self.starts[name]
+            # Okno powiększone – cofamy wskaźnik po zdarzeniach wciąż obecnych w pierścieniu
+            while start > self.tail and self.x[(start - 1) % cap] >= window_start:
+                start -= 1
+            while start < self.head and self.x[start % cap] < window_start:
+                start += 1
+            self.starts[name] = start
+        # Zdarzenia przed najstarszym wskaźnikiem nie są już potrzebne
+        if self.starts:
+            self.tail = min(self.starts.values())
+        else:
+            self.tail = self.head
+
+    def add_batch(self, x, lumps, necks):
+        """
+        Process a whole batch of samples at once.
+
+        Window starts are found with np.searchsorted over the retained events
+        plus the new events of the batch, and the per-sample counts come from
+        the prefix sums, so there is no Python loop over samples.
+
+        Args:
+            x: Array of x-coordinates (non-decreasing)
+            lumps: Array of lump deltas per sample
+            necks: Array of neck deltas per sample
+
+        Returns:
+            Dictionary {window name: (lumps series, necks series)} with the
+            window counts after every sample of the batch
+        """
+        x = np.asarray(x, dtype=np.float64)
+        lumps = np.maximum(np.asarray(lumps, dtype=np.int64), 0)
+        necks = np.maximum(np.asarray(necks, dtype=np.int64), 0)
+        n = len(x)
+        if n == 0:
+            return {name: (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+                    for name in self.lengths}
+
+        # Zdarzenia zachowane w pierścieniu + nowe zdarzenia z partii
+        retained = np.arange(self.tail, self.head) % self.capacity
+        is_event = (lumps > 0) | (necks > 0)
+        ev_x = np.concatenate([self.x[retained], x[is_event]])
+        ev_lumps = lumps[is_event]
+        ev_necks = necks[is_event]
+        # Prefiks (suma przed zdarzeniem k), z dodatkowym elementem na końcu = suma całkowita
+        lumps_prefix = np.concatenate([self.lumps_prefix[retained],
+                                       self.lumps_total + np.concatenate(([0], np.cumsum(ev_lumps)))])
+        necks_prefix = np.concatenate([self.necks_prefix[retained],
+                                       self.necks_total + np.concatenate(([0], np.cumsum(ev_necks)))])
+        # Liczba zdarzeń widocznych po każdej próbce (zdarzenia późniejszych próbek nie wchodzą)
+        ev_end = len(retained) + np.cumsum(is_event)
+
+        result = {}
+        for name, length in self.lengths.items():
+            start = np.searchsorted(ev_x, x - length, side="left")
+            start = np.minimum(start, ev_end)
+            result[name] = (lumps_prefix[ev_end] - lumps_prefix[start],
+                            necks_prefix[ev_end] - necks_prefix[start])
+            self.starts[name] = self.tail + int(start[-1])
+
+        # Zapis nowych zdarzeń do pierścienia
+        n_events = len(ev_lumps)
+        while self.head + n_events - self.tail > self.capacity:
+            self._grow()
+        idx = np.arange(self.head, self.head + n_events) % self.capacity
+        self.x[idx] = x[is_event]
+        self.lumps_prefix[idx] = lumps_prefix[len(retained):-1]
+        self.necks_prefix[idx] = necks_prefix[len(retained):-1]
+        self.lumps_total = int(lumps_prefix[-1])
+        self.necks_total = int(necks_prefix[-1])
+        self.head += n_events
+        self.tail = min(self.starts.values()) if self.starts else self.head
+        return result
+
+    def counts(self, name):
+        """Return (lumps, necks) inside the window."""
+        start = self.starts[name]
+        if start >= self.head:
+            return 0, 0
+        i = start % self.capacity
+        return (int(self.lumps_total - self.lumps_prefix[i]),
+                int(self.necks_total - self.necks_prefix[i]))
+
+    def all_counts(self):
+        """Return {window name: (lumps, necks)} for all windows."""
+        return {name: self.counts(name) for name in self.lengths}
+
+    def _grow(self):
+        """Podwaja pojemność pierścienia, zachowując indeksy absolutne."""
+        new_capacity = self.capacity * 2
+        idx = np.arange(self.tail, self.head)
+        old = idx % self.capacity
+        new = idx % new_capacity
+        for attr in ("x", "lumps_prefix", "necks_prefix"):
+            old_arr = getattr(self, attr)
+            new_arr = np.zeros(new_capacity, dtype=old_arr.dtype)
+            new_arr[new] = old_arr[old]
+            setattr(self, attr, new_arr)
+        self.capacity = new_capacity
+
+
+class DiameterFlawDetector:
+    """
+    Software lump/neck detection from the D1-D4 stream.
+
+    A lump starts when any head exceeds preset + lump_threshold and ends when
+    all heads fall below preset + lump_threshold - lump_histeresis (necks
+    symmetrically below the preset). Whole batches are processed with numpy;
+    defects open at the end of a batch are carried over to the next one.
+    """
+
+    def __init__(self, lump_threshold=0.3, neck_threshold=0.3,
+                 lump_histeresis=0.0, neck_histeresis=0.0, max_defects=1000):
+        """
+        Initialize the DiameterFlawDetector.
+
+        Args:
+            lump_threshold: Deviation above the preset diameter starting a lump [mm]
+            neck_threshold: Deviation below the preset diameter starting a neck [mm]
+            lump_histeresis: Hysteresis for ending a lump [mm]
+            neck_histeresis: Hysteresis for ending a neck [mm]
+            max_defects: Number of completed defects kept in memory
+        """
+        self.configure(lump_threshold, neck_threshold, lump_histeresis, neck_histeresis)
+        # Defekt otwarty na końcu poprzedniej partii: {"x_start", "x_end", "peak"} lub None
+        self.open = {"lump": None, "neck": None}
+        self.defects = deque(maxlen=max_defects)
+        self.total_lumps_count = 0
+        self.total_necks_count = 0
+
+    def configure(self, lump_threshold, neck_threshold, lump_histeresis=0.0, neck_histeresis=0.0):
+        """Update thresholds and hysteresis (e.g. after loading a recipe)."""
+        self.lump_threshold = float(lump_threshold)
+        self.neck_threshold = float(neck_threshold)
+        self.lump_histeresis = max(float(lump_histeresis), 0.0)
+        self.neck_histeresis = max(float(neck_histeresis), 0.0)
+
+    def process_batch(self, x, diameters, preset_diameter):
+        """
+        Detect lumps and necks in a batch of samples.
+
+        Args:
+            x: Array of x-coordinates (n,)
+            diameters: Array of D1-D4 readings (4, n); zero means no reading
+            preset_diameter: Nominal diameter [mm]
+
+        Returns:
+            Dictionary with per-sample 'lumps_delta' / 'necks_delta' arrays
+            (1 on the sample where a defect starts) and the list of 'defects'
+            completed in this batch
+        """
+        x = np.asarray(x, dtype=np.float64)
+        diameters = np.asarray(diameters, dtype=np.float64).reshape(4, -1)
+        n = len(x)
+        result = {
+            "lumps_delta": np.zeros(n, dtype=np.int64),
+            "necks_delta": np.zeros(n, dtype=np.int64),
+            "defects": [],
+        }
+        if n == 0 or preset_diameter <= 0:
+            return result
+
+        valid = diameters > 0
+        deviation = diameters - preset_diameter
+        # Lump: największe odchylenie w górę, neck: największe w dół (tylko głowice z odczytem)
+        lump_signal = np.where(valid, deviation, -np.inf).max(axis=0)
+        neck_signal = np.where(valid, -deviation, -np.inf).max(axis=0)
+
+        for kind, signal, threshold, histeresis in (
+            ("lump", lump_signal, self.lump_threshold, self.lump_histeresis),
+            ("neck", neck_signal, self.neck_threshold, self.neck_histeresis),
+        ):
+            starts, defects = self._detect(kind, x, signal, threshold, histeresis)
+            result[f"{kind}s_delta"][starts] = 1
+            result["defects"].extend(defects)
+
+        self.total_lumps_count += int(result["lumps_delta"].sum())
+        self.total_necks_count += int(result["necks_delta"].sum())
+        self.defects.extend(result["defects"])
+        return result
+
+    def _detect(self, kind, x, signal, threshold, histeresis):
+        """Segmentacja jednego typu defektu; zwraca indeksy startów i zakończone defekty."""
+        n = len(x)
+        carried = self.open[kind]
+        state = hysteresis_state(signal > threshold, signal < threshold - histeresis,
+                                 initial=carried is not None)
+        prev = np.concatenate(([carried is not None], state[:-1]))
+        starts = np.flatnonzero(state & ~prev)
+        ends = np.flatnonzero(~state & prev)        # pierwsza próbka po defekcie
+
+        seg_starts = np.concatenate(([0], starts)) if carried is not None else starts
+        seg_ends = np.concatenate((ends, [n])) if state[-1] else ends
+
+        # Szczyt w każdym segmencie: reduceat po przeplecionych granicach [start, end)
+        padded = np.append(signal, -np.inf)
+        bounds = np.column_stack((seg_starts, seg_ends)).ravel()
+        peaks = np.maximum.reduceat(padded, bounds)[::2] if len(bounds) else np.zeros(0)
+
+        sign = 1.0 if kind == "lump" else -1.0
+        defects = []
+        for i, (s, e, peak) in enumerate(zip(seg_starts.tolist(), seg_ends.tolist(), peaks.tolist())):
+            if i == 0 and carried is not None:
+                x_start = carried["x_start"]
+                peak = max(peak, carried["peak"])
+            else:
+                x_start = float(x[s])
+            x_end = float(x[e - 1]) if e > s else carried["x_end"]
+            if e == n and state[-1]:
+                self.open[kind] = {"x_start": x_start, "x_end": x_end, "peak": peak}
+                continue
+            defects.append({
+                "type": kind,
+                "x_start": x_start,
+                "x_end": x_end,
+                "length": x_end - x_start,
+                "peak_deviation": sign * peak,
+            })
+        if not state[-1]:
+            self.open[kind] = None
+        return starts, defects
+
 
 class FlawDetector:
     """
     Detects and tracks flaws (lumps and necks) based on measurement data.
     Maintains counters for total flaws and flaws within a specified window.
     """
-    
+
+    # Okno pomocnicze do gęstości defektów na metr
+    DENSITY_WINDOW = 1.0
+
     def __init__(self, flaw_window_size=0.5):
         """
         Initialize the FlawDetector.
@@ -18,10 +333,14 @@ class FlawDetector:
         # Counters for flaws in the window
         self.flaw_lumps_count = 0
         self.flaw_necks_count = 0
-        
-        # Coordinates of flaws for window tracking
-        self.flaw_lumps_coords = []
-        self.flaw_necks_coords = []
+
+        # Okna defektów: skonfigurowane okno oraz okno 1 m (gęstość na metr)
+        self.window = FlawWindow({
+            "flaw": flaw_window_size,
+            "per_metre": self.DENSITY_WINDOW,
+        })
+        self.lumps_per_metre = 0
+        self.necks_per_metre = 0
         
         # Total counters
         self.total_lumps_count = 0
@@ -29,8 +348,56 @@ class FlawDetector:
         
         # Processing time
         self.processing_time = 0.0
-    
-    
+
+    def update_flaw_window_size(self, flaw_window_size):
+        """
+        Change the length of the flaw window (takes effect on the next sample).
+
+        Args:
+            flaw_window_size: New window length in meters
+        """
+        self.flaw_window_size = flaw_window_size
+        self.window.set_length("flaw", flaw_window_size)
+
+    def process_flaws_batch(self, x, lumps_delta, necks_delta):
+        """
+        Vectorised counterpart of process_flaws for a whole batch of samples.
+
+        Args:
+            x: Array of x-coordinates of the samples
+            lumps_delta: Array of lump deltas per sample
+            necks_delta: Array of neck deltas per sample
+
+        Returns:
+            Dictionary with the same keys as process_flaws (values after the last
+            sample) plus per-sample window count series and their maxima
+        """
+        series = self.window.add_batch(x, lumps_delta, necks_delta)
+        window_lumps, window_necks = series["flaw"]
+        metre_lumps, metre_necks = series["per_metre"]
+
+        self.total_lumps_count = self.window.lumps_total
+        self.total_necks_count = self.window.necks_total
+        if len(window_lumps):
+            self.flaw_lumps_count = int(window_lumps[-1])
+            self.flaw_necks_count = int(window_necks[-1])
+            self.lumps_per_metre = int(metre_lumps[-1])
+            self.necks_per_metre = int(metre_necks[-1])
+
+        return {
+            'lumps_count': self.total_lumps_count,
+            'necks_count': self.total_necks_count,
+            'window_lumps_count': self.flaw_lumps_count,
+            'window_necks_count': self.flaw_necks_count,
+            'lumps_per_metre': self.lumps_per_metre,
+            'necks_per_metre': self.necks_per_metre,
+            'window_lumps_series': window_lumps,
+            'window_necks_series': window_necks,
+            'window_lumps_max': int(window_lumps.max()) if len(window_lumps) else self.flaw_lumps_count,
+            'window_necks_max': int(window_necks.max()) if len(window_necks) else self.flaw_necks_count,
+            'processing_time': self.processing_time,
+        }
+
     def process_flaws(self, data, current_x):
         """
         Process flaw data and update counters.
@@ -57,51 +424,16 @@ class FlawDetector:
             self.total_necks_count += necks
         
         # Track flaws in window
-        if lumps > 0:
-            self.flaw_lumps_coords.append((current_x, lumps))
-            self.flaw_lumps_count += lumps
-
-        if necks > 0:
-            self.flaw_necks_coords.append((current_x, necks))
-            self.flaw_necks_count += necks
+        if lumps > 0 or necks > 0:
+            self.window.add(current_x, max(lumps, 0), max(necks, 0))
 
         # -----------------------------
-        # 2) Obsługa usuwania defektów poza oknem
+        # 2) Przesunięcie początków okien
         # -----------------------------
+        self.window.update(current_x)
+        self.flaw_lumps_count, self.flaw_necks_count = self.window.counts("flaw")
+        self.lumps_per_metre, self.necks_per_metre = self.window.counts("per_metre")
 
-        
-        window_start = current_x - self.flaw_window_size
-        
-        # Usuwanie lumps poza oknem
-        if self.flaw_lumps_coords and self.flaw_lumps_coords[0][0] < window_start:
-            drop_idx = None
-            for i, (x, cnt) in enumerate(self.flaw_lumps_coords):
-                if x >= window_start:
-                    drop_idx = i
-                    break
-            if drop_idx is None:
-                drop_idx = len(self.flaw_lumps_coords)
-            if drop_idx > 0:
-                removed = sum(cnt for (_, cnt) in self.flaw_lumps_coords[:drop_idx])
-                self.flaw_lumps_coords = self.flaw_lumps_coords[drop_idx:]
-                self.flaw_lumps_count -= removed
-
-        
-        # Usuwanie necks poza oknem
-
-        if self.flaw_necks_coords and self.flaw_necks_coords[0][0] < window_start:
-            drop_idx = None
-            for i, (x, cnt) in enumerate(self.flaw_necks_coords):
-                if x >= window_start:
-                    drop_idx = i
-                    break
-            if drop_idx is None:
-                drop_idx = len(self.flaw_necks_coords)
-            if drop_idx > 0:
-                removed = sum(cnt for (_, cnt) in self.flaw_necks_coords[:drop_idx])
-                self.flaw_necks_coords = self.flaw_necks_coords[drop_idx:]
-                self.flaw_necks_count -= removed
-        
         # -----------------------------
         # 3) Podsumowanie czasu
         # -----------------------------
@@ -124,6 +456,8 @@ class FlawDetector:
             'necks_count': self.total_necks_count,
             'window_lumps_count': self.flaw_lumps_count,
             'window_necks_count': self.flaw_necks_count,
+            'lumps_per_metre': self.lumps_per_metre,
+            'necks_per_metre': self.necks_per_metre,
             'processing_time': self.processing_time,
             
         }
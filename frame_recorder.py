@@ -0,0 +1,255 @@
+"""
+Frame recorder module for AccuScan application.
+Appends raw DB2 frames read from the PLC to preallocated, memory-mapped
+segment files (one directory per batch) and reads them back for analysis/replay.
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+from plc_helper import PLC_FRAME_SIZE
+
+
+# Rekord: seq (uint64), t_mono (float64), t_wall (float64), x (float64), ramka DB2
+RECORD_STRUCT = struct.Struct(f"<Qddd{PLC_FRAME_SIZE}s")
+RECORD_SIZE = RECORD_STRUCT.size
+RECORD_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("t_mono", "<f8"),
+    ("t_wall", "<f8"),
+    ("x", "<f8"),
+    ("frame", f"V{PLC_FRAME_SIZE}"),
+])
+
+SEGMENT_RECORDS = 65536          # ~35 min przy 31 Hz, ~5.8 MB na segment
+INDEX_FILE = "index.json"
+SEGMENT_PATTERN = "seg_{:06d}.bin"
+
+
+def _safe_dir_name(name):
+    """Zamienia nazwę batcha na bezpieczną nazwę katalogu."""
+    return re.sub(r"[^0-9A-Za-z_.-]", "_", name or "no_batch")
+
+
+class FrameRecorder:
+    """
+    Append-only recorder of raw PLC frames.
+    Each record carries a sequence number, monotonic and wall-clock timestamps
+    and the x-coordinate integrated from the speed in the frame. Records are
+    written with struct.pack_into() into a preallocated mmap, so appending a
+    frame performs no system calls; files are only touched on rotation.
+    """
+
+    def __init__(self, base_dir, segment_records=SEGMENT_RECORDS):
+        """
+        Initialize the FrameRecorder.
+
+        Args:
+            base_dir: Directory where per-batch recording directories are created
+            segment_records: Number of records preallocated per segment file
+        """
+        self.base_dir = base_dir
+        self.segment_records = segment_records
+        self.batch = None
+        self.batch_dir = None
+        self.segments = []      # wpisy indeksu zamkniętych segmentów
+        self.seq = 0
+        self.x = 0.0
+        self.last_t_mono = None
+
+        self._file = None
+        self._mm = None
+        self._segment_no = 0
+        self._count = 0
+        self._first = None      # (seq, t_mono, t_wall, x) pierwszego rekordu w segmencie
+        self._last = None
+
+    def start_batch(self, batch):
+        """
+        Close the current recording (if any) and start a new one for the batch.
+        Sequence numbers and x restart from zero for every batch.
+        """
+        self.close()
+        self.batch = batch
+        self.batch_dir = os.path.join(self.base_dir, _safe_dir_name(batch), time.strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(self.batch_dir, exist_ok=True)
+        self.segments = []
+        self.seq = 0
+        self.x = 0.0
+        self.last_t_mono = None
+        self._segment_no = 0
+        self._open_segment()
+        print(f"[Recorder] Recording frames to {self.batch_dir}")
+
+    def append(self, frame, speed=0.0, t_mono=None, t_wall=None):
+        """
+        Append one raw frame.
+
+        Args:
+            frame: Raw DB2 frame (PLC_FRAME_SIZE bytes)
+            speed: Line speed from the frame [m/min], used to integrate x
+            t_mono: Monotonic timestamp (default: time.monotonic())
+            t_wall: Wall-clock timestamp (default: time.time())
+
+        Returns:
+            Sequence number of the record
+        """
+        if self._mm is None:
+            self.start_batch(self.batch)
+        if self._count >= self.segment_records:
+            self._close_segment()
+            self._segment_no += 1
+            self._open_segment()
+
+        t_mono = time.monotonic() if t_mono is None else t_mono
+        t_wall = time.time() if t_wall is None else t_wall
+        if self.last_t_mono is not None:
+            self.x += (t_mono - self.last_t_mono) * (speed / 60.0)
+        self.last_t_mono = t_mono
+        self.seq += 1
+
+        RECORD_STRUCT.pack_into(self._mm, self._count * RECORD_SIZE,
+                                self.seq, t_mono, t_wall, self.x, bytes(frame))
+        self._count += 1
+        self._last = (self.seq, t_mono, t_wall, self.x)
+        if self._first is None:
+            self._first = self._last
+        return self.seq
+
+    def close(self):
+        """Flush and close the active segment and write the index."""
+        if self._mm is not None:
+            self._close_segment()
+
+    # ------------------------------------------------------------------
+    def _open_segment(self):
+        path = os.path.join(self.batch_dir, SEGMENT_PATTERN.format(self._segment_no))
+        self._file = open(path, "w+b")
+        # Prealokacja całego segmentu – późniejsze zapisy nie zmieniają rozmiaru pliku
+        self._file.truncate(self.segment_records * RECORD_SIZE)
+        self._mm = mmap.mmap(self._file.fileno(), self.segment_records * RECORD_SIZE)
+        self._count = 0
+        self._first = None
+        self._last = None
+
+    def _close_segment(self):
+        self._mm.flush()
+        self._mm.close()
+        self._mm = None
+        # Obcinamy niewykorzystaną prealokację
+        self._file.truncate(self._count * RECORD_SIZE)
+        self._file.close()
+        self._file = None
+        if self._count:
+            self.segments.append({
+                "file": SEGMENT_PATTERN.format(self._segment_no),
+                "count": self._count,
+                "first_seq": self._first[0], "last_seq": self._last[0],
+                "t_mono_first": self._first[1], "t_mono_last": self._last[1],
+                "t_wall_first": self._first[2], "t_wall_last": self._last[2],
+                "x_first": self._first[3], "x_last": self._last[3],
+            })
+        self._write_index()
+
+    def _write_index(self):
+        index = {
+            "batch": self.batch,
+            "record_size": RECORD_SIZE,
+            "frame_size": PLC_FRAME_SIZE,
+            "segments": self.segments,
+        }
+        tmp_path = os.path.join(self.batch_dir, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.batch_dir, INDEX_FILE))
+
+
+class FrameReader:
+    """
+    Reader for recordings written by FrameRecorder.
+    Uses the index to find the segments overlapping a time or x range and
+    np.searchsorted on the memory-mapped records inside a segment.
+    """
+
+    def __init__(self, recording_dir):
+        """
+        Initialize the FrameReader.
+
+        Args:
+            recording_dir: Directory of one recording (contains index.json)
+        """
+        self.recording_dir = recording_dir
+        index_path = os.path.join(recording_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"batch": None, "segments": []}
+        self.segments = list(self.index["segments"])
+        self._add_unindexed_segments()
+
+    def _add_unindexed_segments(self):
+        """Dołącza segmenty bez wpisu w indeksie (np. po awarii procesu akwizycji)."""
+        known = {seg["file"] for seg in self.segments}
+        for name in sorted(os.listdir(self.recording_dir)):
+            if not name.startswith("seg_") or name in known:
+                continue
+            records = self._map(name)
+            # Prealokowany, niezapisany ogon ma seq == 0
+            count = int(np.argmax(records["seq"] == 0)) if (records["seq"] == 0).any() else len(records)
+            if count == 0:
+                continue
+            first, last = records[0], records[count - 1]
+            self.segments.append({
+                "file": name, "count": count,
+                "first_seq": int(first["seq"]), "last_seq": int(last["seq"]),
+                "t_mono_first": float(first["t_mono"]), "t_mono_last": float(last["t_mono"]),
+                "t_wall_first": float(first["t_wall"]), "t_wall_last": float(last["t_wall"]),
+                "x_first": float(first["x"]), "x_last": float(last["x"]),
+            })
+
+    def _map(self, name):
+        path = os.path.join(self.recording_dir, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+
+    def records(self, segment):
+        """Return the records of one segment as a read-only structured array."""
+        return self._map(segment["file"])[:segment["count"]]
+
+    def __len__(self):
+        return sum(seg["count"] for seg in self.segments)
+
+    def _range(self, field, lo, hi):
+        parts = []
+        for seg in self.segments:
+            if seg[f"{field}_last"] < lo or seg[f"{field}_first"] > hi:
+                continue
+            recs = self.records(seg)
+            i0 = np.searchsorted(recs[field], lo, side="left")
+            i1 = np.searchsorted(recs[field], hi, side="right")
+            if i1 > i0:
+                parts.append(recs[i0:i1])
+        if not parts:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.concatenate(parts)
+
+    def time_range(self, t_min, t_max, clock="t_wall"):
+        """Return records with t_min <= timestamp <= t_max (clock: 't_wall' or 't_mono')."""
+        return self._range(clock, t_min, t_max)
+
+    def x_range(self, x_min, x_max):
+        """Return records with x_min <= x <= x_max."""
+        return self._range("x", x_min, x_max)
+
+    def iter_records(self):
+        """Iterate over all segments, yielding structured arrays of records."""
+        for seg in self.segments:
+            yield self.records(seg)
@@ -1,3 +1,7 @@
+from collections import namedtuple
+from datetime import datetime, time
+import threading
+
 import mysql.connector
 from mysql.connector import Error
 from PyQt5.QtWidgets import (
@@ -7,7 +11,41 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt, QDate
 from PyQt5.QtGui import QFont, QKeySequence
 from PyQt5.QtWidgets import QShortcut, QDateEdit
-from db_helper import check_database
+from db_helper import check_database, fetch_all, primary_key_column
+
+# Pierwsza strona i rozmiar bufora następnych wierszy pobieranych w tle
+FIRST_PAGE_ROWS = 500
+PREFETCH_ROWS = 1000
+
+# Niezmienna migawka zapytania historii (filtry, parametry, kolumna klucza)
+HistoryQuery = namedtuple("HistoryQuery", "base_query filters params id_column include_undated")
+
+
+def seek_sql(id_column, seek):
+    """
+    Warunek "po ostatnim pobranym wierszu" w porządku `Date time` DESC, id DESC.
+
+    Args:
+        id_column: Kolumna klucza głównego event (None = brak)
+        seek: (date_time, id) ostatniego wiersza, (None, id) w fazie wierszy bez czasu
+              lub None dla pierwszej strony
+
+    Returns:
+        Tuple (SQL clause or None, list of parameters)
+    """
+    if seek is None:
+        return None, []
+    date_time, event_id = seek
+    if date_time is None:
+        # Faza wierszy bez czasu: tylko po id
+        if event_id is None:
+            return "`Date time` IS NULL", []
+        return f"`Date time` IS NULL AND `{id_column}` < %s", [event_id]
+    if id_column is None or event_id is None:
+        return "`Date time` < %s", [date_time]
+    # Pierwszy warunek to czysty zakres na indeksie `Date time` (klucz główny jest jego częścią)
+    return (f"`Date time` <= %s AND (`Date time` < %s OR `{id_column}` < %s)",
+            [date_time, date_time, event_id])
 
 class HistoryPage(QFrame):
     """
@@ -40,8 +78,13 @@ class HistoryPage(QFrame):
 
         # Panel statusu bazy danych
         self.status_frame = QFrame(self.main_frame)
-        self.offset = 0
-        self.base_query = ""
+        self.query = None        # migawka zapytania bieżących filtrów (HistoryQuery)
+        self.generation = 0
+        self.seek = None
+        self.exhausted = True
+        self.buffer = []
+        self.prefetch_thread = None
+        self.page_lock = threading.Lock()
         status_layout = QHBoxLayout(self.status_frame)
         self.status_frame.setLayout(status_layout)
         status_layout.setContentsMargins(5, 5, 5, 5)
@@ -270,7 +313,7 @@ class HistoryPage(QFrame):
 
     def load_data(self, ignore_date=False):
         self.table.setRowCount(0)
-        self.offset = 0
+        self._reset_pages()
 
         if not check_database(self.controller.db_params):
             self.controller.db_connected = False
@@ -278,63 +321,145 @@ class HistoryPage(QFrame):
             self.update_db_status()
             return
 
-        filters = []
+        # Filtry jako parametry wiązane; warunki na samych kolumnach (bez funkcji) – indeksy działają
+        filters, params = [], []
         if not ignore_date:
-            start = self.start_date_edit.date().toString("yyyy-MM-dd")
-            end   = self.end_date_edit.date().toString("yyyy-MM-dd")
-            filters.append(f"DATE(`Date time`) >= '{start}'")
-            filters.append(f"DATE(`Date time`) <= '{end}'")
+            start = self.start_date_edit.date().toPyDate()
+            end = self.end_date_edit.date().addDays(1).toPyDate()
+            # Zakres półotwarty [start, end) zamiast DATE(...)
+            filters.append("`Date time` >= %s AND `Date time` < %s")
+            params += [datetime.combine(start, time.min), datetime.combine(end, time.min)]
 
         for col, val in (
             ("Batch nr", self.batch_entry.text().strip()),
             ("Product nr", self.product_entry.text().strip())
         ):
             if val:
-                filters.append(f"{col} LIKE '%{val}%'")
+                # Wyszukiwanie fragmentu numeru (jak dotychczas), wartość jako parametr
+                filters.append(f"`{col}` LIKE %s")
+                params.append(f"%{val}%")
 
         # Filtruj po typie alarmu tylko, gdy nie wybrano opcji "Wszystkie"
         selected_alarm = self.alarm_combo.currentText().strip()
         if selected_alarm and selected_alarm != "Wszystkie":
-            filters.append(f"alarm_type = '{selected_alarm}'")
+            filters.append("alarm_type = %s")
+            params.append(selected_alarm)
 
-        self.base_query = """
-            SELECT DATE_FORMAT(`Date time`, '%Y-%m-%d') AS data,
-                DATE_FORMAT(`Date time`, '%H:%i:%s') AS godzina,
+        id_column = primary_key_column(self.controller.db_params, "event")
+        id_select = f"`{id_column}`" if id_column else "NULL"
+        base_query = f"""
+            SELECT `Date time` AS date_time, {id_select} AS event_id,
                 `Batch nr` AS batch, `Product nr` AS produkt,
                 D1, D2, D3, D4,
                 `lumps number of` AS flaws, `necks number of` AS necks,
                 `X-coordinate` AS koordynat, comment, alarm_type
             FROM event
         """
-        if filters:
-            self.base_query += " WHERE " + " AND ".join(filters)
+        # Zdarzenia bez czasu (stare wiersze) są na końcu listy – tylko gdy nie filtrujemy po dacie
+        self.query = HistoryQuery(base_query, tuple(filters), tuple(params), id_column,
+                                  ignore_date and id_column is not None)
 
-        sql = self.base_query + " ORDER BY `Date time` DESC LIMIT 500"
-        self._execute_and_populate(sql)
-        self.offset = self.table.rowCount()
+        self._populate(self._take_page(FIRST_PAGE_ROWS))
         self.controller.db_connected = True
         self.update_db_status()
 
     def load_more(self, count):
-        if not self.controller.db_connected:
+        if not self.controller.db_connected or self.query is None:
             return
 
-        sql = self.base_query + f" ORDER BY `Date time` DESC LIMIT {self.offset}, {count}"
-        added = self._execute_and_populate(sql, append=True)
-        self.offset += added
+        self._populate(self._take_page(count), append=True)
+
+    # ------------------------------------------------------------------
+    # Stronicowanie po kluczu (`Date time`, id) z pobieraniem następnej strony w tle
+    def _reset_pages(self):
+        # Nowa generacja unieważnia wynik trwającego pobierania w tle
+        with self.page_lock:
+            self.generation += 1
+            self.seek = None
+            self.exhausted = False
+            self.buffer = []
+        self.query = None
+
+    def _query_page(self, query, seek, count):
+        """
+        Pobiera count wierszy po pozycji seek (na migawce query – bez odczytu stanu strony).
+
+        Returns:
+            Tuple (rows, new seek, exhausted)
+        """
+        rows = []
+        while len(rows) < count:
+            clause, seek_params = seek_sql(query.id_column, seek)
+            filters = list(query.filters)
+            if clause:
+                filters.append(clause)
+            elif not query.include_undated:
+                filters.append("`Date time` IS NOT NULL")
+            sql = query.base_query
+            if filters:
+                sql += " WHERE " + " AND ".join(filters)
+            order = "`Date time` DESC" + (f", `{query.id_column}` DESC" if query.id_column else "")
+            sql += f" ORDER BY {order} LIMIT {int(count - len(rows))}"
+            page = fetch_all(self.controller.db_params, sql, list(query.params) + seek_params)
+            rows += page
+            if page:
+                seek = (page[-1]["date_time"], page[-1]["event_id"])
+            if len(rows) >= count:
+                return rows, seek, False
+            # Strona niepełna: koniec wierszy z czasem – ewentualnie dalej wiersze bez czasu
+            if not query.include_undated or (seek is not None and seek[0] is None):
+                return rows, seek, True
+            seek = (None, None)
+        return rows, seek, False
+
+    def _take_page(self, count):
+        """Zwraca kolejne count wierszy: z bufora pobranego w tle, brakujące pobiera od razu."""
+        thread = self.prefetch_thread
+        if thread is not None:
+            thread.join()
+            self.prefetch_thread = None
+        if not self.exhausted and len(self.buffer) < count:
+            rows, self.seek, self.exhausted = self._query_page(self.query, self.seek, count - len(self.buffer))
+            self.buffer += rows
+        rows, self.buffer = self.buffer[:count], self.buffer[count:]
+        self._start_prefetch()
+        return rows
+
+    def _start_prefetch(self):
+        if self.exhausted or len(self.buffer) >= PREFETCH_ROWS:
+            return
+        # Wątek dostaje migawkę stanu – load_data może w tym czasie podmienić self.query
+        args = (self.generation, self.query, self.seek, PREFETCH_ROWS - len(self.buffer))
+        self.prefetch_thread = threading.Thread(target=self._prefetch, args=args, daemon=True)
+        self.prefetch_thread.start()
+
+    def _prefetch(self, generation, query, seek, count):
+        try:
+            rows, seek, exhausted = self._query_page(query, seek, count)
+        except Exception as e:
+            # Nie przerywamy – kolejna strona zostanie pobrana przy kliknięciu
+            print(f"[History] Prefetch error: {e}")
+            return
+        # Wątek GUI czeka na zakończenie (join) przed odczytem bufora
+        with self.page_lock:
+            if generation == self.generation:
+                self.buffer += rows
+                self.seek = seek
+                self.exhausted = exhausted
 
-    def _execute_and_populate(self, sql, append=False):
-        connection = mysql.connector.connect(**self.controller.db_params)
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        start_row = self.table.rowCount() if append else 0
+    def _populate(self, rows, append=False):
+        if not append:
+            self.table.setRowCount(0)
 
         for row in rows:
             idx = self.table.rowCount()
             self.table.insertRow(idx)
+            # Formatowanie daty po stronie aplikacji (zapytanie bez funkcji specyficznych dla MySQL)
+            date_time = row["date_time"]
             values = [
-                row["data"], row["godzina"], row["batch"], row["produkt"],
+                date_time.strftime("%Y-%m-%d") if date_time else "",
+                date_time.strftime("%H:%M:%S") if date_time else "",
+                row["batch"], row["produkt"],
                 row["D1"], row["D2"], row["D3"], row["D4"],
                 row["flaws"], row["necks"], row["koordynat"],
                 row["comment"], row["alarm_type"]
@@ -344,5 +469,4 @@ class HistoryPage(QFrame):
                 item.setTextAlignment(Qt.AlignCenter)
                 self.table.setItem(idx, col, item)
 
-        connection.close()
         return len(rows)
@@ -62,6 +62,10 @@ class MainPage(QWidget):
 
         # UI interaction state
         self.ui_busy = False  # Flag to indicate UI interaction is in progress
+        # Histereza lumps/necks/średnicy z receptury (brak pól w UI, ładowana razem z recepturą)
+        self.lump_histeresis = 0.0
+        self.neck_histeresis = 0.0
+        self.diameter_histeresis = 0.0
         self.last_save_time = 0  # Track last database save time
         self.save_in_progress = False  # Flag to prevent multiple simultaneous saves
 
@@ -907,6 +911,20 @@ class MainPage(QWidget):
         self.entry_max_necks.clear()
         self.entry_max_necks.setText(f"{new_val}")
 
+    def _update_spectrum_plot(self, plot_data):
+        """Draw either the latest spectrum or the rolling spectrogram in the FFT plot"""
+        if self.btn_spectrogram.isChecked() and hasattr(self.controller, 'spectrogram'):
+            self.plot_manager.update_spectrogram_plot(self.controller.spectrogram)
+        else:
+            self.plot_manager.update_fft_plot(
+                measurement_data=plot_data,
+                data_processing_time=plot_data.get('processing_time', 0)
+            )
+
+    def _on_fft_domain_toggled(self, checked):
+        """Switch the FFT plot between the time (Hz) and distance (1/m) spectrum"""
+        self.plot_manager.fft_domain = "distance" if checked else "time"
+
     def _adjust_flaw_window(self, delta: float):
         """Adjust the flaw window size value"""
         val_str = self.entry_flaw_window.text() or "0.5"
@@ -920,7 +938,7 @@ class MainPage(QWidget):
         self.entry_flaw_window.setText(f"{new_val:.2f}")
         
         # Update the flaw detector with the new window size if available
-        if hasattr(self, 'flaw_detector'):
+        if hasattr(self.controller, 'flaw_detector'):
             self.controller.flaw_detector.update_flaw_window_size(new_val)
 
     def _save_settings_to_db(self):
@@ -979,9 +997,9 @@ class MainPage(QWidget):
             "diameter_window": 0.0,
             "diameter_std_dev": 0.0,
             "num_scans": 128,
-            "diameter_histeresis": 0.0,
-            "lump_histeresis": 0.0,
-            "neck_histeresis": 0.0,
+            "diameter_histeresis": self.diameter_histeresis,
+            "lump_histeresis": self.lump_histeresis,
+            "neck_histeresis": self.neck_histeresis,
             "pulsation_threshold": pulsation_threshold,
             "max_ovality": max_ovality,
             "max_standard_deviation": max_std_dev
@@ -1306,6 +1324,31 @@ class MainPage(QWidget):
         right_layout.setRowStretch(3, 1)  # FFT plot
         right_layout.setColumnStretch(0, 1)
 
+        view_frame = QFrame(self.right_panel)
+        view_layout = QHBoxLayout(view_frame)
+        view_layout.setContentsMargins(0, 0, 0, 0)
+        view_frame.setLayout(view_layout)
+        right_layout.addWidget(view_frame, 0, 0)
+
+        # Przełącznik widoku: ostatnie próbki / cała partia (historia wielopoziomowa)
+        self.btn_whole_batch = QPushButton("Cała partia", view_frame)
+        self.btn_whole_batch.setCheckable(True)
+        self.btn_whole_batch.setFixedHeight(40)
+        view_layout.addWidget(self.btn_whole_batch)
+
+        # Przełącznik FFT / spektrogram (historia ostatnich widm)
+        self.btn_spectrogram = QPushButton("Spektrogram", view_frame)
+        self.btn_spectrogram.setCheckable(True)
+        self.btn_spectrogram.setFixedHeight(40)
+        view_layout.addWidget(self.btn_spectrogram)
+
+        # Przełącznik domeny FFT: Hz / cykle na metr
+        self.btn_fft_distance = QPushButton("FFT [1/m]", view_frame)
+        self.btn_fft_distance.setCheckable(True)
+        self.btn_fft_distance.setFixedHeight(40)
+        self.btn_fft_distance.toggled.connect(self._on_fft_domain_toggled)
+        view_layout.addWidget(self.btn_fft_distance)
+
         # -----------------------
         # Status plot – row 1
         # -----------------------
@@ -1435,6 +1478,8 @@ class MainPage(QWidget):
     def _on_ack(self):
         """Handle Kwituj button press by asynchronously resetting all PLC counters."""
         print("[GUI] Kwituj pressed!")
+        # Kwitowanie common fault – analiza przejmuje zmianę licznika w najbliższym cyklu
+        self.controller.ack_seq += 1
         
         try:
             # Przygotuj komendę resetu dla przycisku Kwituj.
@@ -1662,7 +1707,17 @@ class MainPage(QWidget):
                 # print(f"[MainPage] Plot data ready: {num_points} points, X range: {window_data['x_history'][0]:.1f}-{self.current_x:.1f}m")
             
             # Force a direct update in the main thread to ensure plots are visible even if process is not working
-            if not hasattr(self.plot_manager, 'plot_process') or not self.plot_manager.plot_process or not self.plot_manager.plot_process.is_alive():
+            if self.btn_whole_batch.isChecked():
+                # Widok całej partii – wykresy z historii zagregowanej (poziom dobrany do zakresu)
+                history = self.controller.acquisition_buffer.get_history()
+                self.plot_manager.update_history_plots(
+                    history,
+                    self.current_x,
+                    plot_data['batch_name'],
+                    diameter_preset
+                )
+                self._update_spectrum_plot(plot_data)
+            elif not hasattr(self.plot_manager, 'plot_process') or not self.plot_manager.plot_process or not self.plot_manager.plot_process.is_alive():
                 self.plot_manager.update_status_plot(
                     plot_data['x_history'], 
                     plot_data['lumps_history'], 
@@ -1679,10 +1734,7 @@ class MainPage(QWidget):
                     plot_data['diameter_preset'],
                     plot_data['plc_sample_time']
                 )
-                self.plot_manager.update_fft_plot(
-                    measurement_data=plot_data,
-                    data_processing_time=plot_data.get('processing_time', 0)
-                )
+                self._update_spectrum_plot(plot_data)
 
                 # modulated_history = self.plot_manager.apply_pulsation(plot_data['diameter_history'], sample_rate=100, modulation_frequency=10, modulation_depth=0.5)
                 # self.plot_manager.update_fft_plot(
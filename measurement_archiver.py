@@ -0,0 +1,356 @@
+"""
+Measurement archiver module for AccuScan application.
+Background archival of the raw sample stream to the `measurement` table and
+of one aggregate row per metre of product to `measurement_metre`: the data
+receiver copies each batch into a preallocated columnar chunk and updates
+the per-metre rollup (no database work on the acquisition path), sealed
+chunks are queued and a single thread with a persistent MySQL connection
+writes them with multi-row INSERTs. When the database falls behind the queue
+sheds the oldest chunks instead of blocking acquisition.
+"""
+
+from collections import deque
+import threading
+import time
+
+import numpy as np
+from mysql.connector import Error
+
+from data_processing import HistoryTier
+from db_helper import save_measurement_chunk, METRE_STAT_KEYS
+from db_migrations import try_migrate
+import storage
+
+
+# Kolumny numeryczne chunku (nazwa w partii samples_to_columns -> dtype)
+CHUNK_COLUMNS = (
+    ("D1", np.float64), ("D2", np.float64), ("D3", np.float64), ("D4", np.float64),
+    ("xCoord", np.float64), ("speed", np.float64),
+    ("lumps_delta", np.int64), ("necks_delta", np.int64), ("status_plc", np.int64),
+)
+
+# Kanały agregatu metrowego (wiersze `values` dla HistoryTier)
+ROLLUP_CHANNELS = ("avg", "D1", "D2", "D3", "D4", "ovality")
+
+
+class MeasurementChunk:
+    """
+    Fixed-size columnar block of samples of one batch/product.
+    """
+
+    def __init__(self, rows, batch, product):
+        self.arrays = {key: np.zeros(rows, dtype=dtype) for key, dtype in CHUNK_COLUMNS}
+        self.timestamps = []
+        self.metres = []     # wiersze measurement_metre zamknięte przed zapieczętowaniem chunku
+        self.rows = rows
+        self.n = 0
+        self.batch = batch
+        self.product = product
+        self.created = time.perf_counter()
+
+    def append(self, columns, start, count):
+        """Copy `count` samples from position `start` of a columnar batch; returns the number copied."""
+        count = min(count, self.rows - self.n)
+        end = self.n + count
+        for key, _ in CHUNK_COLUMNS:
+            column = columns.get(key)
+            if column is not None:
+                self.arrays[key][self.n:end] = column[start:start + count]
+        self.timestamps.extend(columns["timestamp"][start:start + count])
+        self.n = end
+        return count
+
+    def full(self):
+        return self.n >= self.rows
+
+    def rows_for_insert(self):
+        """Rows in the column order of MEASUREMENT_INSERT_COLUMNS (Python types for the connector)."""
+        n = self.n
+        lists = {key: self.arrays[key][:n].tolist() for key, _ in CHUNK_COLUMNS}
+        return list(zip(
+            self.timestamps[:n], lists["xCoord"], [self.batch] * n, [self.product] * n,
+            lists["status_plc"], lists["D1"], lists["D2"], lists["D3"], lists["D4"],
+            lists["lumps_delta"], lists["necks_delta"], lists["speed"],
+        ))
+
+
+def _metre_row(summary, date_time, batch, product):
+    """Wiersz measurement_metre (kolejność METRE_INSERT_COLUMNS) z podsumowania kubełka HistoryTier."""
+    stats = tuple(
+        summary[f"{key}_{stat}"] for key in METRE_STAT_KEYS for stat in ("mean", "min", "max", "std")
+    )
+    return (
+        (date_time, batch, product, summary["bucket_id"], summary["samples"])
+        + stats
+        + (summary["ovality_mean"], summary["ovality_max"],
+           summary["lumps"], summary["necks"], summary["speed"])
+    )
+
+
+class MeasurementArchiver:
+    """
+    Asynchronous, chunked writer of raw samples to the `measurement` table
+    and of per-metre aggregates to `measurement_metre`.
+
+    add_columns() only copies arrays into the open chunk and updates a 1 m
+    HistoryTier (sums, min/max and counts per metre), so its cost does not
+    depend on the database. Each completed metre becomes one row written with
+    the next chunk. A chunk is sealed when full, when the batch or product
+    changes, or after flush_interval; at most max_pending_chunks sealed
+    chunks wait for the writer, older ones are dropped and counted.
+    """
+
+    def __init__(self, db_params, chunk_rows=512, flush_interval=2.0, max_pending_chunks=64,
+                 rows_per_insert=256, min_backoff=0.5, max_backoff=30.0,
+                 archive_raw=True, metre_size=1.0):
+        """
+        Initialize the MeasurementArchiver.
+
+        Args:
+            db_params: Database connection parameters
+            chunk_rows: Samples per chunk (one transaction per chunk)
+            flush_interval: Seal and write a partial chunk at least this often [s]
+            max_pending_chunks: Sealed chunks kept while the database is slow or down
+            rows_per_insert: Rows per multi-row INSERT statement
+            min_backoff: First retry delay after a database error [s]
+            max_backoff: Upper bound of the retry delay [s]
+            archive_raw: Write every sample to `measurement` (False = only the per-metre rollup)
+            metre_size: Length of product aggregated into one rollup row [m]
+        """
+        self.db_params = db_params
+        self.archive_raw = archive_raw
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.rows_per_insert = rows_per_insert
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.chunk = None
+        self.pending = deque(maxlen=max_pending_chunks)
+        self.writing = None      # chunk zapisywany właśnie przez _flush (nie może zostać usunięty)
+
+        # Agregat metrowy liczony przyrostowo (pierścień niepotrzebny – wiersze idą do bazy)
+        self.rollup = HistoryTier(metre_size, max_buckets=1, channels=ROLLUP_CHANNELS,
+                                  on_close=self._on_metre_closed)
+        self.rollup_key = None
+        self.closed_metres = []
+        self.metre_rows = []
+        self.last_timestamp = None
+        self.wakeup = threading.Event()
+        self.connection = None
+        self.backoff = 0.0
+        self.retry_at = 0.0
+
+        # Statystyki do diagnostyki
+        self.written_rows = 0
+        self.written_metres = 0
+        self.dropped_rows = 0
+        self.dropped_metres = 0
+        self.failed_flushes = 0
+        self.last_flush_time = 0.0
+        self.last_error = None
+        self.last_drop_report = 0.0
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add_columns(self, columns, batch="", product=""):
+        """
+        Archive a columnar batch (after FastAcquisitionBuffer.add_samples(), which adds xCoord).
+
+        Args:
+            columns: Batch from samples_to_columns() with xCoord
+            batch: Batch name the samples belong to
+            product: Product name the samples belong to
+        """
+        n = len(columns["timestamp"])
+        if n == 0:
+            return
+        start = 0 if self.archive_raw else n
+        with self.lock:
+            self._update_rollup(columns, batch, product)
+            while start < n:
+                chunk = self.chunk
+                if chunk is not None and (chunk.batch != batch or chunk.product != product):
+                    self._seal()
+                    chunk = None
+                if chunk is None:
+                    chunk = self.chunk = MeasurementChunk(self.chunk_rows, batch, product)
+                start += chunk.append(columns, start, n - start)
+                if chunk.full():
+                    self._seal()
+            if self.chunk is not None and time.perf_counter() - self.chunk.created >= self.flush_interval:
+                self._seal()
+
+    def _update_rollup(self, columns, batch, product):
+        """Dodaje partię do agregatu metrowego; zamknięte metry trafiają do metre_rows (lock trzymany)."""
+        if self.rollup_key != (batch, product):
+            # Nowy batch/produkt – domykamy bieżący metr starego batcha
+            self.rollup.close()
+            self._stamp_closed_metres(None, None)
+            self.rollup_key = (batch, product)
+
+        diameters = np.vstack([np.asarray(columns[key], dtype=np.float64) for key in ("D1", "D2", "D3", "D4")])
+        valid = (diameters != 0).all(axis=0)
+        avg = diameters.mean(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ovality = np.where(valid, (diameters.max(axis=0) - diameters.min(axis=0)) / avg * 100.0, 0.0)
+        values = np.vstack([avg[None, :], diameters, ovality[None, :]])
+        x = np.asarray(columns["xCoord"], dtype=np.float64)
+        self.rollup.update(
+            x, values, valid,
+            np.asarray(columns["lumps_delta"], dtype=np.int64),
+            np.asarray(columns["necks_delta"], dtype=np.int64),
+            np.asarray(columns["speed"], dtype=np.float64),
+        )
+        self._stamp_closed_metres(x, columns["timestamp"])
+        self.last_timestamp = columns["timestamp"][-1]
+
+    def _on_metre_closed(self, summary):
+        self.closed_metres.append(summary)
+
+    def _stamp_closed_metres(self, x, timestamps):
+        """Czas metru = czas jego ostatniej próbki (z bieżącej albo poprzedniej partii)."""
+        batch, product = self.rollup_key or ("", "")
+        for summary in self.closed_metres:
+            date_time = self.last_timestamp
+            if x is not None:
+                last = int(np.searchsorted(x, summary["x_end"], side="left")) - 1
+                if last >= 0:
+                    date_time = timestamps[last]
+            self.metre_rows.append(_metre_row(summary, date_time, batch, product))
+        self.closed_metres = []
+
+    def backlog(self):
+        """Number of samples waiting for the database (sealed chunks and the open chunk)."""
+        with self.lock:
+            return sum(chunk.n for chunk in self.pending) + (self.chunk.n if self.chunk else 0)
+
+    def stats(self):
+        """Return counters of the archival stage."""
+        return {
+            "written_rows": self.written_rows,
+            "written_metres": self.written_metres,
+            "dropped_rows": self.dropped_rows,
+            "dropped_metres": self.dropped_metres,
+            "pending_chunks": len(self.pending),
+            "failed_flushes": self.failed_flushes,
+            "last_flush_time": self.last_flush_time,
+        }
+
+    def stop(self, timeout=3.0):
+        """Stop the writer thread after a final write attempt of the pending chunks."""
+        with self.lock:
+            self.rollup.close()
+            self._stamp_closed_metres(None, None)
+            self._seal()
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=timeout)
+
+    # ------------------------------------------------------------------
+    def _seal(self):
+        """Move the open chunk to the write queue (lock held by the caller)."""
+        chunk, self.chunk = self.chunk, None
+        metres, self.metre_rows = self.metre_rows, []
+        if chunk is None:
+            if not metres:
+                return
+            chunk = MeasurementChunk(0, "", "")
+        chunk.metres.extend(metres)
+        if chunk.n == 0 and not chunk.metres:
+            return
+        if len(self.pending) == self.pending.maxlen:
+            # Kolejka pełna – usuwamy najstarszy chunk poza zapisywanym, akwizycja nie czeka
+            victim = next((queued for queued in self.pending if queued is not self.writing), None)
+            if victim is None:
+                victim = chunk
+            else:
+                self.pending.remove(victim)
+                self.pending.append(chunk)
+            self.dropped_rows += victim.n
+            self.dropped_metres += len(victim.metres)
+            now = time.perf_counter()
+            if now - self.last_drop_report > 10.0:
+                self.last_drop_report = now
+                print(f"[Archiver] Database too slow, dropped {self.dropped_rows} samples so far")
+        else:
+            self.pending.append(chunk)
+        self.wakeup.set()
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            with self.lock:
+                if self.chunk is not None and time.perf_counter() - self.chunk.created >= self.flush_interval:
+                    self._seal()
+                elif self.metre_rows and not self.archive_raw:
+                    self._seal()
+            if time.perf_counter() < self.retry_at:
+                continue
+            while self.running and self.pending and self._flush():
+                pass
+
+        while self.pending and time.perf_counter() >= self.retry_at and self._flush():
+            pass
+        if self.pending:
+            print(f"[Archiver] {sum(chunk.n for chunk in self.pending)} samples not archived at shutdown")
+        self._close_connection()
+
+    def _flush(self):
+        """Write the oldest pending chunk; returns True on success."""
+        with self.lock:
+            if not self.pending:
+                return False
+            chunk = self.writing = self.pending[0]
+        start = time.perf_counter()
+        try:
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = storage.connect(self.db_params)
+                try_migrate(self.connection)
+            self.written_rows += save_measurement_chunk(
+                self.connection, chunk.rows_for_insert(), chunk.metres, self.rows_per_insert
+            )
+            self.written_metres += len(chunk.metres)
+            with self.lock:
+                # Zapisywany chunk nie jest usuwany przez _seal, więc nadal jest pierwszy
+                self.pending.popleft()
+                self.writing = None
+            self.backoff = 0.0
+            self.retry_at = 0.0
+            ok = True
+        except Exception as e:
+            self.failed_flushes += 1
+            self.last_error = str(e)
+            self._close_connection()
+            if storage.is_row_error(e):
+                # Chunk z wierszem, którego nie da się zapisać – odrzucony, żeby nie blokował kolejki
+                with self.lock:
+                    if self.pending and self.pending[0] is chunk:
+                        self.pending.popleft()
+                        self.dropped_rows += chunk.n
+                        self.dropped_metres += len(chunk.metres)
+                    self.writing = None
+                print(f"[Archiver] Chunk of {chunk.n} samples rejected by the database: {e}")
+                self.last_flush_time = time.perf_counter() - start
+                return True
+            self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+            self.retry_at = time.perf_counter() + self.backoff
+            print(f"[Archiver] {type(e).__name__}, {len(self.pending)} chunks pending, "
+                  f"retry in {self.backoff:.1f}s: {e}")
+            with self.lock:
+                self.writing = None
+            ok = False
+        self.last_flush_time = time.perf_counter() - start
+        return ok
+
+    def _close_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Error:
+                pass
+        self.connection = None
@@ -158,17 +158,17 @@ def disconnect_plc(client_or_ip):
     else:
         print(f"[PLC Helper] No lock found for {disconnect_key}, can't disconnect safely")
 
-def read_plc_data(client: snap7.client.Client, db_number: int = 2) -> dict:
+# Rozmiar ramki DB2 odczytywanej w każdym cyklu (bajty)
+PLC_FRAME_SIZE = 56
+
+
+def read_plc_frame(client: snap7.client.Client, db_number: int = 2) -> bytearray:
     """
-    Odczytuje strukturę danych z DB sterownika (np. DB2) i zwraca wyniki
-    jako słownik z nazwami kluczowymi (np. 'D1', 'D2', 'lumps').
-    
+    Odczytuje surową ramkę (PLC_FRAME_SIZE bajtów) z DB sterownika.
+
     Handles "Job pending" errors with retries.
     """
-    if OFFLINE_MODE or not client:
-        return {"D1": 0, "D2": 0, "D3": 0, "D4": 0, "lumps": 0, "necks": 0}
-
-    size = 56  # Rozmiar w bajtach, wymagany do odczytu offsetu (bylo 48)
+    size = PLC_FRAME_SIZE  # Rozmiar w bajtach, wymagany do odczytu offsetu (bylo 48)
     start = 0
     
     # Try with retries for job pending errors
@@ -194,6 +194,14 @@ def read_plc_data(client: snap7.client.Client, db_number: int = 2) -> dict:
     if not read_success:
         raise RuntimeError("[PLC Helper] Failed to read data from PLC after multiple retries")
 
+    return raw_data
+
+
+def parse_plc_frame(raw_data) -> dict:
+    """
+    Dekoduje surową ramkę DB2 (np. z read_plc_frame lub z nagrania)
+    do słownika z nazwami kluczowymi (np. 'D1', 'D2', 'lumps').
+    """
     # Przykładowe odczyty (offsety dopasowane do struktury w PLC):
     status_byte = get_byte(raw_data, 0)
     d1 = get_real(raw_data, 2)
@@ -243,6 +251,68 @@ def read_plc_data(client: snap7.client.Client, db_number: int = 2) -> dict:
         "lamp_control": lamp_control,
     }
 
+
+def compute_counter_delta(current: int, previous: int) -> int:
+    """
+    Zwraca przyrost licznika lumps/necks między dwoma odczytami.
+    Jeśli bieżąca wartość jest mniejsza, licznik w PLC został zresetowany
+    lub przepełniony – wtedy przyrostem jest sama bieżąca wartość.
+    """
+    if current >= previous:
+        return current - previous
+    return current
+
+
+# Słowo sterujące lampki/common fault (bajt 27 obszaru Out = offset 55 w DB2)
+CONTROL_BYTE_OFFSET = 55
+CONTROL_LAMP_ON_BIT = 0      # common fault aktywny – zapal lampkę
+CONTROL_LAMP_OFF_BIT = 1     # żądanie zgaszenia lampki (kwitowanie)
+# Bit słowa statusowego (status_plc), którym PLC potwierdza, że lampka świeci
+STATUS_LAMP_BIT = 0
+
+
+def control_byte(lamp_on: bool, lamp_off: bool) -> int:
+    """
+    Składa bajt sterujący lampki z bitów lamp_on / lamp_off.
+    """
+    return (int(bool(lamp_on)) << CONTROL_LAMP_ON_BIT) | (int(bool(lamp_off)) << CONTROL_LAMP_OFF_BIT)
+
+
+def write_plc_byte(client: snap7.client.Client, offset: int, value: int, db_number: int = 2) -> None:
+    """
+    Zapisuje pojedynczy bajt w DB (np. słowo sterujące lampki), bez nadpisywania
+    pozostałych nastaw obszaru 'Out' – w odróżnieniu od write_plc_data.
+
+    Handles "Job pending" errors with retries.
+    """
+    retry_count = 0
+    max_retries = 3
+    while True:
+        try:
+            client.db_write(db_number, offset, bytearray([value & 0xFF]))
+            return
+        except Exception as e:
+            if "CLI: Job pending" in str(e) and retry_count < max_retries:
+                import time
+                time.sleep(0.01 * (retry_count + 1))
+                retry_count += 1
+                print(f"[PLC Helper] Job pending on byte write, retrying {retry_count}/{max_retries}")
+            else:
+                raise
+
+
+def read_plc_data(client: snap7.client.Client, db_number: int = 2) -> dict:
+    """
+    Odczytuje strukturę danych z DB sterownika (np. DB2) i zwraca wyniki
+    jako słownik z nazwami kluczowymi (np. 'D1', 'D2', 'lumps').
+    
+    Handles "Job pending" errors with retries.
+    """
+    if OFFLINE_MODE or not client:
+        return {"D1": 0, "D2": 0, "D3": 0, "D4": 0, "lumps": 0, "necks": 0}
+
+    return parse_plc_frame(read_plc_frame(client, db_number))
+
 def write_plc_data(
     client: snap7.client.Client,
     db_number: int = 2,
@@ -259,16 +329,16 @@ def write_plc_data(
     neck_threshold: float=None,
     flaw_mode: int=16386,
     upper_tol: float=None,
-    under_tol: float=None,
-    lamp_on: bool=False,
-    lamp_off: bool=False
+    under_tol: float=None
 
 ) -> None:
     """
-    Zapisuje wybrane ustawienia 'Out' w DB2 (np. offset od 28 w górę).
+    Zapisuje wybrane ustawienia 'Out' w DB2 (offsety 28-54).
     Jeśli użytkownik nie poda wartości dla średnicy lub progów, pozostaną one niezmienione.
+    Bajt sterujący lampki (offset 55) nie jest zapisywany – należy do CommonFaultAggregator
+    (write_plc_byte), więc resety liczników nie gaszą zatrzaśniętej lampki.
     """
-    size = 28  # Zakładany rozmiar (bajty) do zapisu od offsetu 28
+    size = CONTROL_BYTE_OFFSET - 28  # 27 bajtów od offsetu 28, bez bajtu sterującego lampki
     retry_count = 0
     max_retries = 3
     read_success = False
@@ -313,8 +383,6 @@ def write_plc_data(
     # REAL upper_tol, under_tol
     set_real(write_data, 18, upper_tol if upper_tol is not None else 0.3)
     set_real(write_data, 22, under_tol if under_tol is not None else 0.3)
-    set_bool(write_data, 27, 0, lamp_on if lamp_on else False)
-    set_bool(write_data, 27, 1, lamp_off if lamp_off else False)
     # print(f"[PLC Helper] Data prepared for write: {write_data.hex()}")    
 
     # Zapis do DB (offset 22 w pamięci PLC) with error handling and retry
@@ -0,0 +1,221 @@
+"""
+Replay module for AccuScan application.
+Feeds recorded PLC frames (FrameRecorder) or recorded sample dicts back into
+the live pipeline (data receiver -> FastAcquisitionBuffer -> FlawDetector ->
+AlarmManager) at 1x, Nx or maximum speed, driven by a virtual clock.
+"""
+
+import json
+import os
+import queue
+import time
+from datetime import datetime
+
+from plc_helper import parse_plc_frame, compute_counter_delta
+
+
+def parse_speed(value):
+    """
+    Parse a replay speed argument: '1', '10', '2.5x' or 'max'.
+    Returns None for maximum speed.
+    """
+    if value is None:
+        return 1.0
+    text = str(value).strip().lower().rstrip("x")
+    if text in ("max", "maximum", "0", "inf"):
+        return None
+    return float(text)
+
+
+class VirtualClock:
+    """
+    Virtual clock mapping recording time onto replay time.
+    At speed N one second of recording takes 1/N seconds of wall time;
+    speed None replays as fast as the pipeline accepts samples.
+    """
+
+    def __init__(self, speed=1.0):
+        """
+        Initialize the VirtualClock.
+
+        Args:
+            speed: Replay speed factor (None = maximum speed)
+        """
+        self.speed = speed
+        self.t_record0 = None
+        self.t_wall0 = None
+        self.t_record = None
+
+    def wait_until(self, t_record):
+        """Advance the clock to t_record, sleeping as needed to keep the replay pace."""
+        if self.t_record0 is None:
+            self.t_record0 = t_record
+            self.t_wall0 = time.perf_counter()
+        self.t_record = t_record
+        if self.speed is None:
+            return
+        target = self.t_wall0 + (t_record - self.t_record0) / self.speed
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def now(self):
+        """Current virtual time (recording epoch seconds) or None before the first sample."""
+        return self.t_record
+
+
+class ReplayEngine:
+    """
+    Produces the same sample dicts as the acquisition process from a recording.
+    Lump/neck deltas are recomputed from the recorded PLC counters exactly as
+    in the acquisition loop, and timestamps come from the recording, so the
+    downstream pipeline sees identical input at any replay speed.
+    """
+
+    def __init__(self, source, speed=1.0):
+        """
+        Initialize the ReplayEngine.
+
+        Args:
+            source: Recording directory (FrameRecorder), a .jsonl file with one
+                    sample dict per line, or an iterable of sample dicts
+            speed: Replay speed factor (None = maximum speed)
+        """
+        self.source = source
+        self.clock = VirtualClock(speed)
+        self.samples_sent = 0
+
+    def iter_samples(self):
+        """Yield sample dicts in recording order."""
+        if isinstance(self.source, str) and os.path.isdir(self.source):
+            yield from self._iter_frames(self.source)
+        elif isinstance(self.source, str):
+            yield from self._iter_jsonl(self.source)
+        else:
+            for sample in self.source:
+                yield dict(sample)
+
+    def _iter_frames(self, recording_dir):
+        from frame_recorder import FrameReader
+
+        reader = FrameReader(recording_dir)
+        lumps_prev = necks_prev = 0
+        lumps_total = necks_total = 0
+        for records in reader.iter_records():
+            for rec in records:
+                data = parse_plc_frame(bytes(rec["frame"]))
+                delta_lumps = compute_counter_delta(data.get("lumps", 0), lumps_prev)
+                delta_necks = compute_counter_delta(data.get("necks", 0), necks_prev)
+                lumps_prev = data.get("lumps", 0)
+                necks_prev = data.get("necks", 0)
+                lumps_total += delta_lumps
+                necks_total += delta_necks
+                data["lumps_software"] = lumps_total
+                data["necks_software"] = necks_total
+                data["lumps_delta"] = delta_lumps
+                data["necks_delta"] = delta_necks
+                data["t_record"] = float(rec["t_wall"])
+                data["timestamp"] = datetime.fromtimestamp(float(rec["t_wall"]))
+                data["frame_seq"] = int(rec["seq"])
+                data["plc_read_time"] = 0.0
+                data["plc_reset_time"] = 0.0
+                yield data
+
+    def _iter_jsonl(self, path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                data = json.loads(line)
+                ts = data.get("timestamp")
+                if isinstance(ts, (int, float)):
+                    data["timestamp"] = datetime.fromtimestamp(ts)
+                elif isinstance(ts, str):
+                    data["timestamp"] = datetime.fromisoformat(ts)
+                yield data
+
+    def run(self, data_queue, process_running=None, run_measurement=None):
+        """
+        Push all samples into data_queue, paced by the virtual clock.
+        Uses blocking puts so no sample is dropped even at maximum speed.
+
+        Args:
+            data_queue: Queue consumed by the data receiver
+            process_running: Optional shared Value; replay stops when it becomes 0
+            run_measurement: Optional shared Value; replay pauses while it is 0
+
+        Returns:
+            Number of samples sent
+        """
+        for data in self.iter_samples():
+            while run_measurement is not None and not run_measurement.value:
+                if process_running is not None and not process_running.value:
+                    return self.samples_sent
+                time.sleep(0.01)
+            if process_running is not None and not process_running.value:
+                break
+            ts = data.get("timestamp")
+            t_record = data.pop("t_record", None) or (ts.timestamp() if ts is not None else None)
+            if t_record is not None:
+                self.clock.wait_until(t_record)
+            while True:
+                try:
+                    data_queue.put(data, timeout=0.5)
+                    break
+                except queue.Full:
+                    if process_running is not None and not process_running.value:
+                        return self.samples_sent
+            self.samples_sent += 1
+        return self.samples_sent
+
+
+def replay_process_worker(source, speed, data_queue, process_running, run_measurement, finished_flag):
+    """
+    Process target replacing the acquisition process in replay mode.
+
+    Args:
+        source: Recording directory or .jsonl file
+        speed: Replay speed factor (None = maximum speed)
+        data_queue: Multiprocessing Queue for sending data back to main process
+        process_running: Shared Value flag indicating if process should continue running
+        run_measurement: Shared Value flag; samples are only sent while it is set
+        finished_flag: Shared Value set to 1 when the whole recording was sent
+    """
+    print(f"[Replay] Replaying {source} at {'max' if speed is None else f'{speed:g}x'} speed")
+    engine = ReplayEngine(source, speed)
+    start = time.perf_counter()
+    sent = engine.run(data_queue, process_running, run_measurement)
+    elapsed = time.perf_counter() - start
+    print(f"[Replay] Sent {sent} samples in {elapsed:.2f}s")
+    finished_flag.value = 1
+
+
+class AlarmEventLog:
+    """
+    AlarmManager event listener writing every alarm transition as one JSON line.
+    Reports of two code versions replayed on the same recording can be diffed.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the AlarmEventLog.
+
+        Args:
+            path: Output .jsonl file
+        """
+        self.path = path
+        self.count = 0
+        self._file = open(path, "w")
+
+    def __call__(self, event_data):
+        record = {
+            key: (value.isoformat() if isinstance(value, datetime) else value)
+            for key, value in event_data.items()
+        }
+        self._file.write(json.dumps(record, sort_keys=True) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
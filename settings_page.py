@@ -1,7 +1,7 @@
 import mysql.connector
 from mysql.connector import Error
 from datetime import datetime
-from db_helper import check_database
+from db_helper import check_database, fetch_all, execute_write, pool_metrics
 from PyQt5.QtWidgets import QFrame, QGridLayout, QHBoxLayout, QLabel, QPushButton, QMessageBox, QLineEdit, QTableWidgetItem, QDialog, QApplication, QShortcut, QMenu, QAction, QCheckBox
 from PyQt5.QtGui import QFont, QKeySequence
 from PyQt5.QtWidgets import QWidget, QHBoxLayout, QPushButton, QLabel, QSpacerItem, QSizePolicy, QTableWidget, QHeaderView
@@ -70,7 +70,13 @@ class SettingsPage(QFrame):
     def update_db_status(self):
         """Aktualizuje etykietę statusu połączenia z bazą."""
         if self.controller.db_connected:
-            self.db_status_label.setText("Status bazy danych: Połączono")
+            metrics = pool_metrics()
+            self.db_status_label.setText(
+                "Status bazy danych: Połączono "
+                f"(pobrania z puli: {metrics['acquired']}, "
+                f"śr. oczekiwanie: {metrics['acquire_wait_avg'] * 1000:.1f} ms, "
+                f"wyczerpanie puli: {metrics['pool_exhausted']})"
+            )
             self.db_status_label.setStyleSheet("color: green;")
         else:
             self.db_status_label.setText("Status bazy danych: Brak połączenia")
@@ -373,26 +379,24 @@ class SettingsPage(QFrame):
             return
 
         try:
-            connection = mysql.connector.connect(**self.controller.db_params)
-            cursor = connection.cursor(dictionary=True)
-            
             filter_text = self.filter_entry.text().strip()
             if filter_text:
                 sql = "SELECT * FROM settings WHERE `Product nr` LIKE %s ORDER BY `Id Settings` DESC"
-                cursor.execute(sql, (f"%{filter_text}%",))
+                rows = fetch_all(self.controller.db_params, sql, (f"%{filter_text}%",))
             else:
                 sql = """
                     SELECT `Id Settings` AS id_settings, `Recipe name`, `Product nr`, `Preset Diameter`, 
                         `Diameter Over tolerance`, `Diameter Under tolerance`, `Lump threshold`, 
                         `Neck threshold`, `Flaw Window`, `Max lumps in flaw window`, 
-                        `Max necks in flaw window`, `Pulsation_threshold`, `Max_ovality`, `Max_standard_deviation`, `created_at`
+                        `Max necks in flaw window`, `Pulsation_threshold`, `Max_ovality`, `Max_standard_deviation`,
+                        `Lump histeresis`, `Neck histeresis`, `Diameter histeresis`, `created_at`
                     FROM settings 
                     ORDER BY id_settings DESC
                 """
-                cursor.execute(sql)
-            
-            rows = cursor.fetchall()
+                rows = fetch_all(self.controller.db_params, sql)
             
+            # Histerezy nie są wyświetlane w tabeli – trzymamy je po id receptury
+            self.recipe_histeresis = {}
             for row in rows:
                 id_val = row.get("id_settings") or row.get("Id Settings")
                 recipe_name = row.get("Recipe name") or ""
@@ -408,6 +412,11 @@ class SettingsPage(QFrame):
                 pulsation_threshold = row.get("Pulsation_threshold") or 0
                 max_ovality = row.get("Max_ovality") or 0
                 max_standard_deviation = row.get("Max_standard_deviation") or 0
+                self.recipe_histeresis[str(id_val)] = (
+                    float(row.get("Lump histeresis") or 0.0),
+                    float(row.get("Neck histeresis") or 0.0),
+                    float(row.get("Diameter histeresis") or 0.0)
+                )
                 created_at = row.get("created_at")
                 if created_at:
                     created_at = created_at.strftime("%Y-%m-%d %H:%M:%S")
@@ -431,9 +440,6 @@ class SettingsPage(QFrame):
                     self.table.setItem(current_row, col, item)
 
             
-            if connection and connection.is_connected():
-                connection.close()
-            
             # Aktualizacja statusu bazy danych
             self.controller.db_connected = True
             self.update_db_status()
@@ -491,6 +497,9 @@ class SettingsPage(QFrame):
         main_page.entry_pulsation_threshold.setText(pulsation_threshold)
         main_page.entry_max_ovality.setText(max_ovality)
         main_page.entry_max_std_dev.setText(max_standard_deviation)
+        recipe_id = self.table.item(row, 0).text() if self.table.item(row, 0) else ""
+        main_page.lump_histeresis, main_page.neck_histeresis, main_page.diameter_histeresis = \
+            getattr(self, "recipe_histeresis", {}).get(recipe_id, (0.0, 0.0, 0.0))
 
         QMessageBox.information(self, "Załadowano", "Ustawienia zostały załadowane do aktualnych nastaw.")
 
@@ -589,15 +598,10 @@ class SettingsPage(QFrame):
                 QMessageBox.warning(self, "Błąd", "Nie udało się uzyskać ID receptury.")
                 return
             try:
-                connection = mysql.connector.connect(**self.controller.db_params)
-                cursor = connection.cursor()
                 sql = "DELETE FROM settings WHERE `Id Settings` = %s"
-                cursor.execute(sql, (setting_id,))
-                connection.commit()
+                execute_write(self.controller.db_params, sql, (setting_id,))
                 QMessageBox.information(self, "Sukces", "Receptura usunięta.")
                 self.load_data()
-                if connection and connection.is_connected():
-                    connection.close()
             except mysql.connector.Error as e:
                 QMessageBox.warning(self, "Błąd połączenia z bazą", 
                                     f"Nie można połączyć się z bazą danych: {str(e)}\nOperacja nie została wykonana.")
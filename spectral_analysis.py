@@ -0,0 +1,546 @@
+"""
+Spectral analysis module for AccuScan application.
+Computes the diameter spectrum used for pulsation detection every `hop`
+samples instead of on every incoming sample, on a uniform time grid (Hz)
+and a uniform distance grid (cycles per metre).
+"""
+
+import threading
+import time
+
+import numpy as np
+from scipy import fft as sp_fft
+from scipy.signal import find_peaks, get_window
+
+
+# Pary kanałów analizowane wzajemnie (przeciwległe osie głowicy)
+CROSS_PAIRS = (("D1", "D3"), ("D2", "D4"))
+
+
+class MirroredRing:
+    """
+    Fixed-size ring where every value is stored twice, so the last `size`
+    values are always available as one contiguous, time-ordered view.
+    With channels > 0 the ring holds a (channels, size) block.
+    """
+
+    def __init__(self, size, dtype, channels=0):
+        self.size = size
+        shape = (channels, 2 * size) if channels else (2 * size,)
+        self._buf = np.zeros(shape, dtype=dtype)
+        self._pos = 0
+        self.filled = 0
+
+    def clear(self):
+        self._buf[:] = 0
+        self._pos = 0
+        self.filled = 0
+
+    def push(self, values):
+        values = values[..., -self.size:]
+        m = values.shape[-1]
+        idx = (self._pos + np.arange(m)) % self.size
+        self._buf[..., idx] = values
+        self._buf[..., idx + self.size] = values
+        self._pos = (self._pos + m) % self.size
+        self.filled = min(self.size, self.filled + m)
+
+    def view(self):
+        """Return the last `size` values in time order (a view into the ring)."""
+        return self._buf[..., self._pos:self._pos + self.size]
+
+
+def resample_uniform(coord, values, n):
+    """
+    Resample values onto n uniformly spaced points spanning coord[0]..coord[-1].
+
+    Samples whose coordinate does not increase (line stopped, repeated
+    timestamps) are dropped before the linear interpolation.
+
+    Args:
+        coord: Sample coordinates (timestamps or x-coordinates), non-decreasing
+        values: Sample values, 1-D or (channels, samples); all channels are
+                interpolated with one set of indices and weights
+        n: Number of output points
+
+    Returns:
+        Tuple (resampled values as float32, grid step) or (None, 0.0) when the
+        coordinate span is empty
+    """
+    coord = np.asarray(coord, dtype=np.float64)
+    keep = np.ones(len(coord), dtype=bool)
+    keep[1:] = coord[1:] > np.maximum.accumulate(coord)[:-1]
+    coord = coord[keep]
+    if len(coord) < 2 or coord[-1] <= coord[0]:
+        return None, 0.0
+    values = values[..., keep]
+    grid = np.linspace(coord[0], coord[-1], n)
+    j = np.clip(np.searchsorted(coord, grid, side="right") - 1, 0, len(coord) - 2)
+    w = ((grid - coord[j]) / (coord[j + 1] - coord[j])).astype(np.float32)
+    resampled = values[..., j] * (1 - w) + values[..., j + 1] * w
+    return resampled.astype(np.float32), grid[1] - grid[0]
+
+
+class SpectralEngine:
+    """
+    Hop-based spectral engine for the average diameter stream.
+
+    Samples are pushed into mirrored rings, so the last n_fft samples are
+    always one contiguous view without copying. A spectrum is computed only
+    once `hop` new samples have arrived, which bounds the detection latency
+    to hop / sample_rate while cutting the FFT rate by `hop` times.
+    The window function, its gain and the frequency axis are cached.
+
+    When acquisition timestamps are pushed with the samples, the window is
+    resampled onto a uniform time grid and the sample rate is estimated from
+    the timestamps; with x-coordinates also a distance-domain spectrum
+    (cycles per metre) is computed, independent of the line speed.
+
+    Several channels (e.g. avg, D1-D4) are transformed with one batched 2-D
+    rfft; the first channel drives pulsation detection. Cross-spectra and
+    coherence of opposite axes are estimated with Welch segments, again in
+    a single batched rfft over all segments of both channels.
+    """
+
+    def __init__(self, n_fft=1024, hop=32, window=None, prominence=100, distance=5,
+                 channels=("avg",), cross_pairs=CROSS_PAIRS, welch_segment=128):
+        """
+        Initialize the SpectralEngine.
+
+        Args:
+            n_fft: Number of samples per spectrum
+            hop: Number of new samples between two spectra
+            window: Optional scipy window name (e.g. 'hann'); None = rectangular.
+                    Windowed magnitudes are divided by the window's coherent gain,
+                    so peak amplitudes stay comparable with the pulsation threshold.
+            prominence: Minimum peak prominence for find_peaks
+            distance: Minimum distance between peaks in bins
+            channels: Channel names; values are pushed as (len(channels), m)
+                      arrays, the first channel is used for pulsation detection
+            cross_pairs: Channel pairs for cross-spectra and coherence
+            welch_segment: Segment length for the Welch cross-spectral estimate
+        """
+        self.n_fft = n_fft
+        self.hop = hop
+        self.prominence = prominence
+        self.distance = distance
+
+        if window is not None:
+            win = get_window(window, n_fft).astype(np.float32)
+            self._window = win / np.float32(win.mean())
+        else:
+            self._window = None
+        self._unit_freqs = sp_fft.rfftfreq(n_fft, d=1.0)   # częstotliwości dla fs = 1 Hz
+        self._freqs_fs = None
+        self._freqs = None
+        self._bank_key = None
+        self._bank_kernel = None
+
+        self.channels = tuple(channels)
+        self.cross_pairs = [(a, b) for a, b in cross_pairs if a in self.channels and b in self.channels]
+        self.welch_segment = welch_segment
+        self._welch_window = get_window("hann", welch_segment).astype(np.float32)
+        self._welch_unit_freqs = sp_fft.rfftfreq(welch_segment, d=1.0)
+
+        self._values = MirroredRing(n_fft, np.float32, channels=len(self.channels))
+        self._t = MirroredRing(n_fft, np.float64)
+        self._x = MirroredRing(n_fft, np.float64)
+        self.samples_since = 0
+
+        self.last_result = None
+        self.spectra_count = 0
+
+    def reset(self):
+        """Drop buffered samples (e.g. after a measurement restart)."""
+        for ring in (self._values, self._t, self._x):
+            ring.clear()
+        self.samples_since = 0
+        self.last_result = None
+
+    @property
+    def filled(self):
+        return self._values.filled
+
+    def push(self, values, t=None, x=None):
+        """
+        Append new samples to the ring.
+
+        Args:
+            values: Array of new samples, (channels, m) or (m,) for a single channel
+            t: Optional acquisition timestamps of the samples [s]
+            x: Optional x-coordinates of the samples [m]
+        """
+        values = np.asarray(values, dtype=np.float32).reshape(len(self.channels), -1)
+        if values.shape[1] == 0:
+            return
+        self.samples_since += values.shape[1]
+        self._values.push(values)
+        if t is not None:
+            self._t.push(np.asarray(t, dtype=np.float64).ravel())
+        if x is not None:
+            self._x.push(np.asarray(x, dtype=np.float64).ravel())
+
+    def window_samples(self):
+        """Return the last n_fft samples of all channels, shape (channels, n_fft)."""
+        return self._values.view()
+
+    def due(self):
+        """True when the buffer is full and at least `hop` new samples arrived."""
+        return self.filled >= self.n_fft and self.samples_since >= self.hop
+
+    def freqs(self, sample_rate):
+        """Frequency axis for the given sample rate (cached per sample rate)."""
+        if sample_rate != self._freqs_fs:
+            self._freqs = self._unit_freqs * sample_rate
+            self._freqs_fs = sample_rate
+        return self._freqs
+
+    def _prepared(self, samples=None):
+        samples = self.window_samples() if samples is None else samples
+        x = samples - samples.mean(axis=-1, dtype=np.float32, keepdims=True)
+        if self._window is not None:
+            x = x * self._window
+        return x
+
+    def _peaks(self, magnitude, threshold):
+        peak_idxs, _ = find_peaks(magnitude, prominence=self.prominence, distance=self.distance)
+        return peak_idxs[magnitude[peak_idxs] > threshold]
+
+    def _cross_spectra(self, samples, sample_rate):
+        """
+        Welch cross-spectra and magnitude-squared coherence of the channel pairs.
+        Segments of all involved channels go through a single batched rfft.
+        """
+        if not self.cross_pairs or self.n_fft < 2 * self.welch_segment:
+            return {}
+        seg, step = self.welch_segment, self.welch_segment // 2
+        names = sorted({name for pair in self.cross_pairs for name in pair})
+        rows = samples[[self.channels.index(name) for name in names]]
+        rows = rows - rows.mean(axis=-1, keepdims=True)
+        starts = np.arange(0, self.n_fft - seg + 1, step)
+        segments = rows[:, starts[:, None] + np.arange(seg)] * self._welch_window   # (ch, nseg, seg)
+        spectra = sp_fft.rfft(segments, axis=-1)
+        auto = (np.abs(spectra) ** 2).mean(axis=1)
+        result = {"cross_freqs": self._welch_unit_freqs * sample_rate}
+        for a, b in self.cross_pairs:
+            ia, ib = names.index(a), names.index(b)
+            cross = (spectra[ia] * np.conj(spectra[ib])).mean(axis=0)
+            denom = auto[ia] * auto[ib]
+            coherence = np.divide(np.abs(cross) ** 2, denom, out=np.zeros_like(denom), where=denom > 0)
+            result[f"cross_{a}_{b}_magnitude"] = np.abs(cross)
+            result[f"cross_{a}_{b}_phase"] = np.angle(cross)
+            result[f"coherence_{a}_{b}"] = coherence
+        return result
+
+    def compute(self, sample_rate, threshold):
+        """
+        Compute the spectrum of the last n_fft samples and detect pulsation peaks.
+
+        Args:
+            sample_rate: Fallback sample rate [Hz], used only when no
+                         timestamps were pushed with the samples
+            threshold: Minimum peak magnitude reported as pulsation
+
+        Returns:
+            Dictionary with fft_freqs, fft_magnitude, pulsation_vals
+            [(freq, magnitude), ...] and the sample_rate used; with
+            x-coordinates also fft_freqs_spatial [1/m], fft_magnitude_spatial,
+            pulsation_vals_spatial and samples_per_metre
+        """
+        samples = self.window_samples()
+        if self._t.filled >= self.n_fft:
+            # Równomierna siatka czasu między pierwszym a ostatnim znacznikiem czasu
+            resampled, dt = resample_uniform(self._t.view(), samples, self.n_fft)
+            if resampled is not None:
+                samples, sample_rate = resampled, 1.0 / dt
+        # Jedno rfft 2-D dla wszystkich kanałów
+        magnitudes = np.abs(sp_fft.rfft(self._prepared(samples), axis=-1))
+        magnitude = magnitudes[0]
+        peak_idxs = self._peaks(magnitude, threshold)
+        freqs = self.freqs(sample_rate)
+        result = {
+            "fft_freqs": freqs,
+            "fft_magnitude": magnitude,
+            "pulsation_vals": [(float(freqs[i]), float(magnitude[i])) for i in peak_idxs],
+            "sample_rate": sample_rate,
+        }
+        for name, channel_magnitude in zip(self.channels[1:], magnitudes[1:]):
+            result[f"fft_magnitude_{name}"] = channel_magnitude
+        result.update(self._cross_spectra(samples, sample_rate))
+
+        if self._x.filled >= self.n_fft:
+            resampled, dx = resample_uniform(self._x.view(), self.window_samples()[0], self.n_fft)
+            if resampled is not None:
+                magnitude_x = np.abs(sp_fft.rfft(self._prepared(resampled)))
+                peak_idxs_x = self._peaks(magnitude_x, threshold)
+                freqs_x = self._unit_freqs / dx
+                result.update({
+                    "fft_freqs_spatial": freqs_x,
+                    "fft_magnitude_spatial": magnitude_x,
+                    "pulsation_vals_spatial": [(float(freqs_x[i]), float(magnitude_x[i])) for i in peak_idxs_x],
+                    "samples_per_metre": 1.0 / dx,
+                })
+
+        self.samples_since = 0
+        self.spectra_count += 1
+        self.last_result = result
+        return result
+
+    def update(self, values, sample_rate, threshold, t=None, x=None):
+        """
+        Push new samples and compute a spectrum if one is due.
+
+        Returns:
+            The new result dictionary, or None when no spectrum was computed
+            (the previous one is available in last_result)
+        """
+        self.push(values, t, x)
+        if not self.due():
+            return None
+        return self.compute(sample_rate, threshold)
+
+    def band_magnitudes(self, freqs, sample_rate):
+        """
+        DFT (Goertzel-equivalent) bank: magnitudes at arbitrary frequencies
+        of the monitored band of the first channel, without computing the
+        full spectrum.
+        The complex kernel is cached per (frequencies, sample rate), so each
+        call costs one matrix-vector product of len(freqs) x n_fft.
+
+        Args:
+            freqs: Sequence of frequencies to evaluate
+            sample_rate: Sample rate [Hz]
+
+        Returns:
+            Array of magnitudes (same scale as compute())
+        """
+        freqs = np.asarray(freqs, dtype=np.float64)
+        key = (freqs.tobytes(), sample_rate)
+        if key != self._bank_key:
+            n = np.arange(self.n_fft)
+            self._bank_kernel = np.exp(
+                -2j * np.pi * np.outer(freqs / sample_rate, n)
+            ).astype(np.complex64)
+            self._bank_key = key
+        return np.abs(self._bank_kernel @ self._prepared(self.window_samples()[0]))
+
+
+class SpectrogramStore:
+    """
+    Rolling spectrogram (waterfall) with bounded memory.
+
+    Keeps the most recent `rows` spectra in a preallocated (rows, bins) float32
+    ring. Optionally `average` consecutive spectra are averaged into one row
+    (Welch-style smoothing, fewer rows per second), and the frequency axis is
+    reduced to at most `max_bins` columns by taking the maximum of adjacent
+    bins, so narrow pulsation peaks are not averaged away. Memory use is
+    rows * bins * 4 bytes regardless of the measurement length.
+    """
+
+    def __init__(self, rows=300, average=1, max_bins=256):
+        """
+        Initialize the SpectrogramStore.
+
+        Args:
+            rows: Number of spectra kept
+            average: Number of spectra averaged into one row
+            max_bins: Maximum number of frequency columns
+        """
+        self.rows = rows
+        self.average = max(int(average), 1)
+        self.max_bins = max_bins
+        self.lock = threading.Lock()
+
+        self._data = None           # alokowane przy pierwszym widmie (znana liczba prążków)
+        self._times = np.zeros(rows, dtype=np.float64)
+        self._pos = 0
+        self.filled = 0
+        self.f_max = 0.0
+        self.version = 0            # zwiększane przy każdym nowym wierszu (UI rysuje tylko zmiany)
+
+        self._acc = None
+        self._acc_count = 0
+
+    def _reduce(self, magnitude):
+        n = len(magnitude)
+        factor = -(-n // self.max_bins)   # ceil
+        if factor <= 1:
+            return magnitude.astype(np.float32)
+        pad = (-n) % factor
+        if pad:
+            magnitude = np.concatenate((magnitude, np.zeros(pad, dtype=magnitude.dtype)))
+        return magnitude.reshape(-1, factor).max(axis=1).astype(np.float32)
+
+    def append(self, magnitude, freqs=None, t=None):
+        """
+        Add one spectrum.
+
+        Args:
+            magnitude: Magnitude spectrum (1-D)
+            freqs: Frequency axis of the spectrum (its last value sets f_max)
+            t: Timestamp of the spectrum [s]
+        """
+        row = self._reduce(np.asarray(magnitude))
+        if self._acc is None or len(self._acc) != len(row):
+            self._acc = np.zeros_like(row)
+            self._acc_count = 0
+        self._acc += row
+        self._acc_count += 1
+        if self._acc_count < self.average:
+            return
+
+        with self.lock:
+            if self._data is None or self._data.shape[1] != len(row):
+                self._data = np.zeros((self.rows, len(row)), dtype=np.float32)
+                self._pos = 0
+                self.filled = 0
+            self._data[self._pos] = self._acc / self._acc_count
+            self._times[self._pos] = time.time() if t is None else t
+            self._pos = (self._pos + 1) % self.rows
+            self.filled = min(self.rows, self.filled + 1)
+            if freqs is not None and len(freqs):
+                self.f_max = float(freqs[-1])
+            self.version += 1
+        self._acc[:] = 0.0
+        self._acc_count = 0
+
+    def snapshot(self):
+        """
+        Return a time-ordered copy of the stored spectra.
+
+        Returns:
+            Tuple (image (filled, bins), timestamps (filled,), f_max) or None when empty
+        """
+        with self.lock:
+            if self._data is None or self.filled == 0:
+                return None
+            order = (self._pos - self.filled + np.arange(self.filled)) % self.rows
+            return self._data[order], self._times[order], self.f_max
+
+
+class PeakTracker:
+    """
+    Tracks pulsation peaks across consecutive spectra.
+
+    Existing tracks are followed by reading the local maximum of the new
+    spectrum within +/- freq_tolerance of the track frequency (vectorised,
+    no peak search); only bins above the enter threshold that are local
+    maxima and not claimed by a track can start new tracks. Every track keeps
+    an EWMA of its amplitude, onset time and duration. A track raises its
+    alarm when the EWMA stays above the threshold for min_duration seconds
+    and clears it when the EWMA falls below threshold * (1 - hysteresis).
+    """
+
+    def __init__(self, threshold=500.0, hysteresis=0.2, alpha=0.3,
+                 freq_tolerance=0.3, min_duration=1.0, max_tracks=16):
+        """
+        Initialize the PeakTracker.
+
+        Args:
+            threshold: Amplitude entering the alarm
+            hysteresis: Relative hysteresis for clearing the alarm (0.2 = 20 % below threshold)
+            alpha: EWMA smoothing factor of the track amplitude
+            freq_tolerance: Maximum frequency change between spectra for one track [Hz]
+            min_duration: Time the EWMA must stay above threshold before the alarm [s]
+            max_tracks: Maximum number of tracks (weakest are dropped first)
+        """
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.alpha = alpha
+        self.freq_tolerance = freq_tolerance
+        self.min_duration = min_duration
+        self.max_tracks = max_tracks
+        self.tracks = []
+        self._next_id = 1
+
+    @property
+    def exit_threshold(self):
+        return self.threshold * (1.0 - self.hysteresis)
+
+    def active_tracks(self):
+        """Tracks with an active alarm."""
+        return [track for track in self.tracks if track["active"]]
+
+    def update(self, freqs, magnitude, t):
+        """
+        Associate the new spectrum with the tracks and update their alarms.
+
+        Args:
+            freqs: Frequency axis of the spectrum
+            magnitude: Magnitude spectrum
+            t: Time of the spectrum [s]
+
+        Returns:
+            List of transitions [("entered" | "exited", track), ...]
+        """
+        freqs = np.asarray(freqs)
+        magnitude = np.asarray(magnitude)
+        n = len(magnitude)
+        claimed = np.zeros(n, dtype=bool)
+        transitions = []
+
+        if self.tracks:
+            # Zakres prążków każdego toru: [f - tol, f + tol]
+            track_freqs = np.array([track["freq"] for track in self.tracks])
+            lo = np.searchsorted(freqs, track_freqs - self.freq_tolerance, side="left")
+            hi = np.maximum(np.searchsorted(freqs, track_freqs + self.freq_tolerance, side="right"), lo + 1)
+            hi = np.minimum(hi, n)
+            for track, a, b in zip(self.tracks, lo.tolist(), hi.tolist()):
+                if a >= n:
+                    amp, k = 0.0, n - 1
+                else:
+                    k = a + int(np.argmax(magnitude[a:b]))
+                    amp = float(magnitude[k])
+                    claimed[a:b] = True
+                track["amp"] = amp
+                track["ewma"] = self.alpha * amp + (1.0 - self.alpha) * track["ewma"]
+                if amp > self.exit_threshold:
+                    track["freq"] = float(freqs[k])
+                track["last_t"] = t
+                self._update_alarm(track, t, transitions)
+
+        # Nowe tory: lokalne maksima powyżej progu, poza zakresem istniejących torów
+        if n > 2:
+            inner = magnitude[1:-1]
+            is_peak = (inner > magnitude[:-2]) & (inner >= magnitude[2:]) & (inner > self.threshold)
+            for k in (np.flatnonzero(is_peak & ~claimed[1:-1]) + 1).tolist():
+                if claimed[k]:
+                    continue
+                track = {
+                    "id": self._next_id, "freq": float(freqs[k]), "amp": float(magnitude[k]),
+                    "ewma": self.alpha * float(magnitude[k]), "onset_t": t, "last_t": t,
+                    "above_since": None, "duration": 0.0, "active": False,
+                }
+                self._next_id += 1
+                self.tracks.append(track)
+                self._update_alarm(track, t, transitions)
+                lo_k = np.searchsorted(freqs, freqs[k] - self.freq_tolerance, side="left")
+                hi_k = np.searchsorted(freqs, freqs[k] + self.freq_tolerance, side="right")
+                claimed[lo_k:hi_k] = True
+
+        # Usuwanie wygasłych torów (bez aktywnego alarmu i z małą amplitudą)
+        self.tracks = [
+            track for track in self.tracks
+            if track["active"] or track["ewma"] >= 0.5 * self.exit_threshold
+        ]
+        if len(self.tracks) > self.max_tracks:
+            self.tracks.sort(key=lambda track: (track["active"], track["ewma"]), reverse=True)
+            del self.tracks[self.max_tracks:]
+        return transitions
+
+    def _update_alarm(self, track, t, transitions):
+        if track["ewma"] > self.threshold:
+            if track["above_since"] is None:
+                track["above_since"] = t
+        elif track["ewma"] < self.exit_threshold:
+            track["above_since"] = None
+
+        if track["above_since"] is not None:
+            track["duration"] = t - track["above_since"]
+        if not track["active"] and track["above_since"] is not None and track["duration"] >= self.min_duration:
+            track["active"] = True
+            track["onset_t"] = track["above_since"]
+            transitions.append(("entered", track))
+        elif track["active"] and track["above_since"] is None:
+            track["active"] = False
+            transitions.append(("exited", track))
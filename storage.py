@@ -0,0 +1,362 @@
+"""
+Storage module for AccuScan application.
+Pluggable storage backends behind the db_helper functions: the MySQL server
+(default) or an embedded SQLite file in WAL mode with the same tables,
+column names and queries, so a line without a database server keeps the
+full history locally and tests/benchmarks can run against a real store.
+
+The backend is chosen by the connection parameters: {"backend": "sqlite",
+"path": ...} selects SQLite, anything else is passed to mysql.connector.
+SQLite errors are raised as StorageError, a subclass of mysql.connector.Error,
+so the existing error handling works with both backends.
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+import os
+import sqlite3
+import threading
+
+import mysql.connector
+from mysql.connector import Error, errors
+
+
+class StorageError(Error):
+    """Error of a non-MySQL storage backend (caught like any MySQL error)."""
+
+
+# Błędy wynikające z danych wiersza – ponowienie tego samego wiersza nic nie zmieni
+_MYSQL_ROW_ERRORS = (errors.DataError, errors.IntegrityError, errors.ProgrammingError)
+_SQLITE_ROW_ERRORS = (sqlite3.DataError, sqlite3.IntegrityError, sqlite3.ProgrammingError, sqlite3.InterfaceError)
+
+
+def is_row_error(exc):
+    """
+    True when exc was caused by the data of a row (bad value, constraint,
+    unsupported type) rather than by the connection or the server, so a
+    writer should set the row aside instead of retrying it.
+    """
+    if isinstance(exc, StorageError):
+        return isinstance(exc.__cause__, _SQLITE_ROW_ERRORS)
+    if isinstance(exc, Error):
+        return isinstance(exc, _MYSQL_ROW_ERRORS)
+    # Błąd po stronie Pythona przy budowie wiersza (TypeError, ValueError, ...)
+    return isinstance(exc, (TypeError, ValueError, KeyError))
+
+
+def _adapt_datetime(value):
+    return value.isoformat(" ")
+
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("DATETIME", _convert_datetime)
+
+
+# Schemat SQLite odpowiadający tabelom MySQL (te same nazwy tabel i kolumn)
+_METRE_STATS = ",\n".join(
+    f"    `{key} {stat}` REAL" for key in ("D1", "D2", "D3", "D4", "avg") for stat in ("mean", "min", "max", "std")
+)
+
+_SETTINGS_COLUMNS = """
+    `Recipe name` TEXT,
+    `Product nr` TEXT,
+    `Preset Diameter` REAL,
+    `Diameter Over tolerance` REAL,
+    `Diameter Under tolerance` REAL,
+    `Diameter window` REAL,
+    `Diameter standard deviation` REAL,
+    `Lump threshold` REAL,
+    `Neck threshold` REAL,
+    `Flaw Window` REAL,
+    `Number of scans for gauge to average` INTEGER,
+    `Diameter histeresis` REAL,
+    `Lump histeresis` REAL,
+    `Neck histeresis` REAL,
+    `Max lumps in flaw window` INTEGER,
+    `Max necks in flaw window` INTEGER,
+    `Pulsation_threshold` REAL,
+    `Max_ovality` REAL,
+    `Max_standard_deviation` REAL"""
+
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS settings (
+    `Id Settings` INTEGER PRIMARY KEY AUTOINCREMENT,{_SETTINGS_COLUMNS},
+    created_at DATETIME DEFAULT (datetime('now', 'localtime'))
+);
+CREATE TABLE IF NOT EXISTS settings_register (
+    `Id register Settings` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `Date time` DATETIME,{_SETTINGS_COLUMNS}
+);
+CREATE TABLE IF NOT EXISTS event (
+    `Id event` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `Id register settings` INTEGER,
+    `Date time` DATETIME,
+    `X-coordinate` REAL,
+    `Product nr` TEXT,
+    `Batch nr` TEXT,
+    `Alarm Statusword` INTEGER,
+    D1 REAL, D2 REAL, D3 REAL, D4 REAL,
+    `lumps number of` INTEGER,
+    `necks number of` INTEGER,
+    alarm_type TEXT,
+    event_type INTEGER,
+    comment TEXT,
+    event_key TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS ix_event_date ON event (`Date time`);
+CREATE INDEX IF NOT EXISTS ix_event_batch_date ON event (`Batch nr`, `Date time`);
+CREATE INDEX IF NOT EXISTS ix_event_product_date ON event (`Product nr`, `Date time`);
+CREATE INDEX IF NOT EXISTS ix_event_alarm_date ON event (alarm_type, `Date time`);
+CREATE TABLE IF NOT EXISTS measurement (
+    ID_Measurement INTEGER PRIMARY KEY AUTOINCREMENT,
+    Statusword INTEGER,
+    D1 REAL, D2 REAL, D3 REAL, D4 REAL,
+    `lumps number of` INTEGER,
+    `necks number of` INTEGER,
+    `Date time` DATETIME,
+    `X-coordinate` REAL,
+    `Batch nr` TEXT,
+    `Product nr` TEXT,
+    Speed REAL
+);
+CREATE INDEX IF NOT EXISTS ix_measurement_batch_x ON measurement (`Batch nr`, `X-coordinate`);
+CREATE INDEX IF NOT EXISTS ix_measurement_date ON measurement (`Date time`);
+CREATE INDEX IF NOT EXISTS ix_measurement_batch_date ON measurement (`Batch nr`, `Date time`);
+CREATE INDEX IF NOT EXISTS ix_measurement_product_date ON measurement (`Product nr`, `Date time`);
+CREATE TABLE IF NOT EXISTS measurement_metre (
+    ID_Metre INTEGER PRIMARY KEY AUTOINCREMENT,
+    `Date time` DATETIME,
+    `Batch nr` TEXT,
+    `Product nr` TEXT,
+    Metre INTEGER NOT NULL,
+    Samples INTEGER NOT NULL,
+{_METRE_STATS},
+    `Ovality mean` REAL,
+    `Ovality max` REAL,
+    `lumps number of` INTEGER NOT NULL DEFAULT 0,
+    `necks number of` INTEGER NOT NULL DEFAULT 0,
+    Speed REAL
+);
+CREATE INDEX IF NOT EXISTS ix_metre_batch ON measurement_metre (`Batch nr`, Metre);
+CREATE INDEX IF NOT EXISTS ix_metre_date ON measurement_metre (`Date time`);
+CREATE INDEX IF NOT EXISTS ix_metre_batch_date ON measurement_metre (`Batch nr`, `Date time`);
+CREATE INDEX IF NOT EXISTS ix_metre_product_date ON measurement_metre (`Product nr`, `Date time`);
+"""
+
+
+def _translate(sql):
+    """Dialekt MySQL -> SQLite dla zapytań aplikacji (placeholdery i INSERT IGNORE)."""
+    return sql.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE")
+
+
+class SQLiteCursor:
+    """
+    Cursor with the subset of the mysql.connector cursor API used by the application.
+    """
+
+    def __init__(self, cursor, dictionary=False):
+        self.cursor = cursor
+        self.dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        try:
+            self.cursor.execute(_translate(sql), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def executemany(self, sql, rows):
+        try:
+            self.cursor.executemany(_translate(sql), [tuple(row) for row in rows])
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self.cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    """
+    SQLite connection with the subset of the mysql.connector connection API
+    used by the application (cursor, commit, rollback, is_connected, close).
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path, shared=False):
+        """
+        Initialize the SQLiteConnection.
+
+        Args:
+            path: Database file
+            shared: True for a per-thread connection reused by acquire(); close() then keeps it open
+        """
+        self.path = path
+        self.shared = shared
+        try:
+            self.connection = sqlite3.connect(path, timeout=10.0, check_same_thread=False,
+                                              detect_types=sqlite3.PARSE_DECLTYPES)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def cursor(self, dictionary=False, prepared=False, buffered=False):
+        # sqlite3 sam przechowuje przygotowane instrukcje (cache na połączeniu)
+        return SQLiteCursor(self.connection.cursor(), dictionary=dictionary)
+
+    def commit(self):
+        try:
+            self.connection.commit()
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def is_connected(self):
+        return self.connection is not None
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        if self.shared:
+            # Jak zwrot do puli: transakcja zakończona, połączenie zostaje dla wątku
+            self.connection.rollback()
+            return
+        self.connection.close()
+        self.connection = None
+
+
+class StorageBackend(ABC):
+    """
+    Interface of a storage backend.
+
+    connect() opens a dedicated connection (for long-lived writers, warnings
+    are not raised as errors),
+    acquire() returns a connection for one short operation whose close()
+    releases it. Connections follow the mysql.connector API subset used by
+    db_helper (cursor(dictionary=...), commit, rollback, close).
+    """
+
+    dialect = None
+
+    @abstractmethod
+    def connect(self):
+        """Open a dedicated connection."""
+
+    @abstractmethod
+    def acquire(self):
+        """Return a connection for one short operation (close() releases it)."""
+
+
+class MySQLBackend(StorageBackend):
+    """
+    MySQL server backend. Short operations use the connection pool in db_helper.
+    """
+
+    dialect = "mysql"
+
+    def __init__(self, db_params):
+        self.db_params = db_params
+
+    def connect(self):
+        # Połączenia writerów: INSERT IGNORE zamienia duplikat/obcięcie w ostrzeżenie,
+        # które przy raise_on_warnings byłoby wyjątkiem i blokowało ponowienie partii
+        return mysql.connector.connect(**dict(self.db_params, raise_on_warnings=False))
+
+    def acquire(self):
+        from db_helper import acquire_connection
+        return acquire_connection(self.db_params)
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded SQLite backend (WAL: readers do not block the single writer).
+    The schema is created when the file is first opened in the process.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path):
+        """
+        Initialize the SQLiteBackend.
+
+        Args:
+            path: Database file (directory created if missing)
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.local = threading.local()
+        connection = SQLiteConnection(path)
+        try:
+            connection.connection.executescript(SQLITE_SCHEMA)
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            connection.close()
+
+    def connect(self):
+        return SQLiteConnection(self.path)
+
+    def acquire(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = SQLiteConnection(self.path, shared=True)
+        return connection
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(db_params):
+    """
+    Return the storage backend for the connection parameters (one instance per
+    parameters and process).
+    """
+    key = (os.getpid(),) + tuple(sorted((k, str(v)) for k, v in db_params.items()))
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            if db_params.get("backend") == "sqlite":
+                backend = SQLiteBackend(db_params["path"])
+            else:
+                backend = MySQLBackend(db_params)
+            _backends[key] = backend
+        return backend
+
+
+def connect(db_params):
+    """Open a dedicated connection of the backend selected by db_params."""
+    return get_backend(db_params).connect()
+
+
+def dialect_of(connection):
+    """"mysql" or "sqlite" for a connection returned by a backend."""
+    return getattr(connection, "dialect", "mysql")
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# Moduły aplikacji leżą w katalogu głównym repozytorium
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# HistoryPage to widget Qt – testy działają bez ekranu
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+@pytest.fixture
+def sqlite_params(tmp_path):
+    """Parametry wbudowanego backendu SQLite (nowy plik bazy dla każdego testu)."""
+    return {"backend": "sqlite", "path": str(tmp_path / "accuscan.sqlite")}
+
+
+def wait_until(condition, timeout=5.0):
+    """Czeka, aż wątek w tle spełni warunek; zwraca ostatni wynik condition()."""
+    import time
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.02)
+    return condition()
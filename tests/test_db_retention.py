@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+from db_helper import fetch_all, save_events
+from db_retention import RetentionPolicy, delete_expired_rows, drop_expired_partitions
+import storage
+
+
+class PartitionCursor:
+    """Kursor udający information_schema.PARTITIONS tabeli partycjonowanej miesięcznie."""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.statements = []
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        self.rows = self.partitions if "information_schema.PARTITIONS" in sql else []
+
+    def fetchall(self):
+        return self.rows
+
+
+MONTHS = [
+    ("p202608", "'2026-09-01'", 100),
+    ("p202609", "'2026-10-01'", 200),
+    ("p202610", "'2026-11-01'", 300),
+    ("pmax", "MAXVALUE", 0),
+]
+
+
+def ddl(cursor):
+    return [sql for sql in cursor.statements if sql.startswith("ALTER")]
+
+
+@pytest.mark.parametrize("cutoff, dropped", [
+    # Granica partycji = cutoff: wszystkie jej wiersze są starsze – usuwamy
+    (datetime.datetime(2026, 10, 1), ["p202608", "p202609"]),
+    (datetime.datetime(2026, 10, 15, 8, 30), ["p202608", "p202609"]),
+    # Sekundę przed granicą partycja ma jeszcze wiersze młodsze niż cutoff
+    (datetime.datetime(2026, 9, 30, 23, 59, 59), ["p202608"]),
+    (datetime.datetime(2030, 1, 1), ["p202608", "p202609", "p202610"]),
+])
+def test_drop_expired_partitions_bounds(cutoff, dropped):
+    cursor = PartitionCursor(MONTHS)
+    expired = drop_expired_partitions(cursor, "measurement", cutoff)
+    assert [name for name, _ in expired] == dropped
+    assert dict(expired) == {name: rows for name, _, rows in MONTHS if name in dropped}
+    # pmax (MAXVALUE) nigdy nie jest usuwana, wszystko jednym ALTER
+    assert ddl(cursor) == [f"ALTER TABLE `measurement` DROP PARTITION {', '.join(dropped)}"]
+
+
+@pytest.mark.parametrize("partitions", [MONTHS, []])
+def test_drop_expired_partitions_nothing_expired(partitions):
+    cursor = PartitionCursor(partitions)
+    assert drop_expired_partitions(cursor, "measurement", datetime.datetime(2026, 8, 31)) == []
+    assert ddl(cursor) == []
+
+
+def test_delete_expired_rows_in_chunks(sqlite_params):
+    t0 = datetime.datetime(2026, 9, 1)
+    events = [{"date_time": t0 + datetime.timedelta(hours=i), "comment": str(i), "event_key": str(i)}
+              for i in range(50)]
+    connection = storage.connect(sqlite_params)
+    try:
+        save_events(connection, events)
+        cutoff = t0 + datetime.timedelta(hours=23)
+        deleted = delete_expired_rows(connection, RetentionPolicy("event", keep_days=1), cutoff,
+                                      chunk_rows=4, pause=0.0)
+    finally:
+        connection.close()
+    assert deleted == 23
+    rows = fetch_all(sqlite_params, "SELECT comment FROM event ORDER BY `Date time`")
+    assert [row["comment"] for row in rows] == [str(i) for i in range(23, 50)]
+
+
+def test_delete_expired_rows_stops_when_line_resumes(sqlite_params):
+    t0 = datetime.datetime(2026, 9, 1)
+    events = [{"date_time": t0 + datetime.timedelta(hours=i), "event_key": str(i)} for i in range(20)]
+    connection = storage.connect(sqlite_params)
+    try:
+        save_events(connection, events)
+        deleted = delete_expired_rows(connection, RetentionPolicy("event", keep_days=1),
+                                      t0 + datetime.timedelta(days=2), chunk_rows=5, pause=0.0,
+                                      should_continue=lambda: False)
+    finally:
+        connection.close()
+    assert deleted == 5
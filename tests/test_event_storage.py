@@ -0,0 +1,88 @@
+import datetime
+
+from conftest import wait_until
+from db_helper import fetch_all, save_events
+from event_journal import EventJournal
+from event_writer import EventWriter
+import storage
+
+
+T0 = datetime.datetime(2026, 10, 1, 12, 0, 0)
+
+
+def event(i, **extra):
+    data = {"date_time": T0 + datetime.timedelta(seconds=i), "batch_nr": "B1", "product_nr": "P1",
+            "D1": 1.0 + i, "alarm_type": "lump", "event_type": 1, "comment": f"event {i}"}
+    data.update(extra)
+    return data
+
+
+def test_journal_is_fifo_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "events.sqlite")
+    journal = EventJournal(path)
+    keys = [journal.append(event(i)) for i in range(5)]
+    assert len(set(keys)) == 5 and len(journal) == 5
+    # Ponowne dopisanie tego samego event_key niczego nie dubluje
+    journal.append(event(0, event_key=keys[0]))
+    assert len(journal) == 5
+
+    batch = journal.peek(3)
+    assert [e["comment"] for _, e in batch] == ["event 0", "event 1", "event 2"]
+    assert batch[0][1]["date_time"] == T0
+    journal.remove(batch[-1][0])
+    journal.close()
+
+    journal = EventJournal(path)
+    assert len(journal) == 2
+    assert [e["event_key"] for _, e in journal.peek(10)] == keys[3:]
+    journal.close()
+
+
+def test_journal_reject_sets_event_aside(tmp_path):
+    journal = EventJournal(str(tmp_path / "events.sqlite"))
+    for i in range(3):
+        journal.append(event(i))
+    seq, _ = journal.peek(2)[1]
+    journal.reject(seq, "DataError: bad row")
+    assert len(journal) == 2 and journal.rejected_count() == 1
+    assert [e["comment"] for _, e in journal.peek(10)] == ["event 0", "event 2"]
+
+    # Wpis, którego nie da się zdekodować, nie blokuje kolejki
+    journal.connection.execute("INSERT INTO journal (event_key, payload) VALUES ('broken', '{')")
+    journal.pending += 1
+    assert len(journal.peek(10)) == 2
+    assert journal.rejected_count() == 2 and len(journal) == 2
+    journal.close()
+
+
+def test_save_events_is_idempotent(sqlite_params):
+    events = [event(i, event_key=f"key-{i}") for i in range(10)]
+    connection = storage.connect(sqlite_params)
+    try:
+        assert save_events(connection, events) == 10
+        # Ponowne wysłanie (np. po awarii między commitem a remove()) nie tworzy duplikatów
+        save_events(connection, events[5:] + [event(10, event_key="key-10")])
+    finally:
+        connection.close()
+    rows = fetch_all(sqlite_params, "SELECT event_key, comment FROM event ORDER BY `Id event`")
+    assert [row["event_key"] for row in rows] == [f"key-{i}" for i in range(11)]
+    assert rows[3]["comment"] == "event 3"
+
+
+def test_event_writer_drains_journal_and_rejects_bad_row(sqlite_params, tmp_path):
+    writer = EventWriter(sqlite_params, journal_path=str(tmp_path / "events.sqlite"),
+                         batch_size=8, flush_interval=0.05, min_backoff=0.05)
+    try:
+        for i in range(30):
+            # Lista w kolumnie REAL – błąd danych jednego wiersza
+            writer.enqueue(event(i, D1=[1, 2]) if i == 17 else event(i))
+        assert wait_until(lambda: writer.queue_depth() == 0)
+    finally:
+        writer.stop()
+    assert writer.written == 29 and writer.rejected == 1
+
+    rows = fetch_all(sqlite_params, "SELECT comment FROM event ORDER BY `Date time`")
+    assert [row["comment"] for row in rows] == [f"event {i}" for i in range(30) if i != 17]
+    journal = EventJournal(str(tmp_path / "events.sqlite"))
+    assert journal.rejected_count() == 1
+    journal.close()
@@ -0,0 +1,85 @@
+import datetime
+
+from event_throttle import EventThrottle, alarm_key
+
+
+T0 = datetime.datetime(2026, 10, 1, 12, 0, 0)
+
+
+def at(t):
+    """Czas w sekundach epoki, jak event_time()."""
+    return (T0 + datetime.timedelta(seconds=t)).timestamp()
+
+
+def event(t, alarm_type="lump", comment="on", track_id=None):
+    data = {"date_time": T0 + datetime.timedelta(seconds=t), "alarm_type": alarm_type, "comment": comment}
+    if track_id is not None:
+        data["track_id"] = track_id
+    return data
+
+
+def test_events_under_limits_pass_through():
+    throttle = EventThrottle(flap_window=10, flap_limit=4, rate=5, burst=20)
+    out = []
+    for i in range(4):
+        out += throttle.submit(event(i * 3.0, comment=str(i)))
+    assert [e["comment"] for e in out] == ["0", "1", "2", "3"]
+    assert throttle.flush(at(100.0)) == []
+    assert throttle.coalesced_total == 0 and throttle.dropped_total == 0
+
+
+def test_flapping_alarm_is_coalesced_into_final_state():
+    throttle = EventThrottle(flap_window=10, flap_limit=4, rate=100, burst=100)
+    out = []
+    for i in range(20):
+        out += throttle.submit(event(i * 0.1, comment="on" if i % 2 == 0 else "off"))
+    # flap_limit przejść przechodzi, reszta jest tylko liczona
+    assert len(out) == 4
+    assert throttle.flush(at(5.0)) == []        # alarm wciąż nie ucichł
+
+    summary = throttle.flush(at(12.5))
+    assert len(summary) == 1
+    assert summary[0]["comment"].startswith("off ")
+    assert "(zgrupowano 16 przełączeń w 1.5 s)" in summary[0]["comment"]
+    assert throttle.coalesced_total == 16
+    assert throttle.flapping == {}
+
+
+def test_rate_limit_keeps_last_transition_per_alarm():
+    throttle = EventThrottle(flap_window=1, flap_limit=1000, rate=1, burst=3)
+    out = []
+    for i in range(10):
+        out += throttle.submit(event(0.0, alarm_type=f"a{i % 3}", comment=str(i)))
+    assert [e["comment"] for e in out] == ["0", "1", "2"]
+    assert throttle.dropped_total == 7
+    assert set(throttle.dropped) == {alarm_key(event(0, alarm_type=a)) for a in ("a0", "a1", "a2")}
+
+    # Po uzupełnieniu tokenów każdy alarm dostaje ostatnie pominięte przejście
+    late = throttle.flush(at(10.0))
+    assert sorted(e["comment"].split()[0] for e in late) == ["7", "8", "9"]
+    assert all("limit 1/s" in e["comment"] for e in late)
+    assert throttle.dropped == {}
+
+
+def test_waiting_transition_is_not_overtaken():
+    throttle = EventThrottle(flap_window=1, flap_limit=1000, rate=1, burst=1)
+    assert throttle.submit(event(0.0, comment="on"))
+    assert throttle.submit(event(0.0, comment="off")) == []
+    # Token już jest, ale najpierw wychodzi czekające przejście, a nowe czeka za nim
+    out = throttle.submit(event(1.0, comment="on"))
+    assert [e["comment"].split()[0] for e in out] == ["off"]
+    assert [e["comment"].split()[0] for e in throttle.flush(at(2.0))] == ["on"]
+
+
+def test_pulsation_bands_are_separate_alarms():
+    throttle = EventThrottle(flap_window=10, flap_limit=2, rate=100, burst=100)
+    out = []
+    for i in range(6):
+        out += throttle.submit(event(i * 0.1, alarm_type="pulsation", comment="A", track_id=1))
+    # Pasmo A flapuje, pasmo B nie może zostać przez nie zgrupowane ani zastąpione
+    out_b = throttle.submit(event(0.7, alarm_type="pulsation", comment="B", track_id=2))
+    assert [e["comment"] for e in out_b] == ["B"]
+    assert ("pulsation", 1) in throttle.flapping
+    assert ("pulsation", 2) not in throttle.flapping
+    summary = throttle.flush(at(20.0))
+    assert [e["track_id"] for e in summary] == [1]
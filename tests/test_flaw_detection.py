@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from flaw_detection import FlawWindow, hysteresis_state
+
+
+def latch_reference(set_mask, reset_mask, initial):
+    state, out = initial, []
+    for s, r in zip(set_mask, reset_mask):
+        if s:
+            state = True
+        elif r:
+            state = False
+        out.append(state)
+    return np.array(out, dtype=bool)
+
+
+def test_hysteresis_state_latches_between_set_and_reset():
+    set_mask = np.array([0, 1, 0, 0, 0, 1, 0], dtype=bool)
+    reset_mask = np.array([0, 0, 0, 1, 0, 0, 0], dtype=bool)
+    assert hysteresis_state(set_mask, reset_mask).tolist() == [False, True, True, False, False, True, True]
+
+
+def test_hysteresis_state_carries_initial_and_set_wins():
+    set_mask = np.array([0, 0, 1, 0], dtype=bool)
+    reset_mask = np.array([0, 0, 1, 1], dtype=bool)
+    assert hysteresis_state(set_mask, reset_mask, initial=True).tolist() == [True, True, True, False]
+    assert hysteresis_state(np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)).tolist() == []
+
+
+def test_hysteresis_state_matches_loop():
+    rng = np.random.default_rng(1)
+    for initial in (False, True):
+        set_mask = rng.random(500) < 0.05
+        reset_mask = rng.random(500) < 0.05
+        expected = latch_reference(set_mask, reset_mask, initial)
+        assert np.array_equal(hysteresis_state(set_mask, reset_mask, initial), expected)
+
+
+def window_reference(x, lumps, necks, length):
+    """Zliczenie wprost: zdarzenia do bieżącej próbki z x >= x_i - length."""
+    out_l, out_n = [], []
+    for i in range(len(x)):
+        inside = x[:i + 1] >= x[i] - length
+        out_l.append(int(lumps[:i + 1][inside].sum()))
+        out_n.append(int(necks[:i + 1][inside].sum()))
+    return np.array(out_l), np.array(out_n)
+
+
+@pytest.mark.parametrize("batch", [1, 7, 100, 1000])
+def test_flaw_window_batches_match_brute_force(batch):
+    rng = np.random.default_rng(batch)
+    n = 1000
+    x = np.cumsum(rng.uniform(0.0, 0.02, n))
+    lumps = (rng.random(n) < 0.1).astype(np.int64) * rng.integers(1, 3, n)
+    necks = (rng.random(n) < 0.05).astype(np.int64)
+    # Mała pojemność wymusza powiększanie pierścienia
+    window = FlawWindow({"flaw": 0.5, "metre": 1.0}, capacity=4)
+
+    series = {"flaw": ([], []), "metre": ([], [])}
+    for start in range(0, n, batch):
+        end = start + batch
+        for name, (l, k) in window.add_batch(x[start:end], lumps[start:end], necks[start:end]).items():
+            series[name][0].append(l)
+            series[name][1].append(k)
+
+    for name, length in (("flaw", 0.5), ("metre", 1.0)):
+        expected_l, expected_n = window_reference(x, lumps, necks, length)
+        assert np.array_equal(np.concatenate(series[name][0]), expected_l)
+        assert np.array_equal(np.concatenate(series[name][1]), expected_n)
+        assert window.counts(name) == (expected_l[-1], expected_n[-1])
+
+
+def test_flaw_window_add_and_update():
+    window = FlawWindow({"flaw": 1.0})
+    window.add(0.0, 1, 0)
+    window.add(0.5, 0, 2)
+    window.add(1.2, 3, 0)
+    window.update(1.2)
+    assert window.counts("flaw") == (3, 2)
+    window.update(2.4)
+    assert window.counts("flaw") == (0, 0)
+    assert window.all_counts() == {"flaw": (0, 0)}
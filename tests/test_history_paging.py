@@ -0,0 +1,109 @@
+import datetime
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import history_page
+from db_helper import fetch_all, save_events
+from history_page import HistoryPage, HistoryQuery, seek_sql
+import storage
+
+
+T0 = datetime.datetime(2026, 10, 1, 12, 0, 0)
+
+BASE_QUERY = """
+    SELECT `Date time` AS date_time, `Id event` AS event_id, `Batch nr` AS batch, comment
+    FROM event
+"""
+
+
+def test_seek_sql_clauses():
+    assert seek_sql("Id event", None) == (None, [])
+    assert seek_sql("Id event", (None, None)) == ("`Date time` IS NULL", [])
+    assert seek_sql("Id event", (None, 7)) == ("`Date time` IS NULL AND `Id event` < %s", [7])
+    assert seek_sql("Id event", (T0, 7)) == (
+        "`Date time` <= %s AND (`Date time` < %s OR `Id event` < %s)", [T0, T0, 7])
+    # Tabela bez klucza głównego – tylko po czasie
+    assert seek_sql(None, (T0, None)) == ("`Date time` < %s", [T0])
+
+
+@pytest.fixture
+def history_db(sqlite_params):
+    """Zdarzenia z powtarzającymi się czasami i kilkoma wierszami bez czasu."""
+    events = []
+    for i in range(40):
+        date_time = None if i % 13 == 5 else T0 + datetime.timedelta(seconds=i // 3)
+        events.append({"date_time": date_time, "batch_nr": "B1" if i % 2 else "XB12",
+                       "comment": f"event {i}", "event_key": f"key-{i}"})
+    connection = storage.connect(sqlite_params)
+    try:
+        save_events(connection, events)
+    finally:
+        connection.close()
+    return sqlite_params
+
+
+def make_page(db_params):
+    # Bez budowania widgetu – testujemy tylko stronicowanie
+    page = HistoryPage.__new__(HistoryPage)
+    page.controller = SimpleNamespace(db_params=db_params, db_connected=True)
+    page.page_lock = threading.Lock()
+    page.generation = 0
+    page.prefetch_thread = None
+    page.query = None
+    page._reset_pages()
+    return page
+
+
+def reference(db_params, where="", params=(), include_undated=True):
+    sql = BASE_QUERY + (f" WHERE {where}" if where else "")
+    rows = fetch_all(db_params, sql, list(params))
+    dated = sorted((r for r in rows if r["date_time"] is not None),
+                   key=lambda r: (r["date_time"], r["event_id"]), reverse=True)
+    undated = sorted((r for r in rows if r["date_time"] is None), key=lambda r: r["event_id"], reverse=True)
+    return dated + (undated if include_undated else [])
+
+
+@pytest.mark.parametrize("page_rows", [1, 4, 7, 50])
+@pytest.mark.parametrize("include_undated", [True, False])
+def test_query_page_walks_keyset_order(history_db, page_rows, include_undated):
+    page = make_page(history_db)
+    query = HistoryQuery(BASE_QUERY, (), (), "Id event", include_undated)
+    rows, seek, exhausted = [], None, False
+    for _ in range(100):
+        chunk, seek, exhausted = page._query_page(query, seek, page_rows)
+        assert len(chunk) <= page_rows
+        rows += chunk
+        if exhausted:
+            break
+    expected = reference(history_db, include_undated=include_undated)
+    assert [r["event_id"] for r in rows] == [r["event_id"] for r in expected]
+    # Strona zawsze pełna, dopóki są wiersze
+    assert exhausted
+
+
+def test_take_page_with_prefetch_and_filters(history_db, monkeypatch):
+    monkeypatch.setattr(history_page, "PREFETCH_ROWS", 6)
+    page = make_page(history_db)
+    page.query = HistoryQuery(BASE_QUERY, ("`Batch nr` LIKE %s",), ("%B1%",), "Id event", True)
+    rows = []
+    while True:
+        taken = page._take_page(4)
+        rows += taken
+        if len(taken) < 4:
+            break
+    # Filtr fragmentu numeru łapie także "XB12"
+    expected = reference(history_db, "`Batch nr` LIKE %s", ["%B1%"])
+    assert len(expected) == 40
+    assert [r["event_id"] for r in rows] == [r["event_id"] for r in expected]
+    assert page.exhausted and page.buffer == []
+
+
+def test_reset_discards_stale_prefetch(history_db):
+    page = make_page(history_db)
+    query = HistoryQuery(BASE_QUERY, (), (), "Id event", True)
+    generation = page.generation
+    page._reset_pages()
+    page._prefetch(generation, query, None, 10)
+    assert page.buffer == [] and page.seek is None
@@ -0,0 +1,90 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import wait_until
+from db_helper import MEASUREMENT_INSERT_COLUMNS, fetch_all
+from measurement_archiver import MeasurementArchiver, MeasurementChunk
+
+
+T0 = datetime.datetime(2026, 10, 1, 12, 0, 0)
+
+
+def make_columns(start, n, step=0.01):
+    """Partia kolumnowa jak z samples_to_columns() po dodaniu xCoord."""
+    i = np.arange(start, start + n)
+    return {
+        "timestamp": [T0 + datetime.timedelta(milliseconds=10 * int(k)) for k in i],
+        "xCoord": i * step,
+        "D1": 2.0 + 0.001 * i, "D2": 2.1 + 0.001 * i, "D3": 1.9 + 0.001 * i, "D4": 2.0 - 0.001 * i,
+        "speed": np.full(n, 1.0),
+        "lumps_delta": (i % 50 == 0).astype(np.int64),
+        "necks_delta": (i % 70 == 0).astype(np.int64),
+        "status_plc": np.zeros(n, dtype=np.int64),
+    }
+
+
+def test_chunk_rows_follow_insert_columns():
+    columns = make_columns(0, 10)
+    chunk = MeasurementChunk(6, "B1", "P1")
+    assert chunk.append(columns, 2, 8) == 6
+    assert chunk.full()
+    rows = chunk.rows_for_insert()
+    assert len(rows) == 6 and len(rows[0]) == len(MEASUREMENT_INSERT_COLUMNS)
+    by_name = dict(zip(MEASUREMENT_INSERT_COLUMNS, rows[0]))
+    assert by_name["`Date time`"] == columns["timestamp"][2]
+    assert by_name["`X-coordinate`"] == pytest.approx(0.02)
+    assert (by_name["`Batch nr`"], by_name["`Product nr`"]) == ("B1", "P1")
+    assert by_name["D4"] == pytest.approx(1.998)
+    # Typy Pythona (nie numpy) dla konektora
+    assert all(type(value) in (int, float, str, datetime.datetime) for value in rows[-1])
+
+
+def test_archiver_writes_samples_and_metre_rollup(sqlite_params):
+    n = 1000
+    archiver = MeasurementArchiver(sqlite_params, chunk_rows=128, flush_interval=0.05,
+                                   rows_per_insert=50, min_backoff=0.05)
+    try:
+        for start in range(0, n, 90):
+            archiver.add_columns(make_columns(start, min(90, n - start)), batch="B1", product="P1")
+    finally:
+        archiver.stop()
+    assert wait_until(lambda: archiver.stats()["pending_chunks"] == 0)
+    stats = archiver.stats()
+    assert stats["written_rows"] == n and stats["dropped_rows"] == 0
+
+    rows = fetch_all(sqlite_params, "SELECT `X-coordinate` AS x, D1 FROM measurement ORDER BY ID_Measurement")
+    assert len(rows) == n
+    assert [r["x"] for r in rows] == pytest.approx((np.arange(n) * 0.01).tolist())
+
+    columns = make_columns(0, n)
+    metres = np.floor(columns["xCoord"]).astype(int)
+    metre_rows = fetch_all(sqlite_params, "SELECT * FROM measurement_metre ORDER BY Metre")
+    assert [r["Metre"] for r in metre_rows] == sorted(set(metres.tolist()))
+    assert stats["written_metres"] == len(metre_rows)
+    for row in metre_rows:
+        inside = metres == row["Metre"]
+        d1 = columns["D1"][inside]
+        assert row["Samples"] == inside.sum()
+        assert row["D1 mean"] == pytest.approx(d1.mean())
+        assert (row["D1 min"], row["D1 max"]) == pytest.approx((d1.min(), d1.max()))
+        assert row["lumps number of"] == columns["lumps_delta"][inside].sum()
+        assert row["necks number of"] == columns["necks_delta"][inside].sum()
+        assert (row["Batch nr"], row["Product nr"]) == ("B1", "P1")
+        # Czas metru = czas jego ostatniej próbki
+        assert row["Date time"] == columns["timestamp"][np.flatnonzero(inside)[-1]]
+
+
+def test_batch_change_seals_chunk_and_metre(sqlite_params):
+    archiver = MeasurementArchiver(sqlite_params, chunk_rows=512, flush_interval=10.0, archive_raw=False)
+    try:
+        archiver.add_columns(make_columns(0, 150), batch="B1", product="P1")
+        archiver.add_columns(make_columns(150, 50), batch="B2", product="P1")
+    finally:
+        archiver.stop()
+    metre_rows = fetch_all(sqlite_params, "SELECT `Batch nr` AS batch, Metre, Samples FROM measurement_metre "
+                                          "ORDER BY ID_Metre")
+    assert [(r["batch"], r["Metre"], r["Samples"]) for r in metre_rows] == [
+        ("B1", 0, 100), ("B1", 1, 50), ("B2", 1, 50)]
+    assert fetch_all(sqlite_params, "SELECT COUNT(*) AS n FROM measurement")[0]["n"] == 0
@@ -34,6 +34,7 @@ class PlotManager:
         self.last_update_time = None
         self.plot_dirty = False
         self.fft_threshold = 500.0
+        self.fft_domain = "time"  # "time" – widmo w Hz, "distance" – widmo w cyklach na metr
         self.current_pulsation_vals = []
         
         self.analysis_queue = analysis_queue
@@ -161,6 +162,49 @@ class PlotManager:
             
 
 
+    def update_history_plots(self, history, current_x, batch_name, diameter_preset=0):
+        """
+        Rysuje wykresy defektów i średnicy dla całej partii na podstawie
+        zagregowanej historii (TieredHistory) zamiast surowego bufora próbek.
+
+        Args:
+            history: Słownik z FastAcquisitionBuffer.get_history()
+            current_x: Aktualna pozycja X
+            batch_name: Nazwa bieżącej partii
+            diameter_preset: Docelowa wartość średnicy
+        """
+        if not history or len(history.get('x', [])) == 0:
+            return
+        x_vals = history['x']
+        bucket_size = history['bucket_size']
+
+        plot_widget = self.plot_widgets.get('status')
+        if plot_widget is not None:
+            plot_widget.clear()
+            plot_widget.setTitle(f"Defekty na dystansie - cała partia ({bucket_size:g} m/słupek) - Batch: {batch_name}")
+            plot_widget.setLabel('bottom', "Dystans [m]")
+            plot_widget.setLabel('left', f"Defekty na {bucket_size:g} m")
+            width = bucket_size * 0.4
+            plot_widget.addItem(pg.BarGraphItem(x=x_vals - width / 2, height=history['lumps'], width=width, brush='r'))
+            plot_widget.addItem(pg.BarGraphItem(x=x_vals + width / 2, height=history['necks'], width=width, brush='b'))
+            plot_widget.setXRange(history['x_start'][0], current_x)
+
+        plot_widget = self.plot_widgets.get('diameter')
+        if plot_widget is not None:
+            plot_widget.clear()
+            plot_widget.setTitle(f"Średnica na dystansie - cała partia ({bucket_size:g} m/punkt), {current_x:.1f}m")
+            plot_widget.setLabel('bottom', "Dystans [m]")
+            plot_widget.setLabel('left', "Uśredniona Średnica [mm]")
+            # Min/max w kubełku jako przerywane linie, średnia jako linia ciągła
+            plot_widget.plot(x_vals, history['avg_min'], pen=pg.mkPen('c', style=Qt.DashLine), connect='finite')
+            plot_widget.plot(x_vals, history['avg_max'], pen=pg.mkPen('c', style=Qt.DashLine), connect='finite')
+            plot_widget.plot(x_vals, history['avg_mean'], pen='b', connect='finite')
+            if diameter_preset > 0:
+                plot_widget.addItem(pg.InfiniteLine(angle=0, pos=diameter_preset,
+                                                    pen=pg.mkPen('r', style=Qt.DashLine)))
+            plot_widget.enableAutoRange(axis=pg.ViewBox.YAxis, enable=True)
+            plot_widget.setXRange(history['x_start'][0], current_x)
+
     # def detect_peaks(self, freqs, amplitudes, threshold=None):
     #     """
     #     Wyszukuje lokalne maksima (piki) w wektorze amplitudes,
@@ -180,19 +224,33 @@ class PlotManager:
         plot_widget.clear()
         # print("[update_fft_plot] Received measurement_data keys:", list(measurement_data.keys()))
    
-        if measurement_data and "fft_freqs" in measurement_data and "fft_magnitude" in measurement_data:
-            fft_freqs = measurement_data["fft_freqs"]
-            fft_magnitude = measurement_data["fft_magnitude"]
-            sample_rate = 1 / data_processing_time if data_processing_time > 0 else 83.123
-            # title_text = f"Analiza FFT (fs: {sample_rate:.2f} Hz, Czas przetwarzania: {data_processing_time:.4f,} s), probki fft={len(fft_freqs)}"  
-            title_text = f"Analiza FFT (fs={sample_rate:.2f} Hz, Czas przetwarzania: {data_processing_time:.4f} s)"
+        # Klucze widma w wybranej domenie (czas: Hz, dystans: cykle/m)
+        if self.fft_domain == "distance" and measurement_data and "fft_freqs_spatial" in measurement_data:
+            freqs_key, magnitude_key, peaks_key = "fft_freqs_spatial", "fft_magnitude_spatial", "pulsation_vals_spatial"
+            sample_rate = measurement_data.get("samples_per_metre", 0.0)
+            unit = "1/m"
+        else:
+            freqs_key, magnitude_key, peaks_key = "fft_freqs", "fft_magnitude", "pulsation_vals"
+            if measurement_data and "pulsation_tracks" in measurement_data:
+                # Aktywne tory PeakTracker (z histerezą) zamiast surowych pików
+                peaks_key = "pulsation_tracks"
+            # Częstotliwość próbkowania z silnika widmowego (znaczniki czasu akwizycji)
+            sample_rate = (measurement_data or {}).get("sample_rate") or (
+                1 / data_processing_time if data_processing_time > 0 else 83.123)
+            unit = "Hz"
+
+        if measurement_data and freqs_key in measurement_data and magnitude_key in measurement_data:
+            fft_freqs = measurement_data[freqs_key]
+            fft_magnitude = measurement_data[magnitude_key]
+            title_text = f"Analiza FFT (fs={sample_rate:.2f} {'próbek/m' if unit == '1/m' else 'Hz'}, {len(fft_magnitude)} prążków)"
             plot_widget.setTitle(title_text)
+            plot_widget.setLabel('bottom', f"Częstotliwość [{unit}]")
             plot_widget.plot(fft_freqs, fft_magnitude, pen='m', name="FFT")
             threshold_line = pg.InfiniteLine(pos=self.fft_threshold, angle=0, pen='r')
             plot_widget.addItem(threshold_line)
             # Dodaj pionowe linie dla wykrytych pików
-            if "pulsation_vals" in measurement_data:
-                for (freq, amp) in measurement_data["pulsation_vals"]:
+            if peaks_key in measurement_data:
+                for (freq, amp) in measurement_data[peaks_key]:
                     vertical_line = pg.InfiniteLine(
                         pos=freq,
                         angle=90,
@@ -206,6 +264,50 @@ class PlotManager:
         else:
             plot_widget.setTitle("Trwa zbieranie danych do analizy FFT...")
 
+    def update_spectrogram_plot(self, spectrogram):
+        """
+        Rysuje spektrogram (wodospad) ostatnich widm w oknie FFT.
+        Jeden ImageItem jest tworzony raz i aktualizowany w miejscu; obraz
+        przeliczany jest tylko, gdy w magazynie pojawił się nowy wiersz.
+
+        Args:
+            spectrogram: SpectrogramStore z kontrolera
+        """
+        plot_widget = self.plot_widgets.get('fft')
+        if plot_widget is None:
+            return
+        item = getattr(self, '_spectrogram_item', None)
+        if item is None or item not in plot_widget.getPlotItem().items:
+            # Widok FFT czyści wykres – ponownie dodajemy obraz
+            plot_widget.clear()
+            item = pg.ImageItem()
+            item.setLookupTable(pg.colormap.get('viridis').getLookupTable())
+            plot_widget.addItem(item)
+            plot_widget.setLabel('bottom', "Częstotliwość [Hz]")
+            plot_widget.setLabel('left', "Widmo (najnowsze u góry)")
+            self._spectrogram_item = item
+            self._spectrogram_version = -1
+
+        if spectrogram.version == self._spectrogram_version:
+            return
+        snapshot = spectrogram.snapshot()
+        if snapshot is None:
+            plot_widget.setTitle("Trwa zbieranie danych do spektrogramu...")
+            return
+        image, times, f_max = snapshot
+        self._spectrogram_version = spectrogram.version
+
+        # Skala logarytmiczna, poziomy z percentyli – stabilne kolory mimo pojedynczych pików
+        image_db = 20.0 * np.log10(image + 1e-3)
+        low, high = np.percentile(image_db, (5, 99.5))
+        # ImageItem: pierwsza oś obrazu = X (częstotliwość), druga = Y (kolejne widma)
+        item.setImage(image_db.T, autoLevels=False, levels=(low, max(high, low + 1.0)))
+        item.setRect(pg.QtCore.QRectF(0.0, 0.0, f_max, image.shape[0]))
+        plot_widget.setXRange(0, f_max, padding=0)
+        plot_widget.setYRange(0, image.shape[0], padding=0)
+        span = times[-1] - times[0] if len(times) > 1 else 0.0
+        plot_widget.setTitle(f"Spektrogram - {image.shape[0]} widm, {span:.0f} s")
+
     def initialize_plots(self):
         # Configure each plot widget
         if self.plot_widgets['status']: